@@ -0,0 +1,92 @@
+# Compares the WSGI server (gunicorn app:app) with the async serving mode (asgi:application) on
+# the routes asgi.py serves natively. Start both against the same database, then e.g.:
+#   cd server && gunicorn -c gunicorn.conf.py app:app --bind 127.0.0.1:5000
+#   cd server && hypercorn asgi:application --bind 127.0.0.1:5001
+#   python benchmarks/bench_asgi_vs_flask.py --wsgi http://127.0.0.1:5000 --asgi http://127.0.0.1:5001 \
+#       --token <JWT from /api/users/login> --concurrency 16 64 256
+#
+# Pass --email/--password to include /api/users/login (bcrypt bound) in the run.
+import argparse
+import json
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def make_request(base_url, route, token, body):
+    headers = {"Authorization": f"Bearer {token}"}
+    data = None
+    if body is not None:
+        data = json.dumps(body).encode()
+        headers["Content-Type"] = "application/json"
+    req = urllib.request.Request(base_url + route, data=data, headers=headers)
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=30) as response:
+            response.read()
+        ok = True
+    except (urllib.error.URLError, OSError):
+        ok = False
+    return time.perf_counter() - start, ok
+
+def run(base_url, route, token, body, concurrency, seconds):
+    stop = time.monotonic() + seconds
+
+    def worker():
+        latencies, errors = [], 0
+        while time.monotonic() < stop:
+            elapsed, ok = make_request(base_url, route, token, body)
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors += 1
+        return latencies, errors
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: worker(), range(concurrency)))
+
+    latencies = sorted(l for worker_latencies, _ in results for l in worker_latencies)
+    errors = sum(e for _, e in results)
+    return {
+        "rps": len(latencies) / seconds,
+        "p50": percentile(latencies, 0.50) * 1000,
+        "p95": percentile(latencies, 0.95) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+        "errors": errors,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="WSGI vs ASGI throughput and latency")
+    parser.add_argument("--wsgi", required=True, help="Base URL of the gunicorn/Flask server")
+    parser.add_argument("--asgi", required=True, help="Base URL of the asgi:application server")
+    parser.add_argument("--token", required=True, help="Bearer token for the authenticated routes")
+    parser.add_argument("--post-id", type=int, default=1, help="Post whose comments are fetched (default 1)")
+    parser.add_argument("--email", help="Login email, enables the /api/users/login run")
+    parser.add_argument("--password", help="Login password")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    routes = [
+        ("/api/feed", None),
+        ("/api/profile", None),
+        (f"/api/posts/{args.post_id}/comments", None),
+    ]
+    if args.email and args.password:
+        routes.append(("/api/users/login", {"email": args.email, "password": args.password}))
+
+    print(f"{'route':<28} {'conc':>5} {'server':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for route, body in routes:
+        for concurrency in args.concurrency:
+            for name, base_url in (("wsgi", args.wsgi), ("asgi", args.asgi)):
+                r = run(base_url.rstrip("/"), route, args.token, body, concurrency, args.seconds)
+                print(f"{route:<28} {concurrency:>5} {name:>6} {r['rps']:>8.0f} {r['p50']:>8.1f} {r['p95']:>8.1f} {r['p99']:>8.1f} {r['errors']:>7}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# Load test for concurrent votes on a single poll option: the old single-row
+# "UPDATE PollOptions SET VoteCount = VoteCount + 1" against the sharded PollOptionCounterShards upsert.
+# Each vote is its own transaction, as in record_poll_vote, so the row lock is held through the commit.
+#
+# Needs a MySQL database with database/schema.sql loaded and the DB_* settings in server/.env:
+#   python benchmarks/bench_hot_option.py --threads 1 8 32 --seconds 10 --shards 16
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+# python-dotenv: https://pypi.org/project/python-dotenv/
+from dotenv import load_dotenv
+# (local module)
+import db_queries
+
+def setup_option():
+    conn = db_queries._connect()
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO Users (Username, Email, PasswordHash) VALUES (%s, %s, %s)",
+                   (f"bench{random.randrange(10**8)}", f"bench{random.randrange(10**8)}@example.com", "x"))
+    user_id = cursor.lastrowid
+    cursor.execute("INSERT INTO Posts (AuthorUserID, PostType, Title) VALUES (%s, 'Poll', 'Hot option benchmark')", (user_id,))
+    post_id = cursor.lastrowid
+    cursor.execute("INSERT INTO PollOptions (PostID, OptionText) VALUES (%s, 'Yes')", (post_id,))
+    option_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+    return user_id, post_id, option_id
+
+def teardown(user_id, post_id):
+    conn = db_queries._connect()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM Posts WHERE PostID = %s", (post_id,))
+    cursor.execute("DELETE FROM Users WHERE UserID = %s", (user_id,))
+    conn.commit()
+    conn.close()
+
+def run(mode, option_id, threads, seconds, shards):
+    stop = time.monotonic() + seconds
+    counts = [0] * threads
+
+    def worker(index):
+        conn = db_queries._connect()
+        cursor = conn.cursor(prepared=True)
+        while time.monotonic() < stop:
+            if mode == "single-row":
+                cursor.execute("UPDATE PollOptions SET VoteCount = VoteCount + 1 WHERE OptionID = %s", (option_id,))
+            else:
+                cursor.execute("""
+                    INSERT INTO PollOptionCounterShards (OptionID, Slot, VoteCount) VALUES (%s, %s, 1)
+                    ON DUPLICATE KEY UPDATE VoteCount = VoteCount + 1
+                """, (option_id, random.randrange(shards)))
+            conn.commit()
+            counts[index] += 1
+        cursor.close()
+        conn.close()
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return sum(counts) / seconds
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent vote throughput on one poll option")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--shards", type=int, default=16)
+    args = parser.parse_args()
+
+    load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server', '.env'))
+    user_id, post_id, option_id = setup_option()
+    try:
+        print(f"{'threads':>7} {'single-row votes/s':>19} {'sharded votes/s':>16} {'speedup':>8}")
+        for threads in args.threads:
+            single = run("single-row", option_id, threads, args.seconds, args.shards)
+            sharded = run("sharded", option_id, threads, args.seconds, args.shards)
+            print(f"{threads:>7} {single:>19.0f} {sharded:>16.0f} {sharded / single:>7.1f}x")
+    finally:
+        teardown(user_id, post_id)
+
+if __name__ == '__main__':
+    main()
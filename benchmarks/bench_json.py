@@ -0,0 +1,122 @@
+# Serialisation time and response size of a large feed payload: the stdlib json module as Flask's
+# default provider uses it against orjson (server/json_provider.py), raw and with gzip/brotli
+# (server/compression.py). The payload is synthetic but has the shape of GET /api/feed.
+#
+#   python benchmarks/bench_json.py --posts 10000 --repeat 5
+import argparse
+import datetime
+import decimal
+import email.utils
+import gzip
+import json
+import random
+import time
+
+try:
+    # orjson: https://github.com/ijl/orjson
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    # Brotli: https://pypi.org/project/Brotli/
+    import brotli
+except ImportError:
+    brotli = None
+
+POST_TYPES = ("Poll", "Announcement", "ForumTopic", "VoteItem")
+
+def http_date(value):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return email.utils.format_datetime(value, usegmt=True)
+
+def make_feed(posts, seed=1):
+    rng = random.Random(seed)
+    start = datetime.datetime(2025, 1, 1)
+    feed = []
+    for post_id in range(posts, 0, -1):
+        post_type = rng.choice(POST_TYPES)
+        post = {
+            "PostID": post_id,
+            "Title": f"Post title number {post_id} about the local council",
+            "Content": None if post_type in ("Poll", "VoteItem") else "Some text about the topic. " * rng.randint(1, 10),
+            "PostType": post_type,
+            "AllowComments": True,
+            "CreationTimestamp": start + datetime.timedelta(seconds=post_id * 37),
+            "AuthorUsername": f"user{rng.randint(1, 5000)}",
+            "CommentCount": rng.randint(0, 200),
+            "userHasVoted": rng.random() < 0.3,
+            "priority": False,
+        }
+        if post_type == "Poll":
+            post["Options"] = [
+                {"OptionID": post_id * 10 + i, "OptionText": f"Option {i}", "VoteCount": rng.randint(0, 10000)}
+                for i in range(rng.randint(2, 5))
+            ]
+        if post_type == "VoteItem":
+            post["VoteCounts"] = {"For": rng.randint(0, 5000), "Against": rng.randint(0, 5000), "Abstain": rng.randint(0, 500)}
+        feed.append(post)
+    return {"posts": feed, "next_cursor": "MjAyNS0wMS0wMVQwMDowMDowMHwx"}
+
+# Same output as Flask's DefaultJSONProvider: sorted keys, compact separators, HTTP dates
+def stdlib_default(value):
+    if isinstance(value, datetime.date):
+        return http_date(value)
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    raise TypeError(type(value).__name__)
+
+def dumps_stdlib(obj):
+    return (json.dumps(obj, default=stdlib_default, sort_keys=True, separators=(",", ":")) + "\n").encode("utf-8")
+
+def dumps_orjson(obj):
+    options = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+    return orjson.dumps(obj, default=stdlib_default, option=options) + b"\n"
+
+def timed(func, arg, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Feed payload serialisation and compression")
+    parser.add_argument("--posts", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement, the best is reported")
+    args = parser.parse_args()
+
+    feed = make_feed(args.posts)
+    serializers = [("json", dumps_stdlib)]
+    if orjson is not None:
+        serializers.append(("orjson", dumps_orjson))
+    else:
+        print("orjson is not installed, only the stdlib serializer is measured")
+
+    print(f"{args.posts} posts")
+    print(f"{'serializer':<10} {'dump ms':>9} {'bytes':>10}")
+    body = None
+    for name, func in serializers:
+        data, ms = timed(func, feed, args.repeat)
+        if body is not None and data != body:
+            print("warning: serializers produced different output")
+        body = data
+        print(f"{name:<10} {ms:>9.1f} {len(data):>10}")
+
+    encoders = [("gzip-6", lambda data: gzip.compress(data, compresslevel=6))]
+    if brotli is not None:
+        encoders.append(("br-4", lambda data: brotli.compress(data, quality=4)))
+    else:
+        print("brotli is not installed, only gzip is measured")
+
+    print(f"\n{'encoding':<10} {'encode ms':>9} {'bytes':>10} {'ratio':>7}")
+    print(f"{'identity':<10} {0:>9.1f} {len(body):>10} {1:>7.2f}")
+    for name, func in encoders:
+        data, ms = timed(func, body, args.repeat)
+        print(f"{name:<10} {ms:>9.1f} {len(data):>10} {len(body) / len(data):>7.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# Per-query latency with a fresh prepared cursor per call (prepare, execute, deallocate, as every
+# db_queries function used to do) against the per-connection StatementCache from server/statements.py
+# (prepare once, then execute only). Runs a few of the statements the API sends most often on one
+# connection and also reports how many statements the server had to prepare.
+#
+# Needs a database with some data in it, e.g. from datagen.py, and the DB_* settings in server/.env:
+#   python benchmarks/bench_statement_cache.py --iterations 5000
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+# python-dotenv: https://pypi.org/project/python-dotenv/
+from dotenv import load_dotenv
+# (local modules)
+import db_queries
+from statements import StatementCache, StatementCursor
+
+def queries(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT MAX(UserID) FROM Users")
+    user_id = cursor.fetchone()[0]
+    cursor.execute("SELECT PostID FROM Posts WHERE AllowComments ORDER BY CommentCount DESC LIMIT 1")
+    post_id = cursor.fetchone()[0]
+    cursor.close()
+    if user_id is None or post_id is None:
+        raise SystemExit("The database is empty, load it with benchmarks/datagen.py first")
+    return {
+        "profile": ("SELECT UserID, Username, Email, Role, RegistrationTimestamp FROM Users WHERE UserID = %s", (user_id,)),
+        "allow_comments": ("SELECT AllowComments FROM Posts WHERE PostID = %s", (post_id,)),
+        "comments_page": db_queries._comments_query(post_id, None, 25),
+        "feed_page": db_queries._feed_page_query(None, 20),
+    }
+
+def prepares(conn):
+    cursor = conn.cursor()
+    cursor.execute("SHOW SESSION STATUS LIKE 'Com_stmt_prepare'")
+    count = int(cursor.fetchone()[1])
+    cursor.close()
+    return count
+
+def run(conn, sql, params, iterations, cached):
+    cache = StatementCache(conn, 64)
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        if cached:
+            cursor = StatementCursor(cache)
+        else:
+            cursor = conn.cursor(prepared=True)
+        cursor.execute(sql, params)
+        cursor.fetchall()
+        cursor.close()
+        latencies.append(time.perf_counter() - started)
+    cache.close()
+    latencies.sort()
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description="Prepared statement cache microbenchmark")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server', '.env'))
+    conn = db_queries._connect()
+    print(f"{'query':<15} {'mode':<9} {'mean us':>9} {'p50 us':>9} {'p95 us':>9} {'prepares':>9}")
+    for name, (sql, params) in queries(conn).items():
+        for cached in (False, True):
+            before = prepares(conn)
+            latencies = run(conn, sql, params, args.iterations, cached)
+            prepared = prepares(conn) - before
+            mean = sum(latencies) / len(latencies)
+            p50 = latencies[len(latencies) // 2]
+            p95 = latencies[int(len(latencies) * 0.95)]
+            print(f"{name:<15} {'cached' if cached else 'uncached':<9} {mean * 1e6:>9.0f} {p50 * 1e6:>9.0f} {p95 * 1e6:>9.0f} {prepared:>9}")
+    conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# Compares the cost of building the feed's vote state when every unvoted VoteItem gets a signed
+# JWT on every feed load (old behaviour) against the requiresVoteToken flag plus one token per
+# item the user actually opens (POST /api/posts/<id>/vote-token).
+#
+#   python benchmarks/bench_vote_tokens.py --items 100 200 500 --opened 3
+#
+# PyJWT: https://pyjwt.readthedocs.io/
+import argparse
+import datetime
+import os
+import statistics
+import time
+
+import jwt
+
+SECRET_KEY = "benchmark-secret-key-of-a-realistic-length-0123456789"
+
+def make_posts(n_items):
+    return [{"PostID": post_id, "PostType": "VoteItem"} for post_id in range(1, n_items + 1)]
+
+def sign_vote_token(user_id, post_id, secret_key):
+    payload = {
+        'user_id': user_id,
+        'post_id': post_id,
+        'purpose': 'item_vote',
+        'exp': datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=5),
+    }
+    return jwt.encode(payload, secret_key, algorithm="HS256")
+
+# Old feed: one signature per unvoted item, and the secret re-read from the environment each time
+def eager_feed(posts, user_id):
+    for post in posts:
+        post['voteAuthToken'] = sign_vote_token(user_id, post['PostID'], os.getenv('SECRET_KEY'))
+        post['priority'] = True
+
+# New feed: a flag per item, tokens only for the items the user opens
+def lazy_feed(posts, user_id, opened):
+    for post in posts:
+        post['requiresVoteToken'] = True
+        post['priority'] = True
+    for post in posts[:opened]:
+        sign_vote_token(user_id, post['PostID'], SECRET_KEY)
+
+def time_runs(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), max(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description="Eager vs lazy VoteItem token issuance")
+    parser.add_argument("--items", type=int, nargs="+", default=[100, 250, 500, 1000], help="Open VoteItems in the feed")
+    parser.add_argument("--opened", type=int, default=3, help="Items the user opens per feed load")
+    parser.add_argument("--repeat", type=int, default=50, help="Feed loads per measurement")
+    args = parser.parse_args()
+
+    os.environ.setdefault('SECRET_KEY', SECRET_KEY)
+
+    print(f"{'items':>6} {'eager median ms':>16} {'lazy median ms':>15} {'speedup':>8}")
+    for n_items in args.items:
+        eager_median, _ = time_runs(lambda: eager_feed(make_posts(n_items), 1), args.repeat)
+        lazy_median, _ = time_runs(lambda: lazy_feed(make_posts(n_items), 1, args.opened), args.repeat)
+        speedup = eager_median / lazy_median if lazy_median else float('inf')
+        print(f"{n_items:>6} {eager_median:>16.3f} {lazy_median:>15.3f} {speedup:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
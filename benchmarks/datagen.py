@@ -0,0 +1,193 @@
+# Fills a benchmark database with synthetic Users, Posts, PollOptions, PollVotes, ItemVotes and
+# Comments, then brings the denormalised counters (PollOptions.VoteCount, VoteItemTallies,
+# Posts.CommentCount) in line with them. The same --seed gives the same data.
+#
+# Meant for an empty database such as the one in benchmarks/docker-compose.yml, with the DB_*
+# settings in server/.env. Every user gets the password given by --password, so loadtest.py can
+# log in as any of them:
+#   python benchmarks/datagen.py --users 100000 --posts 20000 --votes 1000000 --comments 200000
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+# bcrypt: https://pypi.org/project/bcrypt/
+import bcrypt
+# python-dotenv: https://pypi.org/project/python-dotenv/
+from dotenv import load_dotenv
+# (local module)
+import db_queries
+
+POST_TYPES = (("Poll", 0.4), ("Announcement", 0.15), ("ForumTopic", 0.3), ("VoteItem", 0.15))
+ITEM_VOTE_CHOICES = ("For", "Against", "Abstain")
+WORDS = (
+    "council budget park library school road transport housing recycling water energy festival "
+    "parking tax community safety cycling bus museum hospital garden river bridge election youth "
+    "sports centre market planning noise lighting waste climate heritage volunteer playground"
+).split()
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+class Loader:
+    def __init__(self, batch_size):
+        self.conn = db_queries._connect()
+        self.cursor = self.conn.cursor()
+        self.batch_size = batch_size
+
+    # Inserts rows from an iterable in committed batches, reports rows/s when done
+    def insert(self, table, columns, rows):
+        started = time.perf_counter()
+        total = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                total += self._flush(table, columns, batch)
+                batch = []
+        if batch:
+            total += self._flush(table, columns, batch)
+        elapsed = time.perf_counter() - started
+        print(f"{table:<14} {total:>10} rows {elapsed:>8.1f} s {total / elapsed if elapsed else 0:>10.0f} rows/s")
+        return total
+
+    def _flush(self, table, columns, batch):
+        inserted = db_queries._bulk_insert(self.cursor, table, columns, batch, chunk_size=self.batch_size)
+        self.conn.commit()
+        return inserted
+
+    def query(self, sql, params=()):
+        self.cursor.execute(sql, params)
+        return self.cursor.fetchall()
+
+    def execute(self, sql, params=()):
+        started = time.perf_counter()
+        self.cursor.execute(sql, params)
+        self.conn.commit()
+        return time.perf_counter() - started
+
+    def close(self):
+        self.cursor.close()
+        self.conn.close()
+
+def generate(args):
+    rng = random.Random(args.seed)
+    loader = Loader(args.batch_size)
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None, microsecond=0)
+    start = now - datetime.timedelta(days=args.days)
+    span = int((now - start).total_seconds())
+
+    # One hash for everybody: hashing 100k passwords would take longer than the whole load
+    password_hash = bcrypt.hashpw(args.password.encode('utf-8'), bcrypt.gensalt(args.bcrypt_rounds))
+
+    first_user = loader.query("SELECT COALESCE(MAX(UserID), 0) FROM Users")[0][0]
+    loader.insert("Users", ("Username", "Email", "PasswordHash", "RegistrationTimestamp"), (
+        (f"{args.prefix}{i}", f"{args.prefix}{i}@example.com", password_hash,
+         start + datetime.timedelta(seconds=rng.randrange(span)))
+        for i in range(1, args.users + 1)
+    ))
+    user_ids = [row[0] for row in loader.query("SELECT UserID FROM Users WHERE UserID > %s", (first_user,))]
+
+    first_post = loader.query("SELECT COALESCE(MAX(PostID), 0) FROM Posts")[0][0]
+    types = [name for name, _ in POST_TYPES]
+    weights = [weight for _, weight in POST_TYPES]
+
+    def posts():
+        for _ in range(args.posts):
+            post_type = rng.choices(types, weights)[0]
+            content = None if post_type in ("Poll", "VoteItem") else sentence(rng, rng.randint(10, 60))
+            yield (rng.choice(user_ids), post_type, sentence(rng, rng.randint(3, 10)), content,
+                   rng.random() > 0.1, start + datetime.timedelta(seconds=rng.randrange(span)))
+
+    loader.insert("Posts", ("AuthorUserID", "PostType", "Title", "Content", "AllowComments", "CreationTimestamp"), posts())
+    post_rows = loader.query("SELECT PostID, PostType, AllowComments FROM Posts WHERE PostID > %s", (first_post,))
+    poll_ids = [post_id for post_id, post_type, _ in post_rows if post_type == "Poll"]
+    item_ids = [post_id for post_id, post_type, _ in post_rows if post_type == "VoteItem"]
+    commentable_ids = [post_id for post_id, _, allow_comments in post_rows if allow_comments]
+
+    loader.insert("PollOptions", ("PostID", "OptionText"), (
+        (post_id, sentence(rng, rng.randint(1, 4)))
+        for post_id in poll_ids for _ in range(rng.randint(2, 5))
+    ))
+    options_by_poll = {}
+    for post_id, option_id in loader.query(
+            "SELECT PostID, OptionID FROM PollOptions WHERE PostID > %s", (first_post,)):
+        options_by_poll.setdefault(post_id, []).append(option_id)
+
+    # One vote per user and post, as the UNIQUE keys demand
+    def votes(post_ids, count, make_row):
+        if not post_ids:
+            return
+        count = min(count, len(post_ids) * len(user_ids))
+        seen = set()
+        while len(seen) < count:
+            user_id, post_id = rng.choice(user_ids), rng.choice(post_ids)
+            key = user_id * (first_post + args.posts + 1) + post_id
+            if key in seen:
+                continue
+            seen.add(key)
+            yield make_row(user_id, post_id)
+
+    poll_votes = int(args.votes * args.poll_vote_share)
+    loader.insert("PollVotes", ("UserID", "PostID", "OptionID"), votes(
+        poll_ids, poll_votes, lambda user_id, post_id: (user_id, post_id, rng.choice(options_by_poll[post_id]))))
+    loader.insert("ItemVotes", ("UserID", "PostID", "VoteType"), votes(
+        item_ids, args.votes - poll_votes, lambda user_id, post_id: (user_id, post_id, rng.choice(ITEM_VOTE_CHOICES))))
+
+    # Half the comments go to the hottest 1% of threads, the rest are spread over all of them
+    if commentable_ids:
+        hot_ids = commentable_ids[:max(1, len(commentable_ids) // 100)]
+        loader.insert("Comments", ("PostID", "UserID", "Content", "Timestamp"), (
+            (rng.choice(hot_ids if rng.random() < 0.5 else commentable_ids), rng.choice(user_ids),
+             sentence(rng, rng.randint(4, 40)), start + datetime.timedelta(seconds=rng.randrange(span)))
+            for _ in range(args.comments)
+        ))
+
+    # Counters the server normally maintains on every write
+    elapsed = loader.execute("""
+        UPDATE PollOptions po
+        JOIN (SELECT OptionID, COUNT(*) AS Votes FROM PollVotes WHERE PostID > %s GROUP BY OptionID) v
+          ON v.OptionID = po.OptionID
+        SET po.VoteCount = v.Votes
+    """, (first_post,))
+    print(f"{'VoteCount':<14} {elapsed:>25.1f} s")
+    elapsed = loader.execute("""
+        INSERT INTO VoteItemTallies (PostID, ForCount, AgainstCount, AbstainCount)
+        SELECT PostID, SUM(VoteType = 'For'), SUM(VoteType = 'Against'), SUM(VoteType = 'Abstain')
+        FROM ItemVotes
+        WHERE PostID > %s
+        GROUP BY PostID
+        ON DUPLICATE KEY UPDATE ForCount = VALUES(ForCount), AgainstCount = VALUES(AgainstCount),
+                                AbstainCount = VALUES(AbstainCount)
+    """, (first_post,))
+    print(f"{'VoteItemTallies':<14} {elapsed:>25.1f} s")
+    loader.close()
+
+    started = time.perf_counter()
+    db_queries.reconcile_comment_counts()
+    print(f"{'CommentCount':<14} {time.perf_counter() - started:>25.1f} s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic benchmark data")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--posts", type=int, default=5000)
+    parser.add_argument("--votes", type=int, default=100000, help="Poll and item votes together")
+    parser.add_argument("--poll-vote-share", type=float, default=0.7)
+    parser.add_argument("--comments", type=int, default=50000)
+    parser.add_argument("--days", type=int, default=365, help="Timestamps spread over this many days back")
+    parser.add_argument("--prefix", default="load", help="Username/email prefix, pick another one to load again")
+    parser.add_argument("--password", default="loadtest-password")
+    parser.add_argument("--bcrypt-rounds", type=int, default=int(os.getenv('BCRYPT_ROUNDS', 12)))
+    parser.add_argument("--batch-size", type=int, default=2000, help="Rows per INSERT and transaction")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server', '.env'))
+    generate(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+# Load driver for a running server (gunicorn app:app or asgi:application) on data from datagen.py.
+# Every virtual user logs in as one of the generated users, then loops over a weighted mix of
+# requests, following what the feed returned the way the client does: paging on, opening threads,
+# voting on polls and vote items it has not voted on, commenting and searching.
+#
+#   python benchmarks/loadtest.py --base-url http://127.0.0.1:5000 --users 200 --seconds 60
+#   python benchmarks/loadtest.py ... --save baseline.json
+#   python benchmarks/loadtest.py ... --compare baseline.json --max-regression 0.2
+#
+# Per route it reports requests/s, p50/p95/p99 latency and errors. With --compare the run fails
+# (exit code 1) when a route's p95 got more than --max-regression slower or its error rate grew.
+# 429s from the write budgets (server/ratelimit.py) count as errors: run the server with
+# RATE_LIMIT_ENABLED=false to measure without them. All virtual users come from one address, so
+# leave RATE_LIMIT_BY_IP and TRUSTED_PROXY_HOPS unset unless that is what is being measured.
+#
+# --streams N keeps N live feed streams (/api/feed/stream) open for the whole run, e.g.
+#   python benchmarks/loadtest.py --base-url http://127.0.0.1:5001 --users 50 --streams 500
+# An open stream must not hold up other requests: with streams open the write routes should keep
+# their latency, and every stream should receive their events. Afterwards it reports how many
+# streams stayed open and the events they received.
+import argparse
+import gzip
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+DEFAULT_MIX = "feed=40,feed_next=10,comments=15,vote=10,item_vote=5,comment=5,search=10,login=5"
+SEARCH_WORDS = ("council", "budget", "park", "library", "transport", "housing", "recycling", "festival")
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, route, elapsed, ok):
+        with self._lock:
+            self.latencies.setdefault(route, []).append(elapsed)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self.latencies.clear()
+            self.errors.clear()
+
+    def summary(self, seconds):
+        summary = {}
+        with self._lock:
+            for route, latencies in self.latencies.items():
+                latencies = sorted(latencies)
+                summary[route] = {
+                    "requests": len(latencies),
+                    "rps": len(latencies) / seconds,
+                    "p50_ms": percentile(latencies, 0.50) * 1000,
+                    "p95_ms": percentile(latencies, 0.95) * 1000,
+                    "p99_ms": percentile(latencies, 0.99) * 1000,
+                    "errors": self.errors.get(route, 0),
+                }
+        return summary
+
+class VirtualUser:
+    def __init__(self, base_url, email, password, stats, rng):
+        self.base_url = base_url
+        self.email = email
+        self.password = password
+        self.stats = stats
+        self.rng = rng
+        self.token = None
+        self.next_cursor = None
+        self.polls = {}
+        self.vote_items = []
+        self.threads = []
+
+    # Sends one request, returns (status, parsed body or None). 4xx answers the driver provoked on
+    # purpose (already voted) are passed in expected and not counted as errors.
+    def request(self, route, method, path, body=None, expected=()):
+        headers = {"Accept-Encoding": "gzip"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        started = time.perf_counter()
+        status, payload = None, None
+        try:
+            with urllib.request.urlopen(req, timeout=30) as response:
+                status = response.status
+                raw = response.read()
+                if response.headers.get("Content-Encoding") == "gzip":
+                    raw = gzip.decompress(raw)
+                payload = json.loads(raw) if raw else None
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except (urllib.error.URLError, OSError, ValueError):
+            pass
+        elapsed = time.perf_counter() - started
+        ok = status is not None and (status < 400 or status in expected)
+        self.stats.record(route, elapsed, ok)
+        return status, payload
+
+    def login(self):
+        status, payload = self.request("login", "POST", "/api/users/login", {"email": self.email, "password": self.password})
+        if status == 200:
+            self.token = payload["token"]
+        return status == 200
+
+    def remember(self, posts):
+        for post in posts:
+            if post["PostType"] == "Poll" and not post.get("userHasVoted") and post.get("Options"):
+                self.polls[post["PostID"]] = [option["OptionID"] for option in post["Options"]]
+            elif post["PostType"] == "VoteItem" and not post.get("userHasVoted"):
+                self.vote_items.append(post["PostID"])
+            if post.get("AllowComments"):
+                self.threads.append(post["PostID"])
+        del self.threads[:-200]
+
+    def feed(self, cursor=None):
+        path = "/api/feed?include=comments"
+        if cursor:
+            path += "&cursor=" + urllib.parse.quote(cursor)
+        status, payload = self.request("feed_next" if cursor else "feed", "GET", path)
+        if status == 200:
+            self.remember(payload["posts"])
+            self.next_cursor = payload["next_cursor"]
+
+    def feed_next(self):
+        if self.next_cursor:
+            self.feed(self.next_cursor)
+        else:
+            self.feed()
+
+    def comments(self):
+        if self.threads:
+            self.request("comments", "GET", f"/api/posts/{self.rng.choice(self.threads)}/comments")
+
+    def vote(self):
+        if self.polls:
+            post_id = self.rng.choice(list(self.polls))
+            options = self.polls.pop(post_id)
+            self.request("vote", "POST", "/api/vote", {"PostId": post_id, "OptionId": self.rng.choice(options)}, expected=(409,))
+
+    def item_vote(self):
+        if not self.vote_items:
+            return
+        post_id = self.vote_items.pop()
+        status, payload = self.request("vote_token", "POST", f"/api/posts/{post_id}/vote-token", expected=(409,))
+        if status == 200:
+            self.request("item_vote", "POST", "/api/item-votes", {
+                "PostId": post_id,
+                "Choice": self.rng.choice(("For", "Against", "Abstain")),
+                "AuthToken": payload["voteAuthToken"],
+            }, expected=(409,))
+
+    def comment(self):
+        if self.threads:
+            self.request("comment", "POST", "/api/comments", {
+                "postId": self.rng.choice(self.threads),
+                "content": f"Load test comment {self.rng.randrange(10**6)}",
+            })
+
+    def search(self):
+        self.request("search", "GET", "/api/search?q=" + urllib.parse.quote(self.rng.choice(SEARCH_WORDS)))
+
+class StreamListener:
+    def __init__(self, base_url, token):
+        self.base_url = base_url
+        self.token = token
+        self.connected = False
+        self.dropped = False
+        self.events = 0
+
+    def listen(self, stop):
+        path = "/api/feed/stream?access_token=" + urllib.parse.quote(self.token)
+        try:
+            # Heartbeats arrive every FEED_STREAM_HEARTBEAT seconds, so reads never wait long
+            with urllib.request.urlopen(self.base_url + path, timeout=60) as response:
+                self.connected = True
+                while time.monotonic() < stop:
+                    line = response.readline()
+                    if not line:
+                        break
+                    if line.startswith(b"event:"):
+                        self.events += 1
+        except (urllib.error.URLError, OSError):
+            pass
+        self.dropped = time.monotonic() < stop
+
+def open_streams(args, stop):
+    listeners = []
+    for index in range(args.streams):
+        user = VirtualUser(args.base_url.rstrip("/"), f"{args.prefix}{index % args.user_count + 1}@example.com", args.password, Stats(), random.Random())
+        if not user.login():
+            continue
+        listener = StreamListener(user.base_url, user.token)
+        threading.Thread(target=listener.listen, args=(stop,), daemon=True).start()
+        listeners.append(listener)
+    return listeners
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, weight = part.split("=")
+        weights[name.strip()] = float(weight)
+    return weights
+
+def run(args):
+    mix = parse_mix(args.mix)
+    actions = list(mix)
+    weights = [mix[action] for action in actions]
+    stats = Stats()
+    stop = time.monotonic() + args.ramp_up + args.seconds
+    measure_from = time.monotonic() + args.ramp_up
+
+    def worker(index):
+        rng = random.Random(args.seed * 100003 + index)
+        user_number = rng.randint(1, args.user_count)
+        user = VirtualUser(args.base_url.rstrip("/"), f"{args.prefix}{user_number}@example.com", args.password, stats, rng)
+        if not user.login():
+            return
+        user.feed()
+        while time.monotonic() < stop:
+            action = rng.choices(actions, weights)[0]
+            if action == "login":
+                user.login()
+            else:
+                getattr(user, action)()
+            if args.think_time:
+                time.sleep(rng.expovariate(1 / args.think_time))
+
+    listeners = open_streams(args, stop)
+    # Requests made while ramping up (logins, first feeds) are not part of the results
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(args.users)]
+    for thread in threads:
+        thread.start()
+    time.sleep(max(0, measure_from - time.monotonic()))
+    stats.reset()
+    for thread in threads:
+        thread.join()
+    return stats.summary(args.seconds), listeners
+
+def report(summary, listeners):
+    print(f"{'route':<12} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for route in sorted(summary):
+        r = summary[route]
+        print(f"{route:<12} {r['requests']:>9} {r['rps']:>8.1f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['errors']:>7}")
+    if listeners:
+        connected = [listener for listener in listeners if listener.connected]
+        dropped = sum(listener.dropped for listener in connected)
+        received = sorted(listener.events for listener in connected)
+        print(f"\nstreams: {len(connected)} of {len(listeners)} connected, {dropped} dropped early, "
+              f"events per stream min {received[0] if received else 0} / max {received[-1] if received else 0}")
+
+# Returns the list of regressions against a saved baseline
+def compare(summary, baseline, max_regression):
+    regressions = []
+    for route, base in baseline.items():
+        current = summary.get(route)
+        if current is None or not base["requests"]:
+            continue
+        if current["p95_ms"] > base["p95_ms"] * (1 + max_regression):
+            regressions.append(f"{route}: p95 {base['p95_ms']:.1f} ms -> {current['p95_ms']:.1f} ms")
+        base_error_rate = base["errors"] / base["requests"]
+        error_rate = current["errors"] / current["requests"] if current["requests"] else 0
+        if error_rate > base_error_rate + 0.01:
+            regressions.append(f"{route}: error rate {base_error_rate:.1%} -> {error_rate:.1%}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Mixed traffic load test with per-route latency")
+    parser.add_argument("--base-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--users", type=int, default=50, help="Concurrent virtual users")
+    parser.add_argument("--seconds", type=float, default=60, help="Measured duration")
+    parser.add_argument("--ramp-up", type=float, default=10, help="Unmeasured warm-up before it")
+    parser.add_argument("--think-time", type=float, default=0, help="Mean pause between a user's requests (s)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Action weights (default {DEFAULT_MIX})")
+    parser.add_argument("--user-count", type=int, default=10000, help="Users created by datagen.py --users")
+    parser.add_argument("--prefix", default="load", help="datagen.py --prefix")
+    parser.add_argument("--password", default="loadtest-password", help="datagen.py --password")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--streams", type=int, default=0, help="Live feed streams held open during the run")
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Baseline JSON file from an earlier --save")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed p95 slowdown (default 0.2 = 20%%)")
+    args = parser.parse_args()
+
+    summary, listeners = run(args)
+    report(summary, listeners)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(summary, json.load(f), args.max_regression)
+        if regressions:
+            print("\nRegressions against " + args.compare)
+            for regression in regressions:
+                print("  " + regression)
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -11,7 +11,11 @@ document.addEventListener("DOMContentLoaded", () => {
         return;
     }
 
+    // Posts currently on the page, so live updates can adjust their counts
+    const postsById = {};
+
     function createPostCard(post) {
+        postsById[post.PostID] = post;
         const card = document.createElement("div");
         card.className = "post-card";
         card.dataset.postId = post.PostID;
@@ -68,6 +72,8 @@ document.addEventListener("DOMContentLoaded", () => {
 
             const voteCount = document.createElement("span");
             voteCount.className = "vote-count";
+            voteCount.id = `vote-count-${option.OptionID}`;
+            voteCount.dataset.count = option.VoteCount;
             voteCount.textContent = `(${option.VoteCount} votes)`;
 
             optionContainer.appendChild(radioInput);
@@ -92,11 +98,16 @@ document.addEventListener("DOMContentLoaded", () => {
         form.appendChild(submitButton);
         form.appendChild(voteMessage);
 
-        if (post.userHasVoted) {
+        if (post.userHasVoted || post.Archived) {
             form.querySelectorAll('input[type="radio"]').forEach(
                 (input) => (input.disabled = true),
             );
         }
+        // Archived posts are read-only
+        if (post.Archived && !post.userHasVoted) {
+            submitButton.disabled = true;
+            submitButton.textContent = "Voting closed";
+        }
 
         return form;
     }
@@ -121,8 +132,17 @@ document.addEventListener("DOMContentLoaded", () => {
         const form = document.createElement("form");
         form.className = "item-vote-options";
 
-        if (post.voteAuthToken) {
-            form.dataset.voteAuthToken = post.voteAuthToken;
+        // The vote token is requested when the user starts voting, not with the feed
+        if (post.requiresVoteToken) {
+            form.addEventListener(
+                "change",
+                () => {
+                    if (!form.dataset.voteAuthToken) {
+                        fetchVoteToken(post.PostID, form);
+                    }
+                },
+                { once: true },
+            );
         }
 
         const contentText = document.createElement("p");
@@ -142,10 +162,12 @@ document.addEventListener("DOMContentLoaded", () => {
 
             const label = document.createElement("label");
             label.htmlFor = radioInput.id;
+            label.id = `item-vote-label-${post.PostID}-${voteType}`;
 
             const voteCount = post.VoteCounts
                 ? post.VoteCounts[voteType] || 0
                 : 0;
+            label.dataset.count = voteCount;
             label.textContent = `${voteType} (${voteCount} votes)`;
 
             optionContainer.appendChild(radioInput);
@@ -174,6 +196,12 @@ document.addEventListener("DOMContentLoaded", () => {
             });
             submitButton.disabled = true;
             submitButton.textContent = "Voted!";
+        } else if (post.Archived) {
+            form.querySelectorAll('input[type="radio"]').forEach(
+                (input) => (input.disabled = true),
+            );
+            submitButton.disabled = true;
+            submitButton.textContent = "Voting closed";
         }
         return form;
     }
@@ -194,7 +222,7 @@ document.addEventListener("DOMContentLoaded", () => {
         const commentsContainer = document.createElement("div");
         commentsContainer.className = "comments-container";
         commentsContainer.style.display = "none"; // Hidden by default
-        commentsContainer.dataset.loadedPages = 0;
+        commentsContainer.dataset.loaded = "false";
         commentsContainer.dataset.postId = post.PostID;
 
         const list = document.createElement("div");
@@ -218,6 +246,12 @@ document.addEventListener("DOMContentLoaded", () => {
         commentsContainer.appendChild(loadMoreBtn);
         commentsContainer.appendChild(form);
 
+        // Embedded by /api/feed?include=comments
+        if (post.Comments) {
+            renderComments(post.Comments, list, loadMoreBtn);
+            commentsContainer.dataset.loaded = "true";
+        }
+
         toggleBtn.addEventListener("click", () => {
             if (commentsContainer.style.display === "none") {
                 commentsContainer.style.display = "block";
@@ -226,9 +260,10 @@ document.addEventListener("DOMContentLoaded", () => {
 
                 if (
                     post.CommentCount > 0 &&
-                    commentsContainer.dataset.loadedPages === "0"
+                    commentsContainer.dataset.loaded === "false"
                 ) {
-                    fetchComments(post.PostID, 1, list, loadMoreBtn);
+                    commentsContainer.dataset.loaded = "true";
+                    fetchComments(post.PostID, null, list, loadMoreBtn);
                 }
             } else {
                 commentsContainer.style.display = "none";
@@ -241,9 +276,12 @@ document.addEventListener("DOMContentLoaded", () => {
         });
 
         loadMoreBtn.addEventListener("click", () => {
-            const nextPage =
-                parseInt(commentsContainer.dataset.loadedPages) + 1;
-            fetchComments(post.PostID, nextPage, list, loadMoreBtn);
+            fetchComments(
+                post.PostID,
+                loadMoreBtn.dataset.nextCursor,
+                list,
+                loadMoreBtn,
+            );
         });
 
         section.appendChild(toggleBtn);
@@ -251,11 +289,58 @@ document.addEventListener("DOMContentLoaded", () => {
         return section;
     }
 
-    async function fetchComments(postId, page, listElement, loadMoreBtn) {
+    async function fetchVoteToken(postId, form) {
+        try {
+            const response = await fetch(
+                `http://localhost:5000/api/posts/${postId}/vote-token`,
+                {
+                    method: "POST",
+                    headers: { Authorization: `Bearer ${token}` },
+                },
+            );
+            const data = await response.json();
+            if (response.ok) {
+                form.dataset.voteAuthToken = data.voteAuthToken;
+                return data.voteAuthToken;
+            }
+            console.error("Failed to get vote token:", data.error);
+        } catch (error) {
+            console.error("Error fetching vote token:", error);
+        }
+        return null;
+    }
+
+    // Appends a {comments, next_cursor} page to the thread and sets up "Load More" for the next one
+    function renderComments(page, listElement, loadMoreBtn) {
+        page.comments.forEach((comment) => {
+            const el = document.createElement("div");
+            el.className = "comment-item";
+            el.innerHTML = `
+                <strong>${comment.Username}</strong>:
+                <span>${comment.Content}</span>
+                <div class="comment-date">${new Date(comment.Timestamp).toLocaleString()}</div>
+            `;
+            listElement.appendChild(el);
+        });
+
+        if (page.next_cursor) {
+            loadMoreBtn.dataset.nextCursor = page.next_cursor;
+            loadMoreBtn.style.display = "block";
+            loadMoreBtn.textContent = "Load More";
+        } else {
+            loadMoreBtn.style.display = "none";
+        }
+    }
+
+    // cursor is the next_cursor of the previous page, or null for the first page
+    async function fetchComments(postId, cursor, listElement, loadMoreBtn) {
         try {
             loadMoreBtn.textContent = "Loading...";
+            const query = cursor
+                ? `?cursor=${encodeURIComponent(cursor)}`
+                : "";
             const response = await fetch(
-                `http://localhost:5000/api/posts/${postId}/comments?page=${page}`,
+                `http://localhost:5000/api/posts/${postId}/comments${query}`,
                 {
                     headers: { Authorization: `Bearer ${token}` },
                 },
@@ -263,23 +348,7 @@ document.addEventListener("DOMContentLoaded", () => {
             const data = await response.json();
 
             if (response.ok) {
-                data.comments.forEach((comment) => {
-                    const el = document.createElement("div");
-                    el.className = "comment-item";
-                    el.innerHTML = `
-                        <strong>${comment.Username}</strong>:
-                        <span>${comment.Content}</span>
-                        <div class="comment-date">${new Date(comment.Timestamp).toLocaleString()}</div>
-                    `;
-                    listElement.appendChild(el);
-                });
-
-                if (data.nextPage) {
-                    loadMoreBtn.style.display = "block";
-                    loadMoreBtn.textContent = "Load More";
-                } else {
-                    loadMoreBtn.style.display = "none";
-                }
+                renderComments(data, listElement, loadMoreBtn);
             } else {
                 loadMoreBtn.textContent = "Failed to load comments";
                 console.error("Failed to fetch comments:", response.status);
@@ -290,26 +359,44 @@ document.addEventListener("DOMContentLoaded", () => {
         }
     }
 
-    const fetchFeed = async () => {
+    // Cursor of the last post loaded, null when there are no more pages
+    let nextCursor = null;
+    const loadMorePostsBtn = document.createElement("button");
+    loadMorePostsBtn.className = "load-more-posts-btn";
+    loadMorePostsBtn.textContent = "Load More Posts";
+    loadMorePostsBtn.addEventListener("click", () => fetchFeed(nextCursor));
+
+    const fetchFeed = async (cursor = null) => {
         try {
-            const response = await fetch("http://localhost:5000/api/feed", {
+            // The first page of every thread comes with the feed, "View Comments" then needs no request
+            const url = cursor
+                ? `http://localhost:5000/api/feed?include=comments&cursor=${encodeURIComponent(cursor)}`
+                : "http://localhost:5000/api/feed?include=comments";
+            const response = await fetch(url, {
                 method: "GET",
                 headers: { Authorization: `Bearer ${token}` },
             });
 
-            const posts = await response.json();
+            const data = await response.json();
             if (response.ok) {
-                // Clear any previous content
-                feedContainer.innerHTML = "";
-                if (posts.length === 0) {
+                if (!cursor) {
+                    // Clear any previous content
+                    feedContainer.innerHTML = "";
+                }
+                loadMorePostsBtn.remove();
+                if (!cursor && data.posts.length === 0) {
                     feedContainer.textContent = "Nothing here at the moment...";
                 } else {
                     // For each post object, handle based on its type
-                    posts.forEach((post) => {
+                    data.posts.forEach((post) => {
                         const postCard = createPostCard(post);
                         feedContainer.appendChild(postCard);
                     });
                 }
+                nextCursor = data.next_cursor;
+                if (nextCursor) {
+                    feedContainer.appendChild(loadMorePostsBtn);
+                }
             } else {
                 // If token is invalid or another server error occurs
                 handleLogout();
@@ -428,7 +515,9 @@ document.addEventListener("DOMContentLoaded", () => {
                     "Could not submit vote. Try again later.";
             }
         } else if (form.classList.contains("item-vote-options")) {
-            const voteAuthToken = form.dataset.voteAuthToken;
+            const voteAuthToken =
+                form.dataset.voteAuthToken ||
+                (await fetchVoteToken(postId, form));
             if (!voteAuthToken) {
                 voteMessage.textContent =
                     "Cannot vote: missing authorization token.";
@@ -458,6 +547,10 @@ document.addEventListener("DOMContentLoaded", () => {
                     form.querySelector(".vote-button").textContent = "Voted!";
                 } else {
                     const err = await response.json();
+                    if (response.status === 401) {
+                        // Expired vote token, a fresh one is fetched on the next attempt
+                        delete form.dataset.voteAuthToken;
+                    }
                     voteMessage.textContent =
                         err.error || "Failed to record vote.";
                 }
@@ -468,6 +561,74 @@ document.addEventListener("DOMContentLoaded", () => {
         }
     });
 
+    // --- Live updates from the server (Server-Sent Events) ---
+    const newPostsBanner = document.createElement("button");
+    newPostsBanner.className = "new-posts-banner";
+    newPostsBanner.textContent = "New posts available - click to refresh";
+    newPostsBanner.style.display = "none";
+    newPostsBanner.addEventListener("click", () => {
+        newPostsBanner.style.display = "none";
+        fetchFeed();
+    });
+    feedContainer.parentElement.insertBefore(newPostsBanner, feedContainer);
+
+    function addToCount(element, delta, format) {
+        if (!element) return;
+        const count = parseInt(element.dataset.count) + delta;
+        element.dataset.count = count;
+        element.textContent = format(count);
+    }
+
+    function subscribeToFeedUpdates() {
+        // EventSource cannot send headers, so the token goes in the query string
+        const stream = new EventSource(
+            `http://localhost:5000/api/feed/stream?access_token=${encodeURIComponent(token)}`,
+        );
+
+        stream.addEventListener("new_post", (e) => {
+            const data = JSON.parse(e.data);
+            if (!postsById[data.PostID]) {
+                newPostsBanner.style.display = "block";
+            }
+        });
+
+        stream.addEventListener("option_count", (e) => {
+            const data = JSON.parse(e.data);
+            addToCount(
+                document.getElementById(`vote-count-${data.OptionID}`),
+                data.delta,
+                (count) => `(${count} votes)`,
+            );
+        });
+
+        stream.addEventListener("item_tally", (e) => {
+            const data = JSON.parse(e.data);
+            addToCount(
+                document.getElementById(
+                    `item-vote-label-${data.PostID}-${data.Choice}`,
+                ),
+                data.delta,
+                (count) => `${data.Choice} (${count} votes)`,
+            );
+        });
+
+        stream.addEventListener("comment_count", (e) => {
+            const data = JSON.parse(e.data);
+            const post = postsById[data.PostID];
+            if (!post) return;
+            post.CommentCount += data.delta;
+            const toggleBtn = document.querySelector(
+                `.post-card[data-post-id="${data.PostID}"] .toggle-comments-btn`,
+            );
+            if (toggleBtn && toggleBtn.getAttribute("aria-expanded") === "false") {
+                toggleBtn.textContent = `View Comments (${post.CommentCount})`;
+            }
+        });
+
+        // We missed some updates, the only safe thing is to reload
+        stream.addEventListener("resync", () => fetchFeed());
+    }
+
     // --- 5. Logout Functionality ---
     const handleLogout = () => {
         localStorage.removeItem("authToken");
@@ -477,4 +638,5 @@ document.addEventListener("DOMContentLoaded", () => {
     // --- 6. Attach Event Listeners and Execute ---
     logoutButton.addEventListener("click", handleLogout);
     fetchFeed(); // Initial call to load the feed
+    subscribeToFeedUpdates();
 });
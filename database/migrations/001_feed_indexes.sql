@@ -0,0 +1,3 @@
+-- Brings an existing database up to date with schema.sql.
+-- Keyset pagination of the feed: ORDER BY CreationTimestamp DESC, PostID DESC
+ALTER TABLE Posts ADD INDEX idx_posts_feed (CreationTimestamp, PostID);
@@ -0,0 +1,7 @@
+-- Denormalised comment counter read by the feed, maintained by create_comment.
+ALTER TABLE Posts ADD COLUMN CommentCount INT NOT NULL DEFAULT 0 AFTER AllowComments;
+
+-- Fill it in for existing posts (or run "python manage.py reconcile-comment-counts" afterwards)
+UPDATE Posts p
+JOIN (SELECT PostID, COUNT(*) AS Actual FROM Comments GROUP BY PostID) c ON c.PostID = p.PostID
+SET p.CommentCount = c.Actual;
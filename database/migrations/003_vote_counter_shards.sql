@@ -0,0 +1,8 @@
+-- Sharded vote counters for hot poll options, see schema.sql.
+CREATE TABLE PollOptionCounterShards (
+    OptionID INT NOT NULL,
+    Slot SMALLINT NOT NULL,
+    VoteCount INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (OptionID, Slot),
+    FOREIGN KEY (OptionID) REFERENCES PollOptions(OptionID) ON DELETE CASCADE
+);
@@ -0,0 +1,18 @@
+-- Running For/Against/Abstain totals per VoteItem, see schema.sql.
+CREATE TABLE VoteItemTallies (
+    PostID INT PRIMARY KEY,
+    ForCount INT NOT NULL DEFAULT 0,
+    AgainstCount INT NOT NULL DEFAULT 0,
+    AbstainCount INT NOT NULL DEFAULT 0,
+    LastUpdated TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (PostID) REFERENCES Posts(PostID) ON DELETE CASCADE
+);
+
+-- Tally the votes cast before the table existed
+INSERT INTO VoteItemTallies (PostID, ForCount, AgainstCount, AbstainCount)
+SELECT PostID,
+       SUM(VoteType = 'For'),
+       SUM(VoteType = 'Against'),
+       SUM(VoteType = 'Abstain')
+FROM ItemVotes
+GROUP BY PostID;
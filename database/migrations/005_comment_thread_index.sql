@@ -0,0 +1,3 @@
+-- Brings an existing database up to date with schema.sql.
+-- Keyset pagination of a thread: WHERE PostID = ? ORDER BY Timestamp, CommentID
+ALTER TABLE Comments ADD INDEX idx_comments_thread (PostID, Timestamp, CommentID, UserID);
@@ -0,0 +1,5 @@
+-- Brings an existing database up to date with schema.sql.
+-- FULLTEXT indexes for GET /api/search ("python manage.py build-search-index" does the same and skips
+-- indexes that already exist). Building them reads every existing row, writes wait until it is done.
+ALTER TABLE Posts ADD FULLTEXT INDEX ft_posts_text (Title, Content);
+ALTER TABLE Comments ADD FULLTEXT INDEX ft_comments_content (Content);
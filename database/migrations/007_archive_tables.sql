@@ -0,0 +1,61 @@
+-- Brings an existing database up to date with schema.sql.
+-- Archive of posts older than the hot window, with their options, votes, tallies and comments,
+-- moved here in batches by "python manage.py archive". Same columns without foreign keys (the posts
+-- are gone from Posts and their rows are read-only) and only the indexes the readers use.
+-- PollOptions_Archive.VoteCount already includes the option's counter shards.
+CREATE TABLE Posts_Archive (
+    PostID INT PRIMARY KEY,
+    AuthorUserID INT NOT NULL,
+    PostType ENUM('Announcement', 'Poll', 'Discussion', 'VoteItem', 'ForumTopic') NOT NULL,
+    Title VARCHAR(255) NOT NULL,
+    Content TEXT,
+    AllowComments BOOLEAN DEFAULT TRUE,
+    CommentCount INT NOT NULL DEFAULT 0,
+    CreationTimestamp TIMESTAMP NULL,
+    INDEX idx_posts_feed (CreationTimestamp, PostID)
+);
+
+CREATE TABLE PollOptions_Archive (
+    OptionID INT PRIMARY KEY,
+    PostID INT NOT NULL,
+    OptionText VARCHAR(255) NOT NULL,
+    VoteCount INT NOT NULL DEFAULT 0,
+    INDEX idx_options_post (PostID)
+);
+
+CREATE TABLE PollVotes_Archive (
+    VoteID INT PRIMARY KEY,
+    UserID INT NOT NULL,
+    PostID INT NOT NULL,
+    OptionID INT NOT NULL,
+    Timestamp TIMESTAMP NULL,
+    UNIQUE KEY user_vote_per_poll (UserID, PostID),
+    INDEX idx_votes_post (PostID)
+);
+
+CREATE TABLE ItemVotes_Archive (
+    VoteID INT PRIMARY KEY,
+    UserID INT NOT NULL,
+    PostID INT NOT NULL,
+    VoteType ENUM('For', 'Against', 'Abstain') NOT NULL,
+    Timestamp TIMESTAMP NULL,
+    UNIQUE KEY user_vote_per_item (UserID, PostID),
+    INDEX idx_votes_post (PostID)
+);
+
+CREATE TABLE VoteItemTallies_Archive (
+    PostID INT PRIMARY KEY,
+    ForCount INT NOT NULL DEFAULT 0,
+    AgainstCount INT NOT NULL DEFAULT 0,
+    AbstainCount INT NOT NULL DEFAULT 0,
+    LastUpdated TIMESTAMP NULL
+);
+
+CREATE TABLE Comments_Archive (
+    CommentID INT PRIMARY KEY,
+    PostID INT NOT NULL,
+    UserID INT NOT NULL,
+    Content TEXT NOT NULL,
+    Timestamp TIMESTAMP NULL,
+    INDEX idx_comments_thread (PostID, Timestamp, CommentID, UserID)
+);
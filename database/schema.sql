@@ -14,8 +14,14 @@ CREATE TABLE Posts (
     Title VARCHAR(255) NOT NULL,
     Content TEXT,
     AllowComments BOOLEAN DEFAULT TRUE,
+    -- Maintained by create_comment, recompute with "python manage.py reconcile-comment-counts"
+    CommentCount INT NOT NULL DEFAULT 0,
     CreationTimestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (AuthorUserID) REFERENCES Users(UserID)
+    FOREIGN KEY (AuthorUserID) REFERENCES Users(UserID),
+    -- Keyset pagination of the feed: ORDER BY CreationTimestamp DESC, PostID DESC
+    INDEX idx_posts_feed (CreationTimestamp, PostID),
+    -- GET /api/search
+    FULLTEXT INDEX ft_posts_text (Title, Content)
 );
 
 CREATE TABLE PollOptions (
@@ -26,6 +32,17 @@ CREATE TABLE PollOptions (
     FOREIGN KEY (PostID) REFERENCES Posts(PostID) ON DELETE CASCADE
 );
 
+-- Vote count increments for hot options, spread over VOTE_COUNTER_SHARDS slots per option.
+-- An option's total is PollOptions.VoteCount plus the sum of its shards,
+-- "python manage.py fold-vote-shards" moves the shards back into PollOptions.VoteCount.
+CREATE TABLE PollOptionCounterShards (
+    OptionID INT NOT NULL,
+    Slot SMALLINT NOT NULL,
+    VoteCount INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (OptionID, Slot),
+    FOREIGN KEY (OptionID) REFERENCES PollOptions(OptionID) ON DELETE CASCADE
+);
+
 CREATE TABLE PollVotes (
     VoteID INT AUTO_INCREMENT PRIMARY KEY,
     UserID INT NOT NULL,
@@ -49,6 +66,16 @@ CREATE TABLE ItemVotes (
     UNIQUE KEY user_vote_per_item (UserID, PostID)
 );
 
+-- Running For/Against/Abstain totals per VoteItem, kept up to date as ItemVotes are inserted
+CREATE TABLE VoteItemTallies (
+    PostID INT PRIMARY KEY,
+    ForCount INT NOT NULL DEFAULT 0,
+    AgainstCount INT NOT NULL DEFAULT 0,
+    AbstainCount INT NOT NULL DEFAULT 0,
+    LastUpdated TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (PostID) REFERENCES Posts(PostID) ON DELETE CASCADE
+);
+
 CREATE TABLE Comments (
     CommentID INT AUTO_INCREMENT PRIMARY KEY,
     PostID INT NOT NULL,
@@ -56,5 +83,70 @@ CREATE TABLE Comments (
     Content TEXT NOT NULL,
     Timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (PostID) REFERENCES Posts(PostID) ON DELETE CASCADE,
-    FOREIGN KEY (UserID) REFERENCES Users(UserID)
-);
\ No newline at end of file
+    FOREIGN KEY (UserID) REFERENCES Users(UserID),
+    -- Keyset pagination of a thread: WHERE PostID = ? ORDER BY Timestamp, CommentID
+    INDEX idx_comments_thread (PostID, Timestamp, CommentID, UserID),
+    -- GET /api/search
+    FULLTEXT INDEX ft_comments_content (Content)
+);
+
+-- Archive of posts older than the hot window, with their options, votes, tallies and comments,
+-- moved here in batches by "python manage.py archive". Same columns without foreign keys (the posts
+-- are gone from Posts and their rows are read-only) and only the indexes the readers use.
+-- PollOptions_Archive.VoteCount already includes the option's counter shards.
+CREATE TABLE Posts_Archive (
+    PostID INT PRIMARY KEY,
+    AuthorUserID INT NOT NULL,
+    PostType ENUM('Announcement', 'Poll', 'Discussion', 'VoteItem', 'ForumTopic') NOT NULL,
+    Title VARCHAR(255) NOT NULL,
+    Content TEXT,
+    AllowComments BOOLEAN DEFAULT TRUE,
+    CommentCount INT NOT NULL DEFAULT 0,
+    CreationTimestamp TIMESTAMP NULL,
+    INDEX idx_posts_feed (CreationTimestamp, PostID)
+);
+
+CREATE TABLE PollOptions_Archive (
+    OptionID INT PRIMARY KEY,
+    PostID INT NOT NULL,
+    OptionText VARCHAR(255) NOT NULL,
+    VoteCount INT NOT NULL DEFAULT 0,
+    INDEX idx_options_post (PostID)
+);
+
+CREATE TABLE PollVotes_Archive (
+    VoteID INT PRIMARY KEY,
+    UserID INT NOT NULL,
+    PostID INT NOT NULL,
+    OptionID INT NOT NULL,
+    Timestamp TIMESTAMP NULL,
+    UNIQUE KEY user_vote_per_poll (UserID, PostID),
+    INDEX idx_votes_post (PostID)
+);
+
+CREATE TABLE ItemVotes_Archive (
+    VoteID INT PRIMARY KEY,
+    UserID INT NOT NULL,
+    PostID INT NOT NULL,
+    VoteType ENUM('For', 'Against', 'Abstain') NOT NULL,
+    Timestamp TIMESTAMP NULL,
+    UNIQUE KEY user_vote_per_item (UserID, PostID),
+    INDEX idx_votes_post (PostID)
+);
+
+CREATE TABLE VoteItemTallies_Archive (
+    PostID INT PRIMARY KEY,
+    ForCount INT NOT NULL DEFAULT 0,
+    AgainstCount INT NOT NULL DEFAULT 0,
+    AbstainCount INT NOT NULL DEFAULT 0,
+    LastUpdated TIMESTAMP NULL
+);
+
+CREATE TABLE Comments_Archive (
+    CommentID INT PRIMARY KEY,
+    PostID INT NOT NULL,
+    UserID INT NOT NULL,
+    Content TEXT NOT NULL,
+    Timestamp TIMESTAMP NULL,
+    INDEX idx_comments_thread (PostID, Timestamp, CommentID, UserID)
+);
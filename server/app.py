@@ -1,21 +1,37 @@
 # Flask: https://flask.palletsprojects.com/
-from flask import Flask, jsonify, request, make_response
+from flask import Flask, jsonify, request, make_response, Response, g
 # python-dotenv: https://pypi.org/project/python-dotenv/
 from dotenv import load_dotenv
 # mysql-connector-python: https://dev.mysql.com/doc/connector-python/en/
 import mysql.connector
-# bcrypt: https://pypi.org/project/bcrypt/
-import bcrypt
 # Flask-CORS: https://flask-cors.readthedocs.io/
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 # PyJWT: https://pyjwt.readthedocs.io/
 import jwt
 import os
 import datetime
+import hashlib
+import json
 import re
+import time
 from functools import wraps
-# (local module)
+# (local modules)
+import auth
 import db_queries
+import passwords
+import feed_cache
+import user_cache
+import vote_queue
+import vote_index
+import events
+import json_provider
+import compression
+import instrumentation
+import ratelimit
+import replicas
+import export
+from cursors import decode_cursor, decode_score_cursor
 
 load_dotenv()
 
@@ -23,6 +39,33 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
+# Behind TRUSTED_PROXY_HOPS reverse proxies, remote_addr is the client's address from X-Forwarded-For
+if ratelimit.trusted_proxy_hops():
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=ratelimit.trusted_proxy_hops())
+json_provider.init_app(app)
+compression.init_app(app)
+instrumentation.init_app(app)
+instrumentation.instrument_module(db_queries)
+instrumentation.register_gauge("edemocracy_db_pool_checked_out", "Connections in use.", lambda: db_queries.get_pool_stats()["checked_out"])
+instrumentation.register_gauge("edemocracy_db_pool_waiting", "Requests waiting for a connection.", lambda: db_queries.get_pool_stats()["waiting"])
+instrumentation.register_gauge("edemocracy_statement_cache_hit_ratio", "Statements run on an already prepared statement.", lambda: db_queries.get_statement_stats()["hit_rate"])
+instrumentation.register_gauge("edemocracy_password_queue_depth", "bcrypt jobs queued or running.", lambda: passwords.stats()["queue_depth"])
+instrumentation.register_gauge("edemocracy_replica_lag_seconds", "Largest replica lag at the last checks.", lambda: (db_queries.get_replica_stats() or {}).get("lag_seconds", 0))
+instrumentation.register_gauge("edemocracy_replicas_behind", "Replicas skipped for lag or stopped replication.", lambda: (db_queries.get_replica_stats() or {}).get("behind", 0))
+instrumentation.register_gauge("edemocracy_rate_limited_total", "Writes refused with 429.", lambda: ratelimit.stats()["limited"])
+instrumentation.register_gauge("edemocracy_write_shed_total", "Writes refused with 503 at WRITE_CONCURRENCY.", lambda: ratelimit.stats()["shed"])
+instrumentation.register_gauge("edemocracy_feed_stream_subscribers", "Open /api/feed/stream connections.", lambda: events.broker.stats()["subscribers"])
+
+# Start warming this worker's vote index now rather than on the first vote or feed load
+if vote_index.enabled():
+    vote_index.get_index()
+
+ADMIN_ROLES = ('Admin_Level1', 'Admin_Level2')
+FEED_PAGE_SIZE = 20
+FEED_PAGE_MAX = 50
+COMMENTS_PAGE_SIZE = 5 # Number of comments to load per click
+FEED_INCLUDES = {'comments'}
+POST_TYPES = ('Announcement', 'Poll', 'Discussion', 'VoteItem', 'ForumTopic')
 
 # Decorator to make certain routes require a valid token
 def token_required(func):
@@ -32,40 +75,140 @@ def token_required(func):
         token = None
         if 'Authorization' in request.headers:
             # The header format is "Bearer <token>"
-            auth_header = request.headers['Authorization']
             try:
-                token = auth_header.split(" ")[1]
-            except:
-                return make_response(jsonify({"error": "Token is in incorrect format!"}), 401)
+                token = auth.bearer_token(request.headers['Authorization'])
+            except ValueError as e:
+                return make_response(jsonify({"error": str(e)}), 401)
 
-        # If the token is not found, return an error
-        if not token:
-            return make_response(jsonify({"error": "Token is missing!"}), 401)
-
-        # Try to decode the token to verify it
-        try:
-            # Verify the token using secret key
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
-            # Get the user's data from the token's payload
-            current_user_id = data['user_id']
-        except jwt.ExpiredSignatureError:
-            return make_response(jsonify({"error": "Token has expired!"}), 401)
-        except jwt.InvalidTokenError:
-            return make_response(jsonify({"error": "Token is invalid!"}), 401)
-        except jwt.DecodeError:
-            return make_response(jsonify({"error": "Token could not be decoded!"}), 401)
+        current_user_id, error_response = verify_token(token)
+        if error_response:
+            return error_response
 
         # If the token is valid, execute the original route function and pass the user's ID to it
-        return func(current_user_id, *args, **kwargs)
+        g.user_id = current_user_id
+        # Reads for this request follow the user's read-your-writes pin, see replicas.py
+        reader_token = replicas.set_reader(current_user_id)
+        try:
+            return func(current_user_id, *args, **kwargs)
+        finally:
+            replicas.reset_reader(reader_token)
 
     return decorated
 
+# Per-route write budgets (per user, per IP) as "requests/seconds", see ratelimit.py for overriding them
+RATE_LIMITS = {
+    'post': ("5/60", "30/60"),
+    'vote': ("30/60", "300/60"),
+    'item_vote': ("30/60", "300/60"),
+    'comment': ("10/60", "100/60"),
+}
+
+# Goes below token_required: throttles the route per user and IP, and sheds it when this process
+# already runs WRITE_CONCURRENCY limited requests
+def rate_limited(name):
+    user_default, ip_default = RATE_LIMITS[name]
+
+    def decorator(func):
+        @wraps(func)
+        def decorated(current_user_id, *args, **kwargs):
+            if not ratelimit.enabled():
+                return func(current_user_id, *args, **kwargs)
+
+            retry_after = ratelimit.check(name, current_user_id, request.remote_addr, user_default, ip_default)
+            if retry_after is not None:
+                response = make_response(jsonify({"error": "Too many requests, please slow down"}), 429)
+                response.headers['Retry-After'] = str(retry_after)
+                return response
+
+            if not ratelimit.enter():
+                response = make_response(jsonify({"error": "Server is busy, please try again shortly"}), 503)
+                response.headers['Retry-After'] = "1"
+                return response
+            try:
+                return func(current_user_id, *args, **kwargs)
+            finally:
+                ratelimit.leave()
+
+        return decorated
+
+    return decorator
+
+# Returns (user_id, None) for a valid token, or (None, error_response)
+def verify_token(token):
+    current_user_id, error = auth.check_token(token, app.config['SECRET_KEY'])
+    if error:
+        return None, make_response(jsonify({"error": error}), 401)
+    return current_user_id, None
+
+# The authenticated user's profile (UserID, Username, Email, Role, RegistrationTimestamp) or None.
+# Loaded at most once per request, and through user_cache at most once per USER_CACHE_TTL.
+def current_user():
+    if 'user' not in g:
+        g.user = db_queries.get_user_profile_by_id(g.user_id)
+    return g.user
+
+def current_user_role():
+    user = current_user()
+    return user['Role'] if user else None
+
+# The ETag of a JSON response body, shared with asgi.py so both servers tag the same bytes alike
+def json_etag(data):
+    return hashlib.sha1(data).hexdigest()
+
+# A 200 JSON response with an ETag of its body, or a 304 when the client's copy still matches.
+# Clients may keep a copy but must revalidate it every time.
+def conditional_json(body, last_modified=None):
+    response = make_response(jsonify(body), 200)
+    response.set_etag(json_etag(response.get_data()))
+    if last_modified:
+        # TIMESTAMP columns come back as naive UTC (see db_queries._connect)
+        response.last_modified = last_modified.replace(tzinfo=datetime.timezone.utc)
+    response.cache_control.no_cache = True
+    response.cache_control.private = True
+    return response.make_conditional(request)
+
 # Define an endpoint using a decorator
 @app.route('/api')
 def hello_world():
   # Whatever this function returns is sent back to the client
   return jsonify({"message": "Hello World from the API!"})
 
+# Input checks for registration and login, shared with asgi.py. Return an error message or None.
+def registration_error(username, email, password):
+  if not all([username, email, password]):
+    return "Missing required fields"
+
+  if not username or not re.match(r'^[a-zA-Z0-9_]+$', username) or len(username) > 50:
+    return "Invalid username"
+
+  if not email or not re.match(r'^[^@]+@[^@]+\.[^@]+$', email) or len(email) > 100:
+    return "Invalid email"
+
+  if not password or len(password) < 8:
+    return "Password must be at least 8 characters"
+  return None
+
+def login_error(email, password):
+  if not email or not password:
+    return "Missing email or password"
+
+  if not re.match(r'^[^@]+@[^@]+\.[^@]+$', email):
+    return "Invalid email format"
+  return None
+
+# The password hashing pool is full, see passwords.py
+def password_pool_busy_response(busy):
+  response = make_response(jsonify({"error": "Server is busy, please try again shortly"}), 503)
+  response.headers['Retry-After'] = str(busy.retry_after)
+  return response
+
+def create_auth_token(user_id):
+  payload = {
+    "user_id": user_id,
+    "exp": datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=30)
+  }
+  return jwt.encode(payload, app.config['SECRET_KEY'], algorithm="HS256")
+
 # Registration route
 @app.route('/api/users/register', methods=['POST'])
 def register_user():
@@ -74,21 +217,14 @@ def register_user():
   email = data.get('email')
   password = data.get('password')
 
-  if not all([username, email, password]):
-    return make_response(jsonify({"error": "Missing required fields"}), 400)
-  
-  if not username or not re.match(r'^[a-zA-Z0-9_]+$', username) or len(username) > 50:
-    return make_response(jsonify({"error": "Invalid username"}), 400)
-
-  if not email or not re.match(r'^[^@]+@[^@]+\.[^@]+$', email) or len(email) > 100:
-    return make_response(jsonify({"error": "Invalid email"}), 400)
-
-  if not password or len(password) < 8:
-    return make_response(jsonify({"error": "Password must be at least 8 characters"}), 400)
+  error = registration_error(username, email, password)
+  if error:
+    return make_response(jsonify({"error": error}), 400)
 
-
-  password_bytes = password.encode('utf-8')
-  hashed_password = bcrypt.hashpw(password_bytes, bcrypt.gensalt())
+  try:
+    hashed_password = passwords.hash_password(password)
+  except passwords.PasswordPoolBusy as busy:
+    return password_pool_busy_response(busy)
 
   try:
     if db_queries.create_user(username, email, hashed_password):
@@ -107,11 +243,9 @@ def login_user():
   email = data.get('email')
   password = data.get('password')
 
-  if not email or not password:
-    return make_response(jsonify({"error": "Missing email or password"}), 400)
-  
-  if not re.match(r'^[^@]+@[^@]+\.[^@]+$', email):
-    return make_response(jsonify({"error": "Invalid email format"}), 400)
+  error = login_error(email, password)
+  if error:
+    return make_response(jsonify({"error": error}), 400)
 
   user_record = db_queries.find_user_by_email(email)
 
@@ -120,12 +254,19 @@ def login_user():
 
   user_id, stored_password_hash = user_record
 
-  if bcrypt.checkpw(password.encode('utf-8'), stored_password_hash.encode('utf-8')):
-    payload = {
-      "user_id": user_id,
-      "exp": datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=30)
-    }
-    token = jwt.encode(payload, app.config['SECRET_KEY'], algorithm="HS256")
+  try:
+    password_ok = passwords.check_password(password, stored_password_hash)
+  except passwords.PasswordPoolBusy as busy:
+    return password_pool_busy_response(busy)
+
+  if password_ok:
+    if passwords.needs_rehash(stored_password_hash):
+      # The cost (BCRYPT_ROUNDS) changed since this hash was made. Best effort: the login succeeds either way.
+      try:
+        db_queries.update_password_hash(user_id, passwords.hash_password(password))
+      except passwords.PasswordPoolBusy:
+        pass
+    token = create_auth_token(user_id)
     return jsonify({"message": "Login successful", "token": token}), 200
   else:
     return make_response(jsonify({"error": "Invalid email or password"}), 401)
@@ -133,20 +274,79 @@ def login_user():
 @app.route('/api/profile')
 @token_required
 def get_profile(current_user_id):
-    user = db_queries.get_user_profile_by_id(current_user_id)
+    user = current_user()
     if not user:
         return make_response(jsonify({"error": "User not found"}), 404)
     return jsonify({"user": user}), 200
-        
+
+# Connection pool statistics, used to size DB_POOL_SIZE against the worker count
+@app.route('/api/admin/db-pool', methods=['GET'])
+@token_required
+def get_db_pool_stats(current_user_id):
+    if current_user_role() not in ADMIN_ROLES:
+        return make_response(jsonify({"error": "Admin access required"}), 403)
+    return jsonify({
+        "pool": db_queries.get_pool_stats(),
+        "replicas": db_queries.get_replica_stats(),
+        "statements": db_queries.get_statement_stats(),
+    }), 200
+
+# Feed cache hit/miss counters
+@app.route('/api/admin/feed-cache', methods=['GET'])
+@token_required
+def get_feed_cache_stats(current_user_id):
+    if current_user_role() not in ADMIN_ROLES:
+        return make_response(jsonify({"error": "Admin access required"}), 403)
+    return jsonify({"feed_cache": feed_cache.stats()}), 200
+
+# User profile and verified token cache counters
+@app.route('/api/admin/user-cache', methods=['GET'])
+@token_required
+def get_user_cache_stats(current_user_id):
+    if current_user_role() not in ADMIN_ROLES:
+        return make_response(jsonify({"error": "Admin access required"}), 403)
+    return jsonify({"user_cache": user_cache.stats(), "token_cache": auth.stats()}), 200
+
+# Prometheus scrape target, see instrumentation.py. Set METRICS_TOKEN to require "Authorization: Bearer <METRICS_TOKEN>".
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    metrics_token = os.getenv('METRICS_TOKEN')
+    if metrics_token and request.headers.get('Authorization') != f"Bearer {metrics_token}":
+        return make_response(jsonify({"error": "Invalid metrics token"}), 401)
+    return Response(instrumentation.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+# Password hashing pool queue depth and latency
+@app.route('/api/admin/passwords', methods=['GET'])
+@token_required
+def get_password_pool_stats(current_user_id):
+    if current_user_role() not in ADMIN_ROLES:
+        return make_response(jsonify({"error": "Admin access required"}), 403)
+    return jsonify({"passwords": passwords.stats()}), 200
+
+@app.route('/api/admin/vote-index', methods=['GET'])
+@token_required
+def get_vote_index_stats(current_user_id):
+    if current_user_role() not in ADMIN_ROLES:
+        return make_response(jsonify({"error": "Admin access required"}), 403)
+    return jsonify({"vote_index": vote_index.stats()}), 200
+
+@app.route('/api/admin/rate-limits', methods=['GET'])
+@token_required
+def get_rate_limit_stats(current_user_id):
+    if current_user_role() not in ADMIN_ROLES:
+        return make_response(jsonify({"error": "Admin access required"}), 403)
+    return jsonify({"rate_limits": ratelimit.stats(), "budgets": RATE_LIMITS}), 200
+
 @app.route('/api/posts', methods=['POST'])
 @token_required
+@rate_limited('post')
 def create_post(current_user_id):
     data = request.get_json()
     post_type = data.get('postType')
     allow_comments = data.get('allowComments', True)
     
     # Get user's role for permission checks
-    user_role = db_queries.get_user_role(current_user_id)
+    user_role = current_user_role()
     if not user_role:
         return make_response(jsonify({"error": "User not found"}), 404)
     
@@ -207,14 +407,221 @@ def create_post(current_user_id):
     else:
         return make_response(jsonify({"error": "Invalid or missing 'postType'."}), 400)
       
+IMPORT_POST_TYPES = ('Announcement', 'Poll', 'ForumTopic', 'VoteItem')
+
+# Checks one line of an import against the same limits as create_post.
+# Returns (post, None) with the row for db_queries.import_posts, or (None, error message).
+def import_post(item):
+  if not isinstance(item, dict):
+    return None, "Expected a JSON object"
+  post_type = item.get('postType')
+  if post_type not in IMPORT_POST_TYPES:
+    return None, "Invalid or missing 'postType'"
+
+  title = item.get('title')
+  if not isinstance(title, str) or len(title) > 200 or not title.strip():
+    return None, "Invalid title"
+
+  content = item.get('content') or None
+  if content is not None and (not isinstance(content, str) or len(content) > 1000 or not content.strip()):
+    return None, "Invalid content"
+  if post_type == 'Announcement' and content is None:
+    return None, "Announcement content is required"
+  if post_type == 'ForumTopic' and content is None:
+    # Stored as create_post stores a topic without content
+    content = ''
+
+  options = item.get('options')
+  if post_type == 'Poll':
+    if not isinstance(options, list) or len(options) < 2:
+      return None, "A poll must have at least two options"
+    for option in options:
+      if not isinstance(option, str) or len(option) > 100 or not option.strip():
+        return None, "Invalid poll option"
+
+  return {
+    "PostType": post_type,
+    "Title": title,
+    "Content": None if post_type == 'Poll' else content,
+    "AllowComments": bool(item.get('allowComments', True)),
+    "Options": options if post_type == 'Poll' else [],
+  }, None
+
+# Bulk import of posts from a JSONL body, one create_post style object per line:
+#   {"postType": "Poll", "title": "...", "options": ["...", "..."], "allowComments": true}
+# Every line is checked before anything is written. The posts are then written in transactions of
+# ?chunk_size= posts (default 500), authored by the importing admin. The body is read a line at a
+# time and may be at most IMPORT_MAX_BYTES (default 64 MiB) for at most IMPORT_MAX_POSTS posts.
+@app.route('/api/admin/import', methods=['POST'])
+@token_required
+def import_posts(current_user_id):
+  if current_user_role() not in ADMIN_ROLES:
+    return make_response(jsonify({"error": "Admin access required"}), 403)
+
+  chunk_size = request.args.get('chunk_size', 500, type=int)
+  if chunk_size < 1 or chunk_size > 5000:
+    return make_response(jsonify({"error": "chunk_size must be between 1 and 5000"}), 400)
+
+  max_posts = int(os.getenv('IMPORT_MAX_POSTS', 100000))
+  max_bytes = int(os.getenv('IMPORT_MAX_BYTES', 64 * 1024 * 1024))
+  if request.content_length is not None and request.content_length > max_bytes:
+    return make_response(jsonify({"error": f"At most {max_bytes} bytes per import"}), 413)
+
+  posts = []
+  bytes_read = 0
+  for line_number, line in enumerate(request.stream, start=1):
+    # Also holds for chunked bodies, which come without a Content-Length
+    bytes_read += len(line)
+    if bytes_read > max_bytes:
+      return make_response(jsonify({"error": f"At most {max_bytes} bytes per import"}), 413)
+    if not line.strip():
+      continue
+    try:
+      item = json.loads(line)
+    except ValueError:
+      return make_response(jsonify({"error": "Invalid JSON", "line": line_number}), 400)
+    post, error = import_post(item)
+    if error:
+      return make_response(jsonify({"error": error, "line": line_number}), 400)
+    posts.append(post)
+    if len(posts) > max_posts:
+      return make_response(jsonify({"error": f"At most {max_posts} posts per import"}), 413)
+
+  if not posts:
+    return make_response(jsonify({"error": "Nothing to import"}), 400)
+
+  started = time.perf_counter()
+  result = db_queries.import_posts(current_user_id, posts, chunk_size)
+  seconds = time.perf_counter() - started
+
+  rows = result["posts"] + result["options"]
+  body = {
+    "posts": result["posts"],
+    "options": result["options"],
+    "rows": rows,
+    "chunks": result["chunks"],
+    "seconds": round(seconds, 3),
+    "rows_per_second": round(rows / seconds) if seconds > 0 else None,
+  }
+  if result["failed_chunk"] is not None:
+    # Chunks before the failed one are committed
+    body["error"] = f"Import failed at chunk {result['failed_chunk']}"
+    body["failed_chunk"] = result["failed_chunk"]
+    return make_response(jsonify(body), 500)
+  return jsonify(body), 201
+
+# Audit export of a whole vote table (db_queries.VOTE_EXPORTS), streamed as it is read:
+#   GET /api/admin/export/poll-votes?format=csv&post_id=12&since=2024-01-01T00:00:00Z&until=...&gzip=true
+# format is csv (default) or jsonl, since/until are ISO 8601 (UTC unless an offset is given) and
+# filter on the vote's Timestamp, gzip=true sends a .gz file. EXPORT_CHUNK rows (default 1000) are
+# read, encoded and sent at a time.
+@app.route('/api/admin/export/<export_name>', methods=['GET'])
+@token_required
+def export_votes(current_user_id, export_name):
+    if current_user_role() not in ADMIN_ROLES:
+        return make_response(jsonify({"error": "Admin access required"}), 403)
+    if export_name not in db_queries.VOTE_EXPORTS:
+        return make_response(jsonify({"error": f"Unknown export, use one of: {', '.join(sorted(db_queries.VOTE_EXPORTS))}"}), 404)
+
+    export_format = request.args.get('format', 'csv')
+    if export_format not in export.FORMATS:
+        return make_response(jsonify({"error": f"format must be one of: {', '.join(sorted(export.FORMATS))}"}), 400)
+    post_id = request.args.get('post_id', type=int)
+    bounds = {}
+    for name in ('since', 'until'):
+        value = request.args.get(name)
+        if value is None:
+            bounds[name] = None
+            continue
+        try:
+            # fromisoformat() before Python 3.11 does not take a "Z"
+            moment = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return make_response(jsonify({"error": f"Invalid {name}, expected an ISO 8601 date and time"}), 400)
+        if moment.tzinfo is not None:
+            moment = moment.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        bounds[name] = moment
+    compress = request.args.get('gzip', 'false').lower() in ('1', 'true', 'yes')
+
+    chunks = db_queries.stream_votes(export_name, post_id, bounds['since'], bounds['until'],
+                                     chunk_size=int(os.getenv('EXPORT_CHUNK', 1000)))
+    if chunks is None:
+        return make_response(jsonify({"error": "Could not start the export"}), 500)
+
+    columns, _ = db_queries.VOTE_EXPORTS[export_name]
+    mimetype, extension = export.FORMATS[export_format]
+    body = export.encode(export_format, columns, chunks)
+    filename = f"{export_name}.{extension}"
+    if compress:
+        body = export.gzip_chunks(body)
+        mimetype = 'application/gzip'
+        filename += '.gz'
+    return Response(body, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Cache-Control': 'no-store',
+        # Stop nginx from buffering the whole export before passing it on
+        'X-Accel-Buffering': 'no',
+    })
+
 @app.route('/api/feed', methods=['GET'])
 @token_required
 def get_feed(current_user_id):
-  feed_data = db_queries.get_feed_posts(current_user_id)
-  return jsonify(feed_data), 200
+  limit = request.args.get('limit', FEED_PAGE_SIZE, type=int)
+  if limit < 1 or limit > FEED_PAGE_MAX:
+    return make_response(jsonify({"error": f"limit must be between 1 and {FEED_PAGE_MAX}"}), 400)
+
+  after = None
+  if request.args.get('cursor'):
+    try:
+      after = decode_cursor(request.args['cursor'])
+    except ValueError:
+      return make_response(jsonify({"error": "Invalid cursor"}), 400)
+
+  # ?include=comments embeds the first page of comments of every post
+  includes = {name for name in request.args.get('include', '').split(',') if name}
+  if includes - FEED_INCLUDES:
+    return make_response(jsonify({"error": f"include must be one of: {', '.join(sorted(FEED_INCLUDES))}"}), 400)
+  comments_per_post = COMMENTS_PAGE_SIZE if 'comments' in includes else 0
+
+  feed_data = db_queries.get_feed_posts(current_user_id, after, limit, comments_per_post,
+                                       vote_filter=vote_index.feed_filter())
+  return conditional_json(feed_data)
+
+# Live feed updates as Server-Sent Events: new_post, option_count, item_tally, comment_count, and
+# resync when the client fell too far behind. EventSource cannot send an Authorization header,
+# so the token comes in the access_token query parameter instead.
+@app.route('/api/feed/stream', methods=['GET'])
+def stream_feed():
+    current_user_id, error_response = verify_token(request.args.get('access_token'))
+    if error_response:
+        return error_response
+
+    heartbeat_interval = float(os.getenv('FEED_STREAM_HEARTBEAT', 15))
+
+    def generate():
+        subscription = events.subscribe()
+        try:
+            # Ask the browser to wait a little before reconnecting after a dropped connection
+            yield "retry: 5000\n\n"
+            while True:
+                event = subscription.get(heartbeat_interval)
+                if event is None:
+                    # Comment line, keeps proxies from closing the idle connection
+                    yield ": heartbeat\n\n"
+                    continue
+                yield events.sse_message(event)
+        finally:
+            events.unsubscribe(subscription)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Stop nginx from buffering the stream
+        'X-Accel-Buffering': 'no',
+    })
 
 @app.route('/api/vote', methods=['POST'])
 @token_required
+@rate_limited('vote')
 def cast_vote(current_user_id):
     data = request.get_json()
     post_id = data.get('PostId')
@@ -223,13 +630,92 @@ def cast_vote(current_user_id):
     if not post_id or not option_id:
         return make_response(jsonify({"error": "Missing PostId or OptionId"}), 400)
 
+    if vote_queue.enabled():
+        try:
+            post_id = int(post_id)
+            option_id = int(option_id)
+        except (TypeError, ValueError):
+            return make_response(jsonify({"error": "Invalid PostId or OptionId format"}), 400)
+        status = vote_queue.get_queue().submit_poll_vote(current_user_id, post_id, option_id)
+        if status == "invalid":
+            archived = archived_post_response(post_id)
+            if archived is not None:
+                return archived
+        return vote_submission_response(status, "Vote cast successfully", "Failed to cast vote")
+
+    duplicate = already_voted('poll', current_user_id, post_id)
+    if duplicate is not None:
+        return duplicate
+
     if db_queries.record_poll_vote(current_user_id, post_id, option_id):
+        vote_index.record('poll', current_user_id, post_id)
         return jsonify({"message": "Vote cast successfully"}), 202
     else:
-        return make_response(jsonify({"error": "Failed to cast vote"}), 500)
+        return archived_post_response(post_id) or make_response(jsonify({"error": "Failed to cast vote"}), 500)
+
+# A 409 for a write to a post that has been moved to the archive (read-only), otherwise None.
+# Only asked once a write has failed or found no post, so normal writes pay nothing for it.
+def archived_post_response(post_id):
+    if db_queries.is_post_archived(post_id):
+        return make_response(jsonify({"error": "Post is archived"}), 409)
+    return None
+
+# A 409 if user_id has already voted on post_id, otherwise None. Only asks the database when the
+# vote index cannot rule it out, the unique keys remain the real check. Without a warmed index
+# (disabled or still warming) there is no pre-check at all, and duplicates fail on the unique keys.
+def already_voted(kind, user_id, post_id):
+    if not vote_index.ready():
+        return None
+    try:
+        post_id = int(post_id)
+    except (TypeError, ValueError):
+        return None
+    if vote_index.might_have_voted(kind, user_id, post_id) and db_queries.has_voted(kind, user_id, post_id):
+        return make_response(jsonify({"error": "You have already voted on this post"}), 409)
+    return None
+
+# Maps a vote_queue submission status onto the endpoint's response
+def vote_submission_response(status, success_message, failure_message):
+    if status == "queued":
+        return jsonify({"message": success_message}), 202
+    elif status == "duplicate":
+        return make_response(jsonify({"error": "You have already voted on this post"}), 409)
+    elif status == "invalid":
+        return make_response(jsonify({"error": "Invalid vote"}), 400)
+    else:
+        return make_response(jsonify({"error": failure_message}), 500)
+
+# Short-lived token authorising one vote on one VoteItem
+def create_vote_token(user_id, post_id):
+    vote_token_payload = {
+        'user_id': user_id,
+        'post_id': post_id,
+        'purpose': 'item_vote',
+        'exp': datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=5) # Token is only valid for 5 mins
+    }
+    return jwt.encode(vote_token_payload, app.config['SECRET_KEY'], algorithm="HS256")
+
+# Issued when the user opens the voting UI of a VoteItem, rather than for every item on every feed load
+@app.route('/api/posts/<int:post_id>/vote-token', methods=['POST'])
+@token_required
+def issue_vote_token(current_user_id, post_id):
+    state = db_queries.get_vote_item_state(current_user_id, post_id)
+    if state is None:
+        return make_response(jsonify({"error": "Failed to check the post"}), 500)
+    if state == "not_found":
+        return archived_post_response(post_id) or make_response(jsonify({"error": "Post not found"}), 404)
+
+    post_type, has_voted = state
+    if post_type != 'VoteItem':
+        return make_response(jsonify({"error": "Post is not a vote item"}), 400)
+    if has_voted:
+        return make_response(jsonify({"error": "You have already voted on this item"}), 409)
+
+    return jsonify({"voteAuthToken": create_vote_token(current_user_id, post_id)}), 200
 
 @app.route('/api/item-votes', methods=['POST'])
 @token_required
+@rate_limited('item_vote')
 def cast_item_vote(current_user_id):
   data = request.get_json()
   post_id_str = data.get('PostId')
@@ -252,10 +738,23 @@ def cast_item_vote(current_user_id):
     if decoded_token['purpose'] != 'item_vote':
       return make_response(jsonify({"error": "Invalid token purpose"}), 403)
 
+    if vote_queue.enabled():
+      status = vote_queue.get_queue().submit_item_vote(current_user_id, post_id, choice)
+      if status == "invalid":
+        archived = archived_post_response(post_id)
+        if archived is not None:
+          return archived
+      return vote_submission_response(status, "Vote recorded successfully", "Failed to record vote")
+
+    duplicate = already_voted('item', current_user_id, post_id)
+    if duplicate is not None:
+      return duplicate
+
     if db_queries.record_item_vote(current_user_id, post_id, choice):
+      vote_index.record('item', current_user_id, post_id)
       return jsonify({"message": "Vote recorded successfully"}), 202
     else:
-      return make_response(jsonify({"error": "Failed to record vote"}), 500)
+      return archived_post_response(post_id) or make_response(jsonify({"error": "Failed to record vote"}), 500)
       
   except jwt.ExpiredSignatureError:
     return make_response(jsonify({"error": "Vote token has expired"}), 401)
@@ -267,8 +766,24 @@ def cast_item_vote(current_user_id):
     print(f"An unexpected error occurred in cast_item_vote: {e}")
     return make_response(jsonify({"error": "An internal server error occurred"}), 500)
 
+# Vote results, with validators so clients that poll get a cheap 304 when nothing changed
+@app.route('/api/posts/<int:post_id>/results', methods=['GET'])
+@token_required
+def get_post_results(current_user_id, post_id):
+    results = db_queries.get_post_results(post_id)
+    if results is None:
+        return make_response(jsonify({"error": "Failed to load results"}), 500)
+    if results == "not_found":
+        return make_response(jsonify({"error": "Post not found"}), 404)
+    if results == "no_results":
+        return make_response(jsonify({"error": "This post has no vote results"}), 400)
+
+    last_modified = results.pop("LastModified")
+    return conditional_json(results, last_modified)
+
 @app.route('/api/comments', methods=['POST'])
 @token_required
+@rate_limited('comment')
 def post_comment(current_user_id):
     data = request.get_json()
     post_id = data.get('postId')
@@ -284,6 +799,11 @@ def post_comment(current_user_id):
     allow_comments = db_queries.get_post_allow_comments(post_id)
     if allow_comments is False:
         return make_response(jsonify({"error": "Comments are disabled for this post"}), 403)
+    # Not in Posts: archived posts are read-only
+    if allow_comments is None:
+        archived = archived_post_response(post_id)
+        if archived is not None:
+            return archived
 
     if db_queries.create_comment(current_user_id, post_id, content):
         return jsonify({"message": "Comment added"}), 201
@@ -293,27 +813,46 @@ def post_comment(current_user_id):
 @app.route('/api/posts/<int:post_id>/comments', methods=['GET'])
 @token_required
 def get_post_comments(current_user_id, post_id):
-    # Check if comments are allowed on this post
-    allow_comments = db_queries.get_post_allow_comments(post_id)
-    if allow_comments is False:
-        return jsonify({
-            "comments": [],
-            "page": 1,
-            "next_page": None
-        }), 200
-
-    # Get page number from query string, default to 1
-    page = request.args.get('page', 1, type=int)
-    per_page = 5 # Number of comments to load per click
-    offset = (page - 1) * per_page
-
-    comments = db_queries.get_comments_by_post(post_id, per_page, offset)
-    
-    return jsonify({
-        "comments": comments,
-        "page": page,
-        "next_page": page + 1 if len(comments) == per_page else None
-    }), 200
+    after = None
+    if request.args.get('cursor'):
+        try:
+            after = decode_cursor(request.args['cursor'])
+        except ValueError:
+            return make_response(jsonify({"error": "Invalid cursor"}), 400)
+
+    # One query returns the page, or nothing if the post does not exist or has comments turned off
+    page = db_queries.get_comments_by_post(post_id, after, COMMENTS_PAGE_SIZE)
+    return conditional_json(page)
+
+# Full-text search: ?q= words, optional ?type=Poll,Announcement, ?limit= and the ?cursor= of the last page.
+# Results are posts, best match first, see db_queries.search_posts.
+@app.route('/api/search', methods=['GET'])
+@token_required
+def search(current_user_id):
+    query = request.args.get('q', '').strip()
+    if not query or len(query) > 200:
+        return make_response(jsonify({"error": "q must be between 1 and 200 characters"}), 400)
+
+    limit = request.args.get('limit', FEED_PAGE_SIZE, type=int)
+    if limit < 1 or limit > FEED_PAGE_MAX:
+        return make_response(jsonify({"error": f"limit must be between 1 and {FEED_PAGE_MAX}"}), 400)
+
+    post_types = [name for name in request.args.get('type', '').split(',') if name]
+    for post_type in post_types:
+        if post_type not in POST_TYPES:
+            return make_response(jsonify({"error": f"type must be one of: {', '.join(POST_TYPES)}"}), 400)
+
+    after = None
+    if request.args.get('cursor'):
+        try:
+            after = decode_score_cursor(request.args['cursor'])
+        except ValueError:
+            return make_response(jsonify({"error": "Invalid cursor"}), 400)
+
+    results = db_queries.search_posts(query, post_types, after, limit)
+    if results is None:
+        return make_response(jsonify({"error": "Search failed"}), 500)
+    return jsonify(results), 200
 
 if __name__ == '__main__':
   app.run(debug=True, port=5000)
\ No newline at end of file
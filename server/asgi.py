@@ -0,0 +1,225 @@
+# Async serving mode, run from the server directory with an ASGI server, e.g.:
+#   hypercorn asgi:application --bind 0.0.0.0:5000
+#   uvicorn asgi:application --port 5000 --workers 4
+#
+# The hot routes (register, login, profile, feed, comment pages) are served natively by a Quart
+# app on an aiomysql pool, with bcrypt offloaded to passwords' bounded process pool so it never
+# blocks the event loop. The live feed stream is served natively too, so an open stream costs a
+# waiting coroutine rather than a thread. Every other route is forwarded to the existing Flask app
+# (app.py), so the full API and its JSON contracts are the same in both modes. Forwarded requests
+# run on a pool of ASGI_WSGI_THREADS threads (default 16), which bounds how many of them can be
+# waiting on MySQL at once; keep it near the Flask app's DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW.
+#
+# Quart: https://quart.palletsprojects.com/
+from quart import Quart, jsonify, request, make_response
+# Quart-CORS: https://github.com/pgjones/quart-cors
+from quart_cors import cors
+# a2wsgi: https://github.com/abersheeran/a2wsgi
+from a2wsgi import WSGIMiddleware
+# PyMySQL (used by aiomysql): https://pymysql.readthedocs.io/
+import pymysql
+from werkzeug.exceptions import HTTPException
+from functools import wraps
+import os
+# (local modules)
+import app as flask_app
+import auth
+import db_async
+import events
+import json_provider
+import passwords
+from cursors import decode_cursor
+
+async_app = cors(Quart(__name__), allow_origin="*")
+async_app.config['SECRET_KEY'] = flask_app.app.config['SECRET_KEY']
+# Same JSON bytes, and so the same ETags, as the Flask app
+json_provider.init_app(async_app)
+
+@async_app.after_serving
+async def shutdown():
+    await db_async.close_pool()
+
+# Async counterpart of app.token_required
+def token_required(func):
+    @wraps(func)
+    async def decorated(*args, **kwargs):
+        token = None
+        if 'Authorization' in request.headers:
+            try:
+                token = auth.bearer_token(request.headers['Authorization'])
+            except ValueError as e:
+                return await make_response(jsonify({"error": str(e)}), 401)
+
+        current_user_id, error = auth.check_token(token, async_app.config['SECRET_KEY'])
+        if error:
+            return await make_response(jsonify({"error": error}), 401)
+        return await func(current_user_id, *args, **kwargs)
+
+    return decorated
+
+# Async counterpart of app.conditional_json: the same ETag over the same bytes, and a 304 with no
+# body when the client's copy still matches
+async def conditional_json(body):
+    response = await make_response(jsonify(body), 200)
+    etag = flask_app.json_etag(await response.get_data())
+    if request.if_none_match.contains_weak(etag):
+        response = await make_response("", 304)
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    response.cache_control.private = True
+    return response
+
+async def password_pool_busy_response(busy):
+    response = await make_response(jsonify({"error": "Server is busy, please try again shortly"}), 503)
+    response.headers['Retry-After'] = str(busy.retry_after)
+    return response
+
+@async_app.route('/api/users/register', methods=['POST'])
+async def register_user():
+    data = await request.get_json()
+    username = data.get('username')
+    email = data.get('email')
+    password = data.get('password')
+
+    error = flask_app.registration_error(username, email, password)
+    if error:
+        return await make_response(jsonify({"error": error}), 400)
+
+    try:
+        hashed_password = await passwords.hash_password_async(password)
+    except passwords.PasswordPoolBusy as busy:
+        return await password_pool_busy_response(busy)
+
+    try:
+        await db_async.create_user(username, email, hashed_password)
+        return jsonify({"message": "User registered successfully"}), 201
+    except pymysql.err.IntegrityError as err:
+        if err.args[0] == 1062: # Duplicate entry
+            return await make_response(jsonify({"error": "Username or Email already exists"}), 409)
+        return await make_response(jsonify({"error": f"Database error: {err}"}), 500)
+    except pymysql.err.MySQLError as err:
+        return await make_response(jsonify({"error": f"Database error: {err}"}), 500)
+
+@async_app.route('/api/users/login', methods=['POST'])
+async def login_user():
+    data = await request.get_json()
+    email = data.get('email')
+    password = data.get('password')
+
+    error = flask_app.login_error(email, password)
+    if error:
+        return await make_response(jsonify({"error": error}), 400)
+
+    user_record = await db_async.find_user_by_email(email)
+    if user_record is None:
+        return await make_response(jsonify({"error": "Invalid email or password"}), 401)
+
+    user_id, stored_password_hash = user_record
+    try:
+        password_ok = await passwords.check_password_async(password, stored_password_hash)
+    except passwords.PasswordPoolBusy as busy:
+        return await password_pool_busy_response(busy)
+
+    if password_ok:
+        if passwords.needs_rehash(stored_password_hash):
+            try:
+                await db_async.update_password_hash(user_id, await passwords.hash_password_async(password))
+            except passwords.PasswordPoolBusy:
+                pass
+        token = flask_app.create_auth_token(user_id)
+        return jsonify({"message": "Login successful", "token": token}), 200
+    return await make_response(jsonify({"error": "Invalid email or password"}), 401)
+
+@async_app.route('/api/profile')
+@token_required
+async def get_profile(current_user_id):
+    user = await db_async.get_user_profile_by_id(current_user_id)
+    if not user:
+        return await make_response(jsonify({"error": "User not found"}), 404)
+    return jsonify({"user": user}), 200
+
+@async_app.route('/api/feed', methods=['GET'])
+@token_required
+async def get_feed(current_user_id):
+    limit = request.args.get('limit', flask_app.FEED_PAGE_SIZE, type=int)
+    if limit < 1 or limit > flask_app.FEED_PAGE_MAX:
+        return await make_response(jsonify({"error": f"limit must be between 1 and {flask_app.FEED_PAGE_MAX}"}), 400)
+
+    after = None
+    if request.args.get('cursor'):
+        try:
+            after = decode_cursor(request.args['cursor'])
+        except ValueError:
+            return await make_response(jsonify({"error": "Invalid cursor"}), 400)
+
+    includes = {name for name in request.args.get('include', '').split(',') if name}
+    if includes - flask_app.FEED_INCLUDES:
+        return await make_response(jsonify({"error": f"include must be one of: {', '.join(sorted(flask_app.FEED_INCLUDES))}"}), 400)
+    comments_per_post = flask_app.COMMENTS_PAGE_SIZE if 'comments' in includes else 0
+
+    feed_data = await db_async.get_feed_posts(current_user_id, after, limit, comments_per_post)
+    return await conditional_json(feed_data)
+
+@async_app.route('/api/posts/<int:post_id>/comments', methods=['GET'])
+@token_required
+async def get_post_comments(current_user_id, post_id):
+    after = None
+    if request.args.get('cursor'):
+        try:
+            after = decode_cursor(request.args['cursor'])
+        except ValueError:
+            return await make_response(jsonify({"error": "Invalid cursor"}), 400)
+
+    # One query returns the page, or nothing if the post does not exist or has comments turned off
+    page = await db_async.get_comments_by_post(post_id, after, flask_app.COMMENTS_PAGE_SIZE)
+    return await conditional_json(page)
+
+# Async counterpart of app.stream_feed
+@async_app.route('/api/feed/stream', methods=['GET'])
+async def stream_feed():
+    current_user_id, error = auth.check_token(request.args.get('access_token'), async_app.config['SECRET_KEY'])
+    if error:
+        return await make_response(jsonify({"error": error}), 401)
+
+    heartbeat_interval = float(os.getenv('FEED_STREAM_HEARTBEAT', 15))
+
+    async def generate():
+        subscription = events.subscribe_async()
+        try:
+            yield b"retry: 5000\n\n"
+            while True:
+                event = await subscription.get(heartbeat_interval)
+                if event is None:
+                    yield b": heartbeat\n\n"
+                    continue
+                yield events.sse_message(event).encode()
+        finally:
+            events.unsubscribe(subscription)
+
+    response = await make_response(generate(), 200, {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    # The stream stays open until the client goes away
+    response.timeout = None
+    return response
+
+# Everything else goes to the Flask app, each request on a thread of its own
+flask_asgi = WSGIMiddleware(flask_app.app, workers=int(os.getenv('ASGI_WSGI_THREADS', 16)))
+_route_adapter = async_app.url_map.bind("")
+
+def _served_natively(scope):
+    try:
+        _route_adapter.match(scope['path'], method=scope['method'])
+        return True
+    except HTTPException:
+        return False
+
+# The ASGI application
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and not _served_natively(scope):
+        await flask_asgi(scope, receive, send)
+    else:
+        # Async routes, plus the lifespan events that open and close the aiomysql pool
+        await async_app(scope, receive, send)
@@ -0,0 +1,69 @@
+import hashlib
+import os
+import threading
+import time
+# PyJWT: https://pyjwt.readthedocs.io/
+import jwt
+# (local module)
+from cache import TTLCache
+
+# Token checks shared by the Flask app (app.py) and its async variant (asgi.py).
+# Neither function knows about a web framework, callers turn the error message into a 401.
+#
+# A client sends the same token on every request, so successful verifications are remembered by
+# a hash of the token until the token expires, and repeated requests skip the HMAC check.
+# TOKEN_CACHE_SIZE caps the number of tokens kept (0 disables the cache).
+
+_verified = None
+_verified_lock = threading.Lock()
+
+def _verified_tokens():
+    global _verified
+    with _verified_lock:
+        if _verified is None:
+            _verified = TTLCache(maxsize=int(os.getenv('TOKEN_CACHE_SIZE', 10000)))
+        return _verified
+
+# Returns the token from an "Authorization: Bearer <token>" header, raises ValueError if malformed
+def bearer_token(auth_header):
+    parts = auth_header.split(" ")
+    if len(parts) < 2:
+        raise ValueError("Token is in incorrect format!")
+    return parts[1]
+
+# Returns (user_id, None) for a valid token, or (None, error message)
+def check_token(token, secret_key):
+    # If the token is not found, return an error
+    if not token:
+        return None, "Token is missing!"
+
+    cache = _verified_tokens() if int(os.getenv('TOKEN_CACHE_SIZE', 10000)) > 0 else None
+    # The secret is part of the key so a changed SECRET_KEY can't reuse earlier results
+    token_key = hashlib.sha256(f"{secret_key}:{token}".encode()).hexdigest()
+    if cache is not None:
+        user_id = cache.get(token_key)
+        if user_id is not None:
+            return user_id, None
+
+    # Try to decode the token to verify it
+    try:
+        # Verify the token using secret key
+        data = jwt.decode(token, secret_key, algorithms=["HS256"])
+    except jwt.ExpiredSignatureError:
+        return None, "Token has expired!"
+    except jwt.InvalidTokenError:
+        return None, "Token is invalid!"
+    except jwt.DecodeError:
+        return None, "Token could not be decoded!"
+
+    # Get the user's data from the token's payload
+    user_id = data['user_id']
+    if cache is not None and 'exp' in data:
+        # Kept until the token expires, after which jwt.decode reports it as expired again
+        remaining = data['exp'] - time.time()
+        if remaining > 0:
+            cache.set(token_key, user_id, ttl=remaining)
+    return user_id, None
+
+def stats():
+    return _verified_tokens().stats()
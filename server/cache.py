@@ -0,0 +1,171 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+# Small key/value caches shared by the server modules.
+# TTLCache lives in the process, RedisCache talks to a local Redis (or anything that speaks its protocol)
+# so several gunicorn workers see the same entries. Both have the same get/get_many/set/delete/incr interface.
+
+
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (expires_at, value), least recently used first
+        self._data = OrderedDict()
+        # Counters never expire or get evicted, see incr()
+        self._counters = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def get_many(self, keys):
+        # Returns {key: value} for the keys that were found
+        found = {}
+        for key in keys:
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                found[key] = value
+        return found
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def get_counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class RedisCache:
+    def __init__(self, url, prefix, ttl=60):
+        # redis-py: https://redis-py.readthedocs.io/
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _key(self, key):
+        return f"{self.prefix}:{key}"
+
+    def _count(self, hits=0, misses=0, errors=0):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.errors += errors
+
+    # A Redis outage must not take the API down, so every failure is treated as a cache miss
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        try:
+            values = self._redis.mget([self._key(key) for key in keys])
+        except Exception as e:
+            print(f"Error reading from Redis cache: {e}")
+            self._count(misses=len(keys), errors=1)
+            return {}
+        found = {key: pickle.loads(value) for key, value in zip(keys, values) if value is not None}
+        self._count(hits=len(found), misses=len(keys) - len(found))
+        return found
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        try:
+            self._redis.set(self._key(key), pickle.dumps(value), ex=ttl or None)
+        except Exception as e:
+            print(f"Error writing to Redis cache: {e}")
+            self._count(errors=1)
+
+    def delete(self, *keys):
+        if not keys:
+            return
+        try:
+            self._redis.delete(*[self._key(key) for key in keys])
+        except Exception as e:
+            print(f"Error deleting from Redis cache: {e}")
+            self._count(errors=1)
+
+    def incr(self, key):
+        try:
+            return self._redis.incr(self._key(key))
+        except Exception as e:
+            print(f"Error incrementing Redis counter: {e}")
+            self._count(errors=1)
+            return None
+
+    def get_counter(self, key):
+        try:
+            value = self._redis.get(self._key(key))
+        except Exception as e:
+            print(f"Error reading Redis counter: {e}")
+            self._count(errors=1)
+            return None
+        return int(value) if value is not None else 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "redis",
+                "hits": self.hits,
+                "misses": self.misses,
+                "errors": self.errors,
+            }
+
+
+_MISSING = object()
@@ -0,0 +1,64 @@
+import gzip
+import os
+# Flask: https://flask.palletsprojects.com/
+from flask import request
+
+# Response compression for the Flask app, negotiated from Accept-Encoding.
+# Brotli is used when the client accepts it and the brotli package is installed, gzip otherwise.
+# Bodies below COMPRESS_MIN_SIZE bytes (default 1024) are sent as they are, as are streamed responses
+# (the SSE feed stream must reach the client event by event) and anything already encoded.
+#
+# A compressed body is a different representation, so its ETag is made weak: conditional GETs
+# (which only use weak comparison) keep working while caches won't mix encodings up.
+try:
+    # Brotli: https://pypi.org/project/Brotli/
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/html', 'text/plain', 'text/csv', 'application/x-ndjson')
+
+
+# accept_encodings is werkzeug's parsed Accept-Encoding, indexing it gives the quality (0 = refused)
+def choose_encoding(accept_encodings):
+    if brotli is not None and accept_encodings['br'] > 0:
+        return 'br'
+    if accept_encodings['gzip'] > 0:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        # Quality 4 is in the same CPU range as gzip level 6 and still smaller
+        return brotli.compress(data, quality=int(os.getenv('COMPRESS_BROTLI_QUALITY', 4)))
+    return gzip.compress(data, compresslevel=int(os.getenv('COMPRESS_GZIP_LEVEL', 6)))
+
+
+def init_app(app):
+    min_size = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+
+    @app.after_request
+    def compress_response(response):
+        response.vary.add('Accept-Encoding')
+        if (response.status_code < 200 or response.status_code in (204, 206, 304)
+                or response.is_streamed or response.direct_passthrough
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_TYPES
+                or request.method == 'HEAD'):
+            return response
+
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+
+        response.set_data(compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
@@ -0,0 +1,34 @@
+import base64
+import datetime
+
+# Opaque keyset pagination cursors.
+# A cursor is the (timestamp, id) of the last row the client has seen, base64 encoded
+# so clients treat it as a token rather than something to build themselves.
+
+def encode_cursor(timestamp, row_id):
+    raw = f"{timestamp.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+# Raises ValueError if the cursor is malformed
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        timestamp_str, row_id_str = raw.split('|')
+        return datetime.datetime.fromisoformat(timestamp_str), int(row_id_str)
+    except (UnicodeError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+# Search results are ordered by relevance, so their cursor holds the (score, id) of the last row.
+# repr() keeps every digit of the float, so the score compares equal when it comes back.
+def encode_score_cursor(score, row_id):
+    raw = f"{float(score)!r}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+# Raises ValueError if the cursor is malformed
+def decode_score_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        score_str, row_id_str = raw.split('|')
+        return float(score_str), int(row_id_str)
+    except (UnicodeError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
@@ -0,0 +1,186 @@
+import os
+import asyncio
+# aiomysql: https://aiomysql.readthedocs.io/
+import aiomysql
+# (local modules)
+import db_queries
+import feed_cache
+import user_cache
+
+# Async versions of the db_queries functions behind the routes that asgi.py serves natively.
+# The SQL and the row shaping come from db_queries (the _*_query builders, _build_feed_posts,
+# _apply_user_state), only the I/O is different, so both servers return identical JSON.
+# Errors are printed and turned into the same "nothing found" results as in db_queries.
+
+_pool = None
+_pool_lock = asyncio.Lock()
+
+async def get_pool():
+    global _pool
+    async with _pool_lock:
+        if _pool is None:
+            size = int(os.getenv('DB_POOL_SIZE', 5))
+            _pool = await aiomysql.create_pool(
+                host=os.getenv('DB_HOST'),
+                port=int(os.getenv('DB_PORT')),
+                user=os.getenv('DB_USER'),
+                password=os.getenv('DB_PASSWORD'),
+                db=os.getenv('DB_NAME'),
+                minsize=size,
+                maxsize=size + int(os.getenv('DB_POOL_MAX_OVERFLOW', 10)),
+                pool_recycle=int(os.getenv('DB_POOL_RECYCLE', 3600)),
+                # Reads must not keep a REPEATABLE READ snapshot open on a pooled connection
+                autocommit=True,
+                # Same session settings as db_queries._connect
+                init_command="SET time_zone = '+00:00'",
+            )
+        return _pool
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        await _pool.wait_closed()
+        _pool = None
+
+async def _fetchone(sql, params, dictionary=False):
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor if dictionary else aiomysql.Cursor) as cursor:
+            await cursor.execute(sql, params)
+            return await cursor.fetchone()
+
+async def find_user_by_email(email):
+    try:
+        return await _fetchone("SELECT UserID, PasswordHash FROM Users WHERE Email = %s", (email,))
+    except aiomysql.Error as e:
+        print(f"Error in find_user_by_email: {e}")
+        return None
+
+# Lets a duplicate key error (1062) propagate so the route can answer 409
+async def create_user(username, email, hashed_password):
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute("INSERT INTO Users (Username, Email, PasswordHash) VALUES (%s, %s, %s)", (username, email, hashed_password))
+            return True
+
+async def update_password_hash(user_id, hashed_password):
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute("UPDATE Users SET PasswordHash = %s WHERE UserID = %s", (hashed_password, user_id))
+                return True
+    except aiomysql.Error as e:
+        print(f"Error in update_password_hash: {e}")
+        return False
+
+# Shares user_cache with db_queries.get_user_profile_by_id
+async def get_user_profile_by_id(user_id):
+    user_profile = user_cache.get_user(user_id)
+    if user_profile is not None:
+        return user_profile
+    try:
+        user_profile = await _fetchone("SELECT UserID, Username, Email, Role, RegistrationTimestamp FROM Users WHERE UserID = %s", (user_id,), dictionary=True)
+    except aiomysql.Error as e:
+        print(f"Error in get_user_profile_by_id: {e}")
+        return None
+    if user_profile:
+        user_cache.set_user(user_profile)
+    return user_profile
+
+async def get_comments_by_post(post_id, after=None, limit=25):
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(*db_queries._comments_query(post_id, after, limit))
+                rows = await cursor.fetchall()
+                # No row at all means the post is not in Posts, it may have been archived
+                if not rows and db_queries.archive_reads():
+                    await cursor.execute(*db_queries._comments_query(post_id, after, limit, archived=True))
+                    rows = await cursor.fetchall()
+                return db_queries._comments_page_from_rows(rows, limit)
+    except aiomysql.Error as e:
+        print(f"Error in get_comments_by_post: {e}")
+        return {"comments": [], "next_cursor": None}
+
+# Same as db_queries.get_feed_posts, including the shared feed cache and the archive
+async def get_feed_posts(user_id, after=None, limit=20, comments_per_post=0):
+    page = {"posts": [], "next_cursor": None}
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                page_key = feed_cache.page_key(after, limit)
+                cached_page = feed_cache.get_page(page_key)
+                post_rows = None
+                if cached_page is not None:
+                    post_ids = cached_page['post_ids']
+                    next_cursor = cached_page['next_cursor']
+                else:
+                    await cursor.execute(*db_queries._feed_page_query(after, limit))
+                    page_rows = list(await cursor.fetchall())
+                    if len(page_rows) <= limit and db_queries.archive_reads():
+                        archive_after = after
+                        if page_rows:
+                            archive_after = (page_rows[-1]['CreationTimestamp'], page_rows[-1]['PostID'])
+                        await cursor.execute(*db_queries._feed_page_query(archive_after, limit - len(page_rows), archived=True))
+                        page_rows += await cursor.fetchall()
+                    post_rows, post_ids, next_cursor = db_queries._feed_page_from_rows(page_rows, limit)
+                    feed_cache.set_page(page_key, post_ids, next_cursor)
+
+                if not post_ids:
+                    return page
+
+                shared_posts = feed_cache.get_posts(post_ids)
+                missing_ids = [post_id for post_id in post_ids if post_id not in shared_posts]
+                if missing_ids:
+                    if post_rows is None:
+                        await cursor.execute(*db_queries._feed_posts_by_id_query(missing_ids))
+                        missing_rows = list(await cursor.fetchall())
+                        found = {row['PostID'] for row in missing_rows}
+                        not_found = [post_id for post_id in missing_ids if post_id not in found]
+                        if not_found and db_queries.archive_reads():
+                            await cursor.execute(*db_queries._feed_posts_by_id_query(not_found, archived=True))
+                            missing_rows += await cursor.fetchall()
+                    else:
+                        missing = set(missing_ids)
+                        missing_rows = [row for row in post_rows if row['PostID'] in missing]
+
+                    option_rows = []
+                    for archived, ids in db_queries._split_archived(missing_rows):
+                        await cursor.execute(*db_queries._feed_options_query(ids, archived))
+                        option_rows += await cursor.fetchall()
+
+                    built_posts = db_queries._build_feed_posts(missing_rows, option_rows)
+                    feed_cache.set_posts(built_posts)
+                    for post in built_posts:
+                        shared_posts[post['PostID']] = post
+
+                # Vote state of archived posts is in the archived vote tables
+                page_posts = [shared_posts[post_id] for post_id in post_ids if post_id in shared_posts]
+                user_voted_polls = set()
+                user_voted_items = set()
+                for archived, ids in db_queries._split_archived(page_posts):
+                    poll_votes_query, item_votes_query = db_queries._user_votes_queries(user_id, ids, archived)
+                    await cursor.execute(*poll_votes_query)
+                    user_voted_polls.update(row['PostID'] for row in await cursor.fetchall())
+                    await cursor.execute(*item_votes_query)
+                    user_voted_items.update(row['PostID'] for row in await cursor.fetchall())
+
+                posts = [dict(post) for post in page_posts]
+                page["posts"] = db_queries._apply_user_state(posts, user_voted_polls, user_voted_items)
+                page["next_cursor"] = next_cursor
+
+                if comments_per_post > 0:
+                    comment_rows = []
+                    for archived, ids in db_queries._split_archived(page_posts):
+                        await cursor.execute(*db_queries._feed_comments_query(ids, comments_per_post, archived))
+                        comment_rows += await cursor.fetchall()
+                    db_queries._attach_comments(page["posts"], comment_rows, comments_per_post)
+    except aiomysql.Error as e:
+        print(f"Error in get_feed_posts: {e}")
+        return {"posts": [], "next_cursor": None}
+    return page
@@ -0,0 +1,234 @@
+import os
+import time
+import threading
+from collections import deque
+# (local module)
+from statements import StatementCache, StatementCursor, per_connection_limit
+
+# A small process-wide connection pool for mysql-connector.
+# mysql.connector.pooling.MySQLConnectionPool has a fixed size and no checkout
+# timeout, overflow or recycling, so we keep our own.
+# Connections handed out are wrapped in PooledConnection, whose close() puts the
+# connection back in the pool instead of closing the socket, so the existing
+# "conn.close()" in every db_queries function keeps working unchanged.
+# Each raw connection also carries a StatementCache (see statements.py) for as long as it is open.
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, connect, size=5, max_overflow=10, timeout=30.0, recycle=3600, pre_ping=True, statement_cache_size=0):
+        # connect: zero argument function returning a new raw connection
+        self._connect = connect
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self.statement_cache_size = statement_cache_size
+        # Lowered to the server's limit by the first connection, see statements.per_connection_limit
+        self._statement_limit = None
+        # raw connection -> StatementCache
+        self._statements = {}
+        # Pools must not be shared across fork() (gunicorn workers), so remember who made us
+        self.pid = os.getpid()
+
+        self._cond = threading.Condition()
+        # Idle connections as (raw_connection, created_at, returned_at), most recently used last
+        self._idle = deque()
+        self._open = 0
+
+        self._checked_out = 0
+        self._waiting = 0
+        self._created = 0
+        self._recycled = 0
+        self._discarded = 0
+        self._timeouts = 0
+        self._acquire_time_total = 0.0
+        self._acquires = 0
+
+    def acquire(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        entry = None
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._open < self.size + self.max_overflow:
+                        # Reserve a slot now, the connection itself is created outside the lock
+                        self._open += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(f"Timed out after {self.timeout}s waiting for a database connection")
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+            self._checked_out += 1
+
+        try:
+            if entry is not None:
+                entry = self._check_idle_entry(entry)
+            if entry is None:
+                raw = self._connect()
+                now = time.monotonic()
+                entry = (raw, now, now)
+                with self._cond:
+                    self._created += 1
+        except Exception:
+            # Could not produce a usable connection, give the slot back
+            with self._cond:
+                self._open -= 1
+                self._checked_out -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._acquires += 1
+            self._acquire_time_total += time.monotonic() - start
+        return PooledConnection(self, entry[0], entry[1])
+
+    # Returns the entry if it is still usable, otherwise closes it and returns None
+    def _check_idle_entry(self, entry):
+        raw, created_at, returned_at = entry
+        if self.recycle is not None and self.recycle >= 0 and time.monotonic() - returned_at > self.recycle:
+            # Idle for longer than the recycle window, MySQL may already have dropped it (wait_timeout)
+            self._close_raw(raw)
+            with self._cond:
+                self._recycled += 1
+            return None
+        if self.pre_ping:
+            try:
+                alive = raw.is_connected()
+            except Exception:
+                alive = False
+            if not alive:
+                self._close_raw(raw)
+                with self._cond:
+                    self._discarded += 1
+                return None
+        return entry
+
+    def _release(self, raw, created_at, discard=False):
+        if not discard:
+            try:
+                # Never hand the next caller a half finished transaction
+                if raw.in_transaction:
+                    raw.rollback()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            self._checked_out -= 1
+            # Connections beyond the core size are overflow and are closed when returned
+            if discard or len(self._idle) >= self.size:
+                self._open -= 1
+                if discard:
+                    self._discarded += 1
+                close_it = True
+            else:
+                self._idle.append((raw, created_at, time.monotonic()))
+                close_it = False
+            self._cond.notify()
+
+        if close_it:
+            self._close_raw(raw)
+
+    def _close_raw(self, raw):
+        with self._cond:
+            statements = self._statements.pop(raw, None)
+        if statements is not None:
+            statements.close()
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    # Called with raw checked out, so only the pool lock guards the dict itself
+    def statement_cache(self, raw):
+        with self._cond:
+            statements = self._statements.get(raw)
+        if statements is not None:
+            return statements
+        if self._statement_limit is None:
+            try:
+                self._statement_limit = per_connection_limit(raw, self.statement_cache_size)
+            except Exception as e:
+                print(f"Error reading the prepared statement limit, not caching statements: {e}")
+                self._statement_limit = 0
+        statements = StatementCache(raw, self._statement_limit)
+        with self._cond:
+            self._statements[raw] = statements
+        return statements
+
+    def dispose(self):
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._open -= len(idle)
+        for raw, _, _ in idle:
+            self._close_raw(raw)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self.size,
+                "max_overflow": self.max_overflow,
+                "open": self._open,
+                "idle": len(self._idle),
+                "checked_out": self._checked_out,
+                "waiting": self._waiting,
+                "created": self._created,
+                "recycled": self._recycled,
+                "discarded": self._discarded,
+                "timeouts": self._timeouts,
+                "statement_cache_size": self._statement_limit,
+                "avg_acquire_ms": (self._acquire_time_total / self._acquires * 1000) if self._acquires else 0.0,
+            }
+
+
+class PooledConnection:
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+
+    def __getattr__(self, name):
+        # Only called for attributes not defined here, e.g. cursor(), commit(), rollback()
+        raw = self.__dict__.get('_raw')
+        if raw is None:
+            raise AttributeError(f"Connection has been returned to the pool (accessing '{name}')")
+        return getattr(raw, name)
+
+    # Prepared statements cached on this connection, see statements.py
+    def statement_cursor(self, dictionary=False):
+        if self._raw is None:
+            raise AttributeError("Connection has been returned to the pool (accessing 'statement_cursor')")
+        return StatementCursor(self._pool.statement_cache(self._raw), dictionary)
+
+    def is_connected(self):
+        if self._raw is None:
+            return False
+        return self._raw.is_connected()
+
+    def close(self):
+        # Return the connection to the pool. Liveness is checked on the next checkout
+        # (pre_ping), so returning does not cost a round trip.
+        raw = self._raw
+        if raw is None:
+            return
+        self._raw = None
+        self._pool._release(raw, self._created_at)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
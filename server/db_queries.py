@@ -1,24 +1,119 @@
+import functools
 import os
+import random
+import threading
+from collections import Counter
 import mysql.connector
-import jwt
-import datetime
 from mysql.connector import Error
+# (local modules)
+from db_pool import ConnectionPool, PoolTimeout
+import statements
+from cursors import encode_cursor, encode_score_cursor
+import feed_cache
+import user_cache
+import events
+import replicas
 
-def get_db_connection():
+# One pool per process, created on first use so that load_dotenv() in app.py has
+# already run and so that each forked gunicorn worker builds its own
+_pool = None
+_replica_set = None
+_pool_lock = threading.Lock()
+
+def _connect(host=None, port=None):
+    port_num = int(port or os.getenv('DB_PORT'))
+    return mysql.connector.connect(
+        host=host or os.getenv('DB_HOST'),
+        port=port_num,
+        user=os.getenv('DB_USER'),
+        password=os.getenv('DB_PASSWORD'),
+        database=os.getenv('DB_NAME'),
+        # The C extension blocks green threads, gunicorn.conf.py turns this on for gevent workers
+        use_pure=os.getenv('DB_USE_PURE', 'false').lower() in ('1', 'true', 'yes'),
+        # TIMESTAMPs are read and written as UTC, which is how jsonify and HTTP dates present them
+        time_zone='+00:00',
+    )
+
+def _new_pool(connect, size):
+    return ConnectionPool(
+        connect,
+        size=size,
+        max_overflow=int(os.getenv('DB_POOL_MAX_OVERFLOW', 10)),
+        timeout=float(os.getenv('DB_POOL_TIMEOUT', 10)),
+        # Seconds a connection may sit idle before it is replaced, keep below MySQL's wait_timeout
+        recycle=int(os.getenv('DB_POOL_RECYCLE', 3600)),
+        pre_ping=os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes'),
+        statement_cache_size=statements.configured_size(),
+    )
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = _new_pool(_connect, int(os.getenv('DB_POOL_SIZE', 5)))
+        return _pool
+
+# The DB_REPLICA_HOSTS replicas (see replicas.py), or None without any
+def _get_replica_set():
+    global _replica_set
+    hosts = replicas.parse_hosts(os.getenv('DB_REPLICA_HOSTS', ''), int(os.getenv('DB_PORT', 3306)))
+    if not hosts:
+        return None
+    with _pool_lock:
+        if _replica_set is None or _replica_set.pid != os.getpid():
+            size = int(os.getenv('DB_REPLICA_POOL_SIZE', os.getenv('DB_POOL_SIZE', 5)))
+            _replica_set = replicas.ReplicaSet(
+                [replicas.Replica(host, port, _new_pool(functools.partial(_connect, host, port), size)) for host, port in hosts],
+                eject_seconds=float(os.getenv('DB_REPLICA_EJECT_SECONDS', 30)),
+                max_lag=float(os.getenv('DB_REPLICA_MAX_LAG', 5)),
+                lag_check_seconds=float(os.getenv('DB_REPLICA_LAG_CHECK_SECONDS', 5)),
+            )
+        return _replica_set
+
+def _acquire(pool):
     try:
-      port_num = int(os.getenv('DB_PORT'))
-      conn = mysql.connector.connect(
-          host=os.getenv('DB_HOST'),
-          port=port_num,
-          user=os.getenv('DB_USER'),
-          password=os.getenv('DB_PASSWORD'),
-          database=os.getenv('DB_NAME'),
-      )
-      return conn
-    except Error as e:
+        return pool.acquire()
+    except (Error, PoolTimeout) as e:
         print(f"Error connecting to MySQL: {e}")
         return None
 
+def get_db_connection():
+    return _acquire(_get_pool())
+
+# Connection for the read-only functions: a replica, unless there are none, none is reachable and
+# caught up, or the current reader wrote within the last DB_REPLICA_PIN_SECONDS (replicas.pinned()).
+# Whatever a replica returns can be up to DB_REPLICA_MAX_LAG seconds old, and so can what the feed
+# cache keeps of it. The duplicate vote checks (check_poll_vote, get_vote_item_state, has_voted) stay
+# on the primary. Some checks in front of writes do read from here: get_post_allow_comments (before a
+# comment) and the profile behind get_user_role (before admin actions). A change to a post's comment
+# setting or to a user's role can therefore take up to the replica lag to be enforced.
+def get_read_connection():
+    replica_set = _get_replica_set()
+    if replica_set is not None and not replicas.pinned():
+        conn = replica_set.acquire()
+        if conn is not None:
+            return conn
+    return _acquire(_get_pool())
+
+def get_pool_stats():
+    return _get_pool().stats()
+
+def get_statement_stats():
+    return statements.stats()
+
+# Every db_queries function gets its cursor here. A prepared one runs each statement on the
+# connection's cached prepared statement for that SQL (see statements.py), so fetch its rows
+# before the next execute. prepared=False gives a plain cursor, for DDL and for multi-row
+# statements whose SQL changes with their size.
+def _cursor(conn, dictionary=False, prepared=True):
+    if prepared:
+        return conn.statement_cursor(dictionary)
+    return conn.cursor(dictionary=dictionary)
+
+def get_replica_stats():
+    replica_set = _get_replica_set()
+    return replica_set.stats() if replica_set is not None else None
+
 def find_user_by_email(email):
     conn = get_db_connection()
     if not conn:
@@ -26,8 +121,8 @@ def find_user_by_email(email):
     
     user_record = None
     try:
-        cursor = conn.cursor(prepared=True)
-        cursor.execute("SELECT UserID, PasswordHash FROM users WHERE Email = %s", (email,))
+        cursor = _cursor(conn)
+        cursor.execute("SELECT UserID, PasswordHash FROM Users WHERE Email = %s", (email,))
         user_record = cursor.fetchone() # Fetches one record, e.g., (1, 'some_hash_string')
     except Error as e:
         print(f"Error in find_user_by_email: {e}")
@@ -36,7 +131,7 @@ def find_user_by_email(email):
     finally:
         if conn.is_connected():
             cursor.close()
-            conn.close()
+        conn.close()
     return user_record
 
 def create_user(username, email, hashed_password):
@@ -46,8 +141,8 @@ def create_user(username, email, hashed_password):
         
     success = False
     try:
-        cursor = conn.cursor(prepared=True)
-        cursor.execute("INSERT INTO users (Username, Email, PasswordHash) VALUES (%s, %s, %s)", (username, email, hashed_password))
+        cursor = _cursor(conn)
+        cursor.execute("INSERT INTO Users (Username, Email, PasswordHash) VALUES (%s, %s, %s)", (username, email, hashed_password))
         conn.commit()
         success = True
     except Error as e:
@@ -57,55 +152,90 @@ def create_user(username, email, hashed_password):
     finally:
         if conn.is_connected():
             cursor.close()
-            conn.close()
+        conn.close()
     return success
 
-def get_user_profile_by_id(user_id):
+# Replaces a hash made with an outdated bcrypt cost, see passwords.needs_rehash
+def update_password_hash(user_id, hashed_password):
     conn = get_db_connection()
+    if not conn:
+        return False
+
+    success = False
+    try:
+        cursor = _cursor(conn)
+        cursor.execute("UPDATE Users SET PasswordHash = %s WHERE UserID = %s", (hashed_password, user_id))
+        conn.commit()
+        success = True
+    except Error as e:
+        print(f"Error in update_password_hash: {e}")
+        if conn.is_connected():
+            conn.rollback()
+    finally:
+        if conn.is_connected():
+            cursor.close()
+        conn.close()
+    return success
+
+# Read through user_cache, see there for how long a changed user can stay cached
+def get_user_profile_by_id(user_id):
+    user_profile = user_cache.get_user(user_id)
+    if user_profile is not None:
+        return user_profile
+
+    conn = get_read_connection()
     if not conn:
         return None
 
-    user_profile = None
     try:
-        cursor = conn.cursor(prepared=True, dictionary=True)
-        cursor.execute("SELECT UserID, Username, Email, Role, RegistrationTimestamp FROM users WHERE UserID = %s", (user_id,))
+        cursor = _cursor(conn, dictionary=True)
+        cursor.execute("SELECT UserID, Username, Email, Role, RegistrationTimestamp FROM Users WHERE UserID = %s", (user_id,))
         user_profile = cursor.fetchone()
+        if user_profile:
+            user_cache.set_user(user_profile)
     except Error as e:
         print(f"Error in get_user_profile_by_id: {e}")
     finally:
         if conn.is_connected():
             cursor.close()
-            conn.close()
+        conn.close()
     return user_profile
 
 def get_user_role(user_id):
+    user_profile = get_user_profile_by_id(user_id)
+    return user_profile['Role'] if user_profile else None
+
+def update_user_role(user_id, role):
     conn = get_db_connection()
     if not conn:
-        return None
+        return False
 
-    role = None
+    success = False
     try:
-        cursor = conn.cursor(prepared=True)
-        cursor.execute("SELECT Role FROM users WHERE UserID = %s", (user_id,))
-        result = cursor.fetchone()
-        if result:
-            role = result[0]
+        cursor = _cursor(conn)
+        cursor.execute("UPDATE Users SET Role = %s WHERE UserID = %s", (role, user_id))
+        conn.commit()
+        success = True
     except Error as e:
-        print(f"Error in get_user_role: {e}")
+        print(f"Error in update_user_role: {e}")
+        if conn.is_connected():
+            conn.rollback()
     finally:
         if conn.is_connected():
             cursor.close()
-            conn.close()
-    return role
+        conn.close()
+    if success:
+        user_cache.invalidate_user(user_id)
+    return success
 
 def get_post_allow_comments(post_id):
-    conn = get_db_connection()
+    conn = get_read_connection()
     if not conn:
         return None
 
     allow_comments = None
     try:
-        cursor = conn.cursor(prepared=True)
+        cursor = _cursor(conn)
         cursor.execute("SELECT AllowComments FROM Posts WHERE PostID = %s", (post_id,))
         result = cursor.fetchone()
         if result:
@@ -115,9 +245,47 @@ def get_post_allow_comments(post_id):
     finally:
         if conn.is_connected():
             cursor.close()
-            conn.close()
+        conn.close()
     return allow_comments
 
+# True when post_id has been moved to Posts_Archive (and so is read-only), False when it has not,
+# or None on error
+def is_post_archived(post_id):
+    if not archive_reads():
+        return False
+    conn = get_db_connection()
+    if not conn:
+        return None
+
+    archived = None
+    try:
+        cursor = _cursor(conn)
+        cursor.execute("SELECT 1 FROM Posts_Archive WHERE PostID = %s", (post_id,))
+        archived = cursor.fetchone() is not None
+    except Error as e:
+        print(f"Error in is_post_archived: {e}")
+    finally:
+        if conn.is_connected():
+            cursor.close()
+        conn.close()
+    return archived
+
+# Inserts rows (tuples in the order of columns) with one multi-row INSERT per chunk_size rows,
+# on the caller's cursor and inside the caller's transaction. Returns the number of rows inserted.
+# BULK_INSERT_CHUNK bounds the statement size, keep chunk_size * row size below max_allowed_packet.
+def _bulk_insert(cursor, table, columns, rows, chunk_size=None):
+    chunk_size = chunk_size or int(os.getenv('BULK_INSERT_CHUNK', 500))
+    inserted = 0
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        row_placeholders = "(" + ", ".join(["%s"] * len(columns)) + ")"
+        cursor.execute(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join([row_placeholders] * len(chunk))}",
+            [value for row in chunk for value in row],
+        )
+        inserted += cursor.rowcount
+    return inserted
+
 def create_poll(user_id, question, options, allow_comments=True):
     conn = get_db_connection()
     if not conn:
@@ -125,14 +293,15 @@ def create_poll(user_id, question, options, allow_comments=True):
 
     success = False
     try:
-        cursor = conn.cursor(prepared=True)
+        # Plain cursor: the options INSERT grows with the number of options
+        cursor = _cursor(conn, prepared=False)
         cursor.execute("INSERT INTO Posts (AuthorUserID, PostType, Title, AllowComments) VALUES (%s, %s, %s, %s)", (user_id, "Poll",  question, allow_comments))
         post_id = cursor.lastrowid
-        
-        for option in options:
-            cursor.execute("INSERT INTO PollOptions (PostID, OptionText) VALUES (%s, %s)", (post_id, option))
-        
+        _bulk_insert(cursor, "PollOptions", ("PostID", "OptionText"), [(post_id, option) for option in options])
         conn.commit()
+        replicas.pin(user_id)
+        feed_cache.invalidate_head()
+        events.publish("new_post", {"PostID": post_id, "PostType": "Poll"})
         success = True
     except Error as e:
         print(f"Error in create_poll: {e}")
@@ -141,95 +310,327 @@ def create_poll(user_id, question, options, allow_comments=True):
     finally:
         if conn.is_connected():
             cursor.close()
-            conn.close()
+        conn.close()
     return success
 
-def get_feed_posts(user_id):
-    conn = get_db_connection()
-    if not conn:
-        return []
+# Builds "%s, %s, ..." for an IN (...) list of n values, or "(%s, %s), ..." for n rows of width values
+def _in_placeholders(n, width=1):
+    item = "%s" if width == 1 else "(" + ", ".join(["%s"] * width) + ")"
+    return ", ".join([item] * n)
+
+# {"For": n, "Against": n, "Abstain": n} from a row with the VoteItemTallies columns (NULL when nobody has voted yet)
+def _tally_counts(row):
+    return {
+        "For": row['ForCount'] or 0,
+        "Against": row['AgainstCount'] or 0,
+        "Abstain": row['AbstainCount'] or 0,
+    }
 
+# Turns the rows of one feed page into post dicts, without any per-user state
+def _build_feed_posts(post_rows, option_rows):
     posts = {}
+    for row in post_rows:
+        post_id = row['PostID']
+        posts[post_id] = {
+            "PostID": post_id,
+            "Title": row['Title'],
+            "Content": row.get('Content', ''),  # Content may not be present for Polls
+            "PostType": row['PostType'],
+            "AllowComments": bool(row['AllowComments']),
+            "CreationTimestamp": row['CreationTimestamp'],
+            "AuthorUsername": row['AuthorUsername'],
+            "Options": [],
+            "CommentCount": row['CommentCount'],
+        }
+        if row['PostType'] == 'VoteItem':
+            posts[post_id]["VoteCounts"] = _tally_counts(row)
+        if row.get('Archived'):
+            posts[post_id]["Archived"] = True
+    for row in option_rows:
+        posts[row['PostID']]["Options"].append({
+            "OptionID": row['OptionID'],
+            "OptionText": row['OptionText'],
+            "VoteCount": int(row['VoteCount']),
+        })
+    return list(posts.values())
+
+# Adds the current user's vote state to the shared post dicts.
+# Unvoted VoteItems only get a requiresVoteToken flag, the client asks /api/posts/<id>/vote-token when it needs one.
+def _apply_user_state(posts, user_voted_polls, user_voted_items):
+    for post in posts:
+        post_id = post['PostID']
+        has_voted = False
+        if post['PostType'] == 'Poll':
+            has_voted = post_id in user_voted_polls
+        elif post['PostType'] == 'VoteItem':
+            has_voted = post_id in user_voted_items
+        post['userHasVoted'] = has_voted
+        post['priority'] = False  # Default priority to False
+
+        # If the post is a VoteItem and the user has NOT voted on it yet...
+        # (archived posts are read-only, so there is nothing to ask for a token for)
+        if post['PostType'] == 'VoteItem' and not has_voted and not post.get('Archived'):
+            post['requiresVoteToken'] = True
+            post['priority'] = True
+    return posts
+
+FEED_POST_COLUMNS = """
+    p.PostID, p.Title, p.CreationTimestamp, p.Content, p.PostType, p.AllowComments,
+    p.CommentCount, u.Username AS AuthorUsername,
+    t.ForCount, t.AgainstCount, t.AbstainCount
+"""
+FEED_POST_FROM = """
+    FROM Posts p
+    JOIN Users u ON p.AuthorUserID = u.UserID
+    LEFT JOIN VoteItemTallies t ON t.PostID = p.PostID
+"""
+FEED_POST_ARCHIVE_FROM = """
+    FROM Posts_Archive p
+    JOIN Users u ON p.AuthorUserID = u.UserID
+    LEFT JOIN VoteItemTallies_Archive t ON t.PostID = p.PostID
+"""
+
+# Posts older than the hot window are moved to the *_Archive tables by archive_posts. Readers fall
+# back to those once they run out of hot rows, unless ARCHIVE_READS=false (before migration 007).
+def archive_reads():
+    return os.getenv('ARCHIVE_READS', 'true').lower() in ('1', 'true', 'yes')
+
+# (columns, FROM clause) of the feed's post queries; archived rows come back with Archived = 1
+def _feed_post_source(archived):
+    if archived:
+        return FEED_POST_COLUMNS + ", TRUE AS Archived", FEED_POST_ARCHIVE_FROM
+    return FEED_POST_COLUMNS, FEED_POST_FROM
+
+# The feed's queries as (sql, params), shared by get_feed_posts and its async twin in db_async.
+# Page over Posts alone (idx_posts_feed), one extra row tells us whether there is a next page.
+# With archived=True they read the same data from the *_Archive tables.
+def _feed_page_query(after, limit, archived=False):
+    columns, source = _feed_post_source(archived)
+    if after is None:
+        return f"""
+            SELECT {columns}
+            {source}
+            ORDER BY p.CreationTimestamp DESC, p.PostID DESC
+            LIMIT %s
+        """, (limit + 1,)
+    after_timestamp, after_post_id = after
+    return f"""
+        SELECT {columns}
+        {source}
+        WHERE p.CreationTimestamp < %s
+           OR (p.CreationTimestamp = %s AND p.PostID < %s)
+        ORDER BY p.CreationTimestamp DESC, p.PostID DESC
+        LIMIT %s
+    """, (after_timestamp, after_timestamp, after_post_id, limit + 1)
+
+def _feed_posts_by_id_query(post_ids, archived=False):
+    columns, source = _feed_post_source(archived)
+    return f"""
+        SELECT {columns}
+        {source}
+        WHERE p.PostID IN ({_in_placeholders(len(post_ids))})
+    """, list(post_ids)
+
+# Archived options have their counter shards folded in already
+def _feed_options_query(post_ids, archived=False):
+    if archived:
+        return f"""
+            SELECT PostID, OptionID, OptionText, VoteCount
+            FROM PollOptions_Archive
+            WHERE PostID IN ({_in_placeholders(len(post_ids))})
+            ORDER BY OptionID
+        """, list(post_ids)
+    return f"""
+        SELECT po.PostID, po.OptionID, po.OptionText, {OPTION_VOTE_COUNT} AS VoteCount
+        FROM PollOptions po
+        LEFT JOIN PollOptionCounterShards s ON s.OptionID = po.OptionID
+        WHERE po.PostID IN ({_in_placeholders(len(post_ids))})
+        GROUP BY po.OptionID
+        ORDER BY po.OptionID
+    """, list(post_ids)
+
+def _user_votes_queries(user_id, post_ids, archived=False):
+    placeholders = _in_placeholders(len(post_ids))
+    suffix = "_Archive" if archived else ""
+    return (
+        (f"SELECT PostID FROM PollVotes{suffix} WHERE UserID = %s AND PostID IN ({placeholders})", [user_id] + list(post_ids)),
+        (f"SELECT PostID FROM ItemVotes{suffix} WHERE UserID = %s AND PostID IN ({placeholders})", [user_id] + list(post_ids)),
+    )
+
+# The first comments_per_post comments of each post, plus one to tell whether there are more,
+# ranked per post in one statement instead of one thread query per post (needs MySQL 8.0).
+def _feed_comments_query(post_ids, comments_per_post, archived=False):
+    suffix = "_Archive" if archived else ""
+    return f"""
+        SELECT ranked.PostID, ranked.CommentID, ranked.Content, ranked.Timestamp, ranked.Username
+        FROM (
+            SELECT c.PostID, c.CommentID, c.Content, c.Timestamp, u.Username,
+                   ROW_NUMBER() OVER (PARTITION BY c.PostID ORDER BY c.Timestamp, c.CommentID) AS RowNumber
+            FROM Comments{suffix} c
+            JOIN Posts{suffix} p ON p.PostID = c.PostID AND p.AllowComments
+            JOIN Users u ON u.UserID = c.UserID
+            WHERE c.PostID IN ({_in_placeholders(len(post_ids))})
+        ) ranked
+        WHERE ranked.RowNumber <= %s
+        ORDER BY ranked.PostID, ranked.RowNumber
+    """, list(post_ids) + [comments_per_post + 1]
+
+# Sets post["Comments"] to the first comment page of each post, the same {"comments", "next_cursor"}
+# that GET /api/posts/<id>/comments returns, so clients can carry on from next_cursor
+def _attach_comments(posts, comment_rows, comments_per_post):
+    rows_by_post = {}
+    for row in comment_rows:
+        rows_by_post.setdefault(row['PostID'], []).append(row)
+    for post in posts:
+        post["Comments"] = _comments_page_from_rows(rows_by_post.get(post['PostID'], []), comments_per_post)
+    return posts
+
+# Drops the extra row of a page query, returns (post_rows, post_ids, next_cursor)
+def _feed_page_from_rows(post_rows, limit):
+    next_cursor = None
+    if len(post_rows) > limit:
+        post_rows = post_rows[:limit]
+        last = post_rows[-1]
+        next_cursor = encode_cursor(last['CreationTimestamp'], last['PostID'])
+    return post_rows, [row['PostID'] for row in post_rows], next_cursor
+
+# [(archived, post_ids)] for the hot and the archived ones among rows or posts that have a PostID,
+# leaving out empty groups
+def _split_archived(posts):
+    groups = {False: [], True: []}
+    for post in posts:
+        groups[bool(post.get('Archived'))].append(post['PostID'])
+    return [(archived, ids) for archived, ids in groups.items() if ids]
+
+# Returns one page of the feed, newest first.
+# after is the (CreationTimestamp, PostID) of the last post on the previous page, or None for the first page.
+# The shared part of each post comes from feed_cache when possible, the user's vote state is always read fresh.
+# With comments_per_post > 0 each post also gets its first page of comments (never cached).
+# Once the page runs past the oldest hot post it is filled up from the archive, and cursors carry on
+# into it as if it were one table.
+def get_feed_posts(user_id, after=None, limit=20, comments_per_post=0, vote_filter=None):
+    page = {"posts": [], "next_cursor": None}
+    conn = get_read_connection()
+    if not conn:
+        return page
+
     try:
-        cursor = conn.cursor(prepared=True, dictionary=True)
-        #Query partially generated by Copilot
-        query = """
-            SELECT 
-                p.PostID, 
-                p.Title,
-                p.CreationTimestamp,
-                p.Content,
-                p.PostType,
-                p.AllowComments,
-                u.Username AS AuthorUsername,
-                po.OptionID,
-                po.OptionText,
-                po.VoteCount,
-                (SELECT COUNT(*) FROM Comments c WHERE c.PostID = p.PostID) AS CommentCount
-            FROM Posts p
-            JOIN Users u ON p.AuthorUserID = u.UserID
-            LEFT JOIN PollOptions po ON p.PostID = po.PostID
-            ORDER BY p.CreationTimestamp DESC;
-        """
-        cursor.execute(query)
-        all_post_rows = cursor.fetchall()
-        
-        cursor.execute("SELECT PostID FROM PollVotes WHERE UserID = %s", (user_id,))
-        # Results go into a set for fast af lookups
-        user_voted_polls = {row['PostID'] for row in cursor.fetchall()}
-        
-        cursor.execute("SELECT PostID FROM ItemVotes WHERE UserID = %s", (user_id,))
-        user_voted_items = {row['PostID'] for row in cursor.fetchall()}
-        
-        for row in all_post_rows:
-            post_id = row['PostID']
-            
-            if post_id not in posts:
-                has_voted = False
-                if row['PostType'] == 'Poll':
-                    has_voted = post_id in user_voted_polls
-                elif row['PostType'] == 'VoteItem':
-                    has_voted = post_id in user_voted_items
-                posts[post_id] = {
-                    "PostID": post_id,
-                    "Title": row['Title'],
-                    "Content": row.get('Content', ''),  # Content may not be present for Polls
-                    "PostType": row['PostType'],
-                    "CreationTimestamp": row['CreationTimestamp'],
-                    "AuthorUsername": row['AuthorUsername'],
-                    "Options": [],
-                    "CommentCount": row['CommentCount'],
-                    "userHasVoted": has_voted,
-                    "priority": False  # Default priority to False
-                }
-            # If the current row is for a VoteItem and the user has NOT voted on it yet...
-            if row['PostType'] == 'VoteItem' and not posts[post_id]['userHasVoted']:
-                vote_token_payload = {
-                    'user_id': user_id,
-                    'post_id': post_id,
-                    'purpose': 'item_vote',
-                    'exp': datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=5) # Token is only valid for 5 mins
-                }
-                secret_key = os.getenv('SECRET_KEY')
-                vote_auth_token = jwt.encode(vote_token_payload, secret_key, algorithm="HS256")
-                posts[post_id]['voteAuthToken'] = vote_auth_token
-                posts[post_id]['priority'] = True
-                
-            if row['OptionID'] is not None:
-                posts[post_id]["Options"].append({
-                    "OptionID": row['OptionID'],
-                    "OptionText": row['OptionText'],
-                    "VoteCount": row['VoteCount'],
-                })
+        cursor = _cursor(conn, dictionary=True)
+        # The IN (...) lists follow the number of posts, one prepared statement per length would
+        # crowd the statement cache
+        id_cursor = _cursor(conn, dictionary=True, prepared=False)
+
+        page_key = feed_cache.page_key(after, limit)
+        cached_page = feed_cache.get_page(page_key)
+        post_rows = None
+        if cached_page is not None:
+            post_ids = cached_page['post_ids']
+            next_cursor = cached_page['next_cursor']
+        else:
+            cursor.execute(*_feed_page_query(after, limit))
+            page_rows = list(cursor.fetchall())
+            # Every archived post is older than every hot one, so the archive only comes into it once
+            # the hot rows run out, continuing from the last of them
+            if len(page_rows) <= limit and archive_reads():
+                archive_after = after
+                if page_rows:
+                    archive_after = (page_rows[-1]['CreationTimestamp'], page_rows[-1]['PostID'])
+                cursor.execute(*_feed_page_query(archive_after, limit - len(page_rows), archived=True))
+                page_rows += cursor.fetchall()
+            post_rows, post_ids, next_cursor = _feed_page_from_rows(page_rows, limit)
+            feed_cache.set_page(page_key, post_ids, next_cursor)
+
+        if not post_ids:
+            return page
+
+        # Shared layer: post, option and comment count data, only the posts missing from the cache are loaded
+        shared_posts = feed_cache.get_posts(post_ids)
+        missing_ids = [post_id for post_id in post_ids if post_id not in shared_posts]
+        if missing_ids:
+            if post_rows is None:
+                id_cursor.execute(*_feed_posts_by_id_query(missing_ids))
+                missing_rows = list(id_cursor.fetchall())
+                # A cached page can list posts that have been archived since
+                found = {row['PostID'] for row in missing_rows}
+                not_found = [post_id for post_id in missing_ids if post_id not in found]
+                if not_found and archive_reads():
+                    id_cursor.execute(*_feed_posts_by_id_query(not_found, archived=True))
+                    missing_rows += id_cursor.fetchall()
+            else:
+                missing = set(missing_ids)
+                missing_rows = [row for row in post_rows if row['PostID'] in missing]
+
+            option_rows = []
+            for archived, ids in _split_archived(missing_rows):
+                id_cursor.execute(*_feed_options_query(ids, archived))
+                option_rows += id_cursor.fetchall()
+
+            built_posts = _build_feed_posts(missing_rows, option_rows)
+            feed_cache.set_posts(built_posts)
+            for post in built_posts:
+                shared_posts[post['PostID']] = post
+
+        # Per-user layer: vote state for the posts on this page only. With a vote_filter (see
+        # vote_index.feed_filter) only the polls and vote items it cannot rule out are looked up.
+        # Archived posts are always looked up, the vote index only reads the hot vote tables.
+        page_posts = [shared_posts[post_id] for post_id in post_ids if post_id in shared_posts]
+        user_voted_polls = set()
+        user_voted_items = set()
+        for archived, ids in _split_archived(page_posts):
+            if vote_filter is None or archived:
+                poll_ids = item_ids = ids
+            else:
+                posts_by_id = {post['PostID']: post for post in page_posts}
+                poll_ids = [post_id for post_id in ids
+                            if posts_by_id[post_id]['PostType'] == 'Poll' and vote_filter('poll', user_id, post_id)]
+                item_ids = [post_id for post_id in ids
+                            if posts_by_id[post_id]['PostType'] == 'VoteItem' and vote_filter('item', user_id, post_id)]
+
+            # Results go into a set for fast af lookups
+            if poll_ids:
+                id_cursor.execute(*_user_votes_queries(user_id, poll_ids, archived)[0])
+                user_voted_polls.update(row['PostID'] for row in id_cursor.fetchall())
+            if item_ids:
+                id_cursor.execute(*_user_votes_queries(user_id, item_ids, archived)[1])
+                user_voted_items.update(row['PostID'] for row in id_cursor.fetchall())
+
+        # Copies, so the overlay never leaks into the shared cache entries
+        posts = [dict(post) for post in page_posts]
+        page["posts"] = _apply_user_state(posts, user_voted_polls, user_voted_items)
+        page["next_cursor"] = next_cursor
+
+        if comments_per_post > 0:
+            comment_rows = []
+            for archived, ids in _split_archived(page_posts):
+                id_cursor.execute(*_feed_comments_query(ids, comments_per_post, archived))
+                comment_rows += id_cursor.fetchall()
+            _attach_comments(page["posts"], comment_rows, comments_per_post)
     except Error as e:
-        print(f"Error in collate_polls: {e}")
-        return []
+        print(f"Error in get_feed_posts: {e}")
+        return {"posts": [], "next_cursor": None}
     finally:
         if conn.is_connected():
             cursor.close()
-            conn.close()
-            
-    return list(posts.values())
+            id_cursor.close()
+        conn.close()
+
+    return page
+
+# Vote counts are split between PollOptions.VoteCount (folded total) and PollOptionCounterShards,
+# so concurrent voters on one option update different rows. Readers add the two together with
+# OPTION_VOTE_COUNT over a LEFT JOIN PollOptionCounterShards s, grouped by option.
+# VOTE_COUNTER_SHARDS sets the number of slots per option (default 16).
+OPTION_VOTE_COUNT = "po.VoteCount + COALESCE(SUM(s.VoteCount), 0)"
+
+# Adds {option_id: delta} to a random counter shard of each option, in one statement
+def _add_option_votes(cursor, deltas):
+    shards = int(os.getenv('VOTE_COUNTER_SHARDS', 16))
+    rows = sorted((option_id, random.randrange(shards), delta) for option_id, delta in deltas.items())
+    cursor.execute(f"""
+        INSERT INTO PollOptionCounterShards (OptionID, Slot, VoteCount)
+        VALUES {_in_placeholders(len(rows), 3)}
+        ON DUPLICATE KEY UPDATE VoteCount = VoteCount + VALUES(VoteCount)
+    """, [value for row in rows for value in row])
 
 def record_poll_vote(user_id, post_id, option_id):
     conn = get_db_connection()
@@ -238,10 +639,13 @@ def record_poll_vote(user_id, post_id, option_id):
 
     success = False
     try:
-        cursor = conn.cursor(prepared=True)
+        cursor = _cursor(conn)
         cursor.execute("INSERT INTO PollVotes (UserID, PostID, OptionID) VALUES (%s, %s, %s)", (user_id, post_id, option_id))
-        cursor.execute("UPDATE PollOptions SET VoteCount = VoteCount + 1 WHERE OptionID = %s", (option_id,))
+        _add_option_votes(cursor, {option_id: 1})
         conn.commit()
+        replicas.pin(user_id)
+        feed_cache.invalidate_post(post_id)
+        events.publish("option_count", {"PostID": post_id, "OptionID": option_id, "delta": 1})
         success = True
     except Error as e:
         print(f"Error in record_vote: {e}")
@@ -250,16 +654,111 @@ def record_poll_vote(user_id, post_id, option_id):
     finally:
         if conn.is_connected():
             cursor.close()
-            conn.close()
+        conn.close()
     return success
 
+# Synchronous checks for a queued poll vote: "ok", "duplicate", "invalid" (option not in this poll) or None on error
+def check_poll_vote(user_id, post_id, option_id):
+    conn = get_db_connection()
+    if not conn:
+        return None
+
+    status = None
+    try:
+        cursor = _cursor(conn)
+        cursor.execute("""
+            SELECT po.PostID,
+                   EXISTS(SELECT 1 FROM PollVotes pv WHERE pv.UserID = %s AND pv.PostID = po.PostID)
+            FROM PollOptions po
+            WHERE po.OptionID = %s
+        """, (user_id, option_id))
+        result = cursor.fetchone()
+        if not result or result[0] != post_id:
+            status = "invalid"
+        elif result[1]:
+            status = "duplicate"
+        else:
+            status = "ok"
+    except Error as e:
+        print(f"Error in check_poll_vote: {e}")
+    finally:
+        if conn.is_connected():
+            cursor.close()
+        conn.close()
+    return status
+
+# Writes a batch of queued votes in one transaction.
+# poll_votes is a list of (user_id, post_id, option_id), item_votes a list of (user_id, post_id, choice).
+# Votes already in the database (e.g. replayed from the journal) are skipped, and the VoteCount
+# deltas are aggregated per option into a single counter shard upsert.
+# Returns (inserted_poll_votes, inserted_item_votes), or None if the batch could not be written.
+def apply_vote_batch(poll_votes, item_votes):
+    conn = get_db_connection()
+    if not conn:
+        return None
+
+    result = None
+    try:
+        # A plain cursor, so executemany() sends one multi-row INSERT
+        cursor = _cursor(conn, prepared=False)
+
+        if poll_votes:
+            cursor.execute(
+                f"SELECT UserID, PostID FROM PollVotes WHERE (UserID, PostID) IN ({_in_placeholders(len(poll_votes), 2)})",
+                [value for user_id, post_id, _ in poll_votes for value in (user_id, post_id)])
+            existing = set(cursor.fetchall())
+            poll_votes = [vote for vote in poll_votes if (vote[0], vote[1]) not in existing]
+        if item_votes:
+            cursor.execute(
+                f"SELECT UserID, PostID FROM ItemVotes WHERE (UserID, PostID) IN ({_in_placeholders(len(item_votes), 2)})",
+                [value for user_id, post_id, _ in item_votes for value in (user_id, post_id)])
+            existing = set(cursor.fetchall())
+            item_votes = [vote for vote in item_votes if (vote[0], vote[1]) not in existing]
+
+        if poll_votes:
+            cursor.executemany("INSERT INTO PollVotes (UserID, PostID, OptionID) VALUES (%s, %s, %s)", poll_votes)
+            deltas = {}
+            for _, _, option_id in poll_votes:
+                deltas[option_id] = deltas.get(option_id, 0) + 1
+            _add_option_votes(cursor, deltas)
+        if item_votes:
+            cursor.executemany("INSERT INTO ItemVotes (UserID, PostID, VoteType) VALUES (%s, %s, %s)", item_votes)
+            _add_item_tallies(cursor, [(post_id, choice) for _, post_id, choice in item_votes])
+
+        conn.commit()
+        for user_id in {vote[0] for vote in poll_votes + item_votes}:
+            replicas.pin(user_id)
+        for post_id in {vote[1] for vote in poll_votes + item_votes}:
+            feed_cache.invalidate_post(post_id)
+        for (post_id, option_id), delta in Counter((post_id, option_id) for _, post_id, option_id in poll_votes).items():
+            events.publish("option_count", {"PostID": post_id, "OptionID": option_id, "delta": delta})
+        for (post_id, choice), delta in Counter((post_id, choice) for _, post_id, choice in item_votes).items():
+            events.publish("item_tally", {"PostID": post_id, "Choice": choice, "delta": delta})
+        result = (poll_votes, item_votes)
+    except Error as e:
+        print(f"Error in apply_vote_batch: {e}")
+        if conn.is_connected():
+            conn.rollback()
+    finally:
+        if conn.is_connected():
+            cursor.close()
+        conn.close()
+    return result
+
 def create_announcement(user_id, title, content, allow_comments=True):
     conn = get_db_connection()
+    if not conn:
+        return False
+
     success = False
     try:
-        cursor = conn.cursor(prepared=True)
+        cursor = _cursor(conn)
         cursor.execute("INSERT INTO Posts (AuthorUserID, PostType, Title, Content, AllowComments) VALUES (%s, %s, %s, %s, %s)", (user_id, "Announcement", title, content, allow_comments))
+        post_id = cursor.lastrowid
         conn.commit()
+        replicas.pin(user_id)
+        feed_cache.invalidate_head()
+        events.publish("new_post", {"PostID": post_id, "PostType": "Announcement"})
         success = True
     except Error as e:
         print(f"Error in create_announcement: {e}")
@@ -268,17 +767,24 @@ def create_announcement(user_id, title, content, allow_comments=True):
     finally:
         if conn.is_connected():
             cursor.close()
-            conn.close()
+        conn.close()
     return success
 
 # Full functionality will be added with forum sub-project later
 def create_forum_topic(user_id, title, content, allow_comments=True):
     conn = get_db_connection()
+    if not conn:
+        return False
+
     success = False
     try:
-        cursor = conn.cursor(prepared=True)
+        cursor = _cursor(conn)
         cursor.execute("INSERT INTO Posts (AuthorUserID, PostType, Title, Content, AllowComments) VALUES (%s, %s, %s, %s, %s)", (user_id, "ForumTopic", title, content, allow_comments))
+        post_id = cursor.lastrowid
         conn.commit()
+        replicas.pin(user_id)
+        feed_cache.invalidate_head()
+        events.publish("new_post", {"PostID": post_id, "PostType": "ForumTopic"})
         success = True
     except Error as e:
         print(f"Error in create_forum_topic: {e}")
@@ -287,7 +793,7 @@ def create_forum_topic(user_id, title, content, allow_comments=True):
     finally:
         if conn.is_connected():
             cursor.close()
-            conn.close()
+        conn.close()
     return success
 
 
@@ -298,9 +804,13 @@ def create_vote_item(user_id, title, allow_comments=True):
 
     success = False
     try:
-        cursor = conn.cursor(prepared=True)
+        cursor = _cursor(conn)
         cursor.execute("INSERT INTO Posts (AuthorUserID, PostType, Title, AllowComments) VALUES (%s, %s, %s, %s)", (user_id, "VoteItem", title, allow_comments))
+        post_id = cursor.lastrowid
         conn.commit()
+        replicas.pin(user_id)
+        feed_cache.invalidate_head()
+        events.publish("new_post", {"PostID": post_id, "PostType": "VoteItem"})
         success = True
     except Error as e:
         print(f"Error in create_vote_item: {e}")
@@ -309,9 +819,25 @@ def create_vote_item(user_id, title, allow_comments=True):
     finally:
         if conn.is_connected():
             cursor.close()
-            conn.close()
+        conn.close()
     return success
 
+# Adds (post_id, choice) votes to VoteItemTallies, one row per post in a single statement
+def _add_item_tallies(cursor, votes):
+    tallies = {}
+    for post_id, choice in votes:
+        counts = tallies.setdefault(post_id, {"For": 0, "Against": 0, "Abstain": 0})
+        counts[choice] += 1
+    rows = sorted((post_id, c["For"], c["Against"], c["Abstain"]) for post_id, c in tallies.items())
+    cursor.execute(f"""
+        INSERT INTO VoteItemTallies (PostID, ForCount, AgainstCount, AbstainCount)
+        VALUES {_in_placeholders(len(rows), 4)}
+        ON DUPLICATE KEY UPDATE
+            ForCount = ForCount + VALUES(ForCount),
+            AgainstCount = AgainstCount + VALUES(AgainstCount),
+            AbstainCount = AbstainCount + VALUES(AbstainCount)
+    """, [value for row in rows for value in row])
+
 def record_item_vote(user_id, post_id, choice):
     conn = get_db_connection()
     if not conn:
@@ -319,9 +845,13 @@ def record_item_vote(user_id, post_id, choice):
 
     success = False
     try:
-        cursor = conn.cursor(prepared=True)
+        cursor = _cursor(conn)
         cursor.execute("INSERT INTO ItemVotes (UserID, PostID, VoteType) VALUES (%s, %s, %s)", (user_id, post_id, choice))
+        _add_item_tallies(cursor, [(post_id, choice)])
         conn.commit()
+        replicas.pin(user_id)
+        feed_cache.invalidate_post(post_id)
+        events.publish("item_tally", {"PostID": post_id, "Choice": choice, "delta": 1})
         success = True
     except Error as e:
         print(f"Error in record_item_vote: {e}")
@@ -330,18 +860,170 @@ def record_item_vote(user_id, post_id, choice):
     finally:
         if conn.is_connected():
             cursor.close()
-            conn.close()
+        conn.close()
     return success
 
+# Returns (PostType, user_has_voted) for an item vote token request, "not_found" if the post does not
+# exist, or None on error
+def get_vote_item_state(user_id, post_id):
+    conn = get_db_connection()
+    if not conn:
+        return None
+
+    state = None
+    try:
+        cursor = _cursor(conn)
+        cursor.execute("""
+            SELECT p.PostType,
+                   EXISTS(SELECT 1 FROM ItemVotes iv WHERE iv.UserID = %s AND iv.PostID = p.PostID)
+            FROM Posts p
+            WHERE p.PostID = %s
+        """, (user_id, post_id))
+        result = cursor.fetchone()
+        if result:
+            state = (result[0], bool(result[1]))
+        else:
+            state = "not_found"
+    except Error as e:
+        print(f"Error in get_vote_item_state: {e}")
+    finally:
+        if conn.is_connected():
+            cursor.close()
+        conn.close()
+    return state
+
+# The vote table of each vote_index kind
+VOTE_TABLES = {"poll": "PollVotes", "item": "ItemVotes"}
+
+# Whether user_id has a vote of kind ("poll" or "item") on post_id, or None on error
+def has_voted(kind, user_id, post_id):
+    conn = get_db_connection()
+    if not conn:
+        return None
+
+    voted = None
+    try:
+        cursor = _cursor(conn)
+        cursor.execute(f"SELECT EXISTS(SELECT 1 FROM {VOTE_TABLES[kind]} WHERE UserID = %s AND PostID = %s)", (user_id, post_id))
+        voted = bool(cursor.fetchone()[0])
+    except Error as e:
+        print(f"Error in has_voted: {e}")
+    finally:
+        if conn.is_connected():
+            cursor.close()
+        conn.close()
+    return voted
+
+# Up to limit (VoteID, UserID, PostID) rows of kind's vote table with VoteID above after, in VoteID
+# order, for warming and refreshing vote_index. Returns None on error.
+def get_vote_keys(kind, after, limit):
+    conn = get_db_connection()
+    if not conn:
+        return None
+
+    rows = None
+    try:
+        cursor = _cursor(conn)
+        cursor.execute(f"SELECT VoteID, UserID, PostID FROM {VOTE_TABLES[kind]} WHERE VoteID > %s ORDER BY VoteID LIMIT %s", (after, limit))
+        rows = cursor.fetchall()
+    except Error as e:
+        print(f"Error in get_vote_keys: {e}")
+    finally:
+        if conn.is_connected():
+            cursor.close()
+        conn.close()
+    return rows
+
+# The (VoteID, UserID, PostID) rows of kind's vote table among vote_ids, for the VoteIDs vote_index
+# skipped while their transaction was still open. Returns None on error.
+def get_vote_keys_by_id(kind, vote_ids):
+    conn = get_db_connection()
+    if not conn:
+        return None
+
+    rows = None
+    try:
+        # The IN list changes size from call to call
+        cursor = _cursor(conn, prepared=False)
+        cursor.execute(f"SELECT VoteID, UserID, PostID FROM {VOTE_TABLES[kind]} WHERE VoteID IN ({_in_placeholders(len(vote_ids))})", list(vote_ids))
+        rows = cursor.fetchall()
+    except Error as e:
+        print(f"Error in get_vote_keys_by_id: {e}")
+    finally:
+        if conn.is_connected():
+            cursor.close()
+        conn.close()
+    return rows
+
+# Results of a Poll (option counts) or VoteItem (VoteItemTallies), from the archive for archived posts.
+# Returns {"PostID", "PostType", "Results", "LastModified"}, "not_found", "no_results" for other post types,
+# or None on error.
+def get_post_results(post_id):
+    conn = get_db_connection()
+    if not conn:
+        return None
+
+    results = None
+    try:
+        cursor = _cursor(conn, dictionary=True)
+        post_query = """
+            SELECT p.PostType, p.CreationTimestamp, t.ForCount, t.AgainstCount, t.AbstainCount, t.LastUpdated
+            FROM Posts{suffix} p
+            LEFT JOIN VoteItemTallies{suffix} t ON t.PostID = p.PostID
+            WHERE p.PostID = %s
+        """
+        cursor.execute(post_query.format(suffix=""), (post_id,))
+        row = cursor.fetchone()
+        archived = False
+        if not row and archive_reads():
+            cursor.execute(post_query.format(suffix="_Archive"), (post_id,))
+            row = cursor.fetchone()
+            archived = row is not None
+        if not row:
+            results = "not_found"
+        elif row['PostType'] == 'VoteItem':
+            results = {
+                "PostID": post_id,
+                "PostType": row['PostType'],
+                "Results": _tally_counts(row),
+                "LastModified": row['LastUpdated'] or row['CreationTimestamp'],
+            }
+        elif row['PostType'] != 'Poll':
+            results = "no_results"
+        else:
+            cursor.execute(*_feed_options_query([post_id], archived))
+            results = {
+                "PostID": post_id,
+                "PostType": row['PostType'],
+                "Results": [
+                    {"OptionID": r['OptionID'], "OptionText": r['OptionText'], "VoteCount": int(r['VoteCount'])}
+                    for r in cursor.fetchall()
+                ],
+                # Votes are not timestamped per option, so polls are only validated by ETag
+                "LastModified": None,
+            }
+    except Error as e:
+        print(f"Error in get_post_results: {e}")
+    finally:
+        if conn.is_connected():
+            cursor.close()
+        conn.close()
+    return results
+
 def create_comment(user_id, post_id, content):
     conn = get_db_connection()
     if not conn:
         return False
     success = False
     try:
-        cursor = conn.cursor(prepared=True)
+        cursor = _cursor(conn)
         cursor.execute("INSERT INTO Comments (PostID, UserID, Content) VALUES (%s, %s, %s)", (post_id, user_id, content))
+        # Keep the denormalised counter in the same transaction as the comment itself
+        cursor.execute("UPDATE Posts SET CommentCount = CommentCount + 1 WHERE PostID = %s", (post_id,))
         conn.commit()
+        replicas.pin(user_id)
+        feed_cache.invalidate_post(post_id)
+        events.publish("comment_count", {"PostID": post_id, "delta": 1})
         success = True
     except Error as e:
         print(f"Error in create_comment: {e}")
@@ -350,31 +1032,476 @@ def create_comment(user_id, post_id, content):
     finally:
         if conn.is_connected():
             cursor.close()
-            conn.close()
+        conn.close()
     return success
 
-def get_comments_by_post(post_id, limit=25, offset=0):
-    conn = get_db_connection()
+# One page of a comment thread, oldest first, as (sql, params). Shared with db_async.
+# after is the (Timestamp, CommentID) of the last comment already shown, or None for the first page.
+# Posts is the driving table so the same round trip also answers whether the post exists and allows
+# comments: a post without (allowed) comments comes back as one row with NULL comment columns.
+# The thread is read through idx_comments_thread, one extra row tells us whether there is a next page.
+# archived=True reads an archived post's thread from Posts_Archive and Comments_Archive.
+def _comments_query(post_id, after, limit, archived=False):
+    after_filter = ""
+    params = []
+    if after is not None:
+        after_timestamp, after_comment_id = after
+        after_filter = "AND (c.Timestamp > %s OR (c.Timestamp = %s AND c.CommentID > %s))"
+        params = [after_timestamp, after_timestamp, after_comment_id]
+    suffix = "_Archive" if archived else ""
+    return f"""
+        SELECT p.AllowComments, c.CommentID, c.Content, c.Timestamp, u.Username
+        FROM Posts{suffix} p
+        LEFT JOIN Comments{suffix} c ON c.PostID = p.PostID AND p.AllowComments {after_filter}
+        LEFT JOIN Users u ON u.UserID = c.UserID
+        WHERE p.PostID = %s
+        ORDER BY c.Timestamp ASC, c.CommentID ASC
+        LIMIT %s
+    """, params + [post_id, limit + 1]
+
+# Returns {"comments", "next_cursor"} from the rows of _comments_query
+def _comments_page_from_rows(rows, limit):
+    comments = [
+        {"CommentID": row['CommentID'], "Content": row['Content'], "Timestamp": row['Timestamp'], "Username": row['Username']}
+        for row in rows if row['CommentID'] is not None
+    ]
+    next_cursor = None
+    if len(comments) > limit:
+        comments = comments[:limit]
+        last = comments[-1]
+        next_cursor = encode_cursor(last['Timestamp'], last['CommentID'])
+    return {"comments": comments, "next_cursor": next_cursor}
+
+# Unknown posts and posts with comments turned off both give an empty page
+def get_comments_by_post(post_id, after=None, limit=25):
+    page = {"comments": [], "next_cursor": None}
+    conn = get_read_connection()
     if not conn:
-        return []
-    
-    comments = []
+        return page
+
     try:
-        cursor = conn.cursor(prepared=True, dictionary=True)
-        query = """
-            SELECT c.CommentID, c.Content, c.Timestamp, u.Username
-            FROM Comments c
-            JOIN Users u ON c.UserID = u.UserID
-            WHERE c.PostID = %s
-            ORDER BY c.Timestamp ASC
-            LIMIT %s OFFSET %s
-        """
-        cursor.execute(query, (post_id, limit, offset))
-        comments = cursor.fetchall()
+        cursor = _cursor(conn, dictionary=True)
+        cursor.execute(*_comments_query(post_id, after, limit))
+        rows = cursor.fetchall()
+        # No row at all means the post is not in Posts, it may have been archived
+        if not rows and archive_reads():
+            cursor.execute(*_comments_query(post_id, after, limit, archived=True))
+            rows = cursor.fetchall()
+        page = _comments_page_from_rows(rows, limit)
     except Error as e:
         print(f"Error in get_comments_by_post: {e}")
     finally:
         if conn.is_connected():
             cursor.close()
+        conn.close()
+    return page
+
+# Full-text search over post titles and contents and comment contents (the ft_* FULLTEXT indexes).
+# A post matches on its own text or on any of its comments; its Score is the relevance of its own text
+# plus half that of its best matching comment, rounded so it survives the trip through a cursor.
+# post_types limits the PostTypes searched, after is the (Score, PostID) of the last result shown.
+# Relevance depends on the whole index, so new posts can shift results between pages.
+SEARCH_SCORE = "ROUND(MATCH(p.Title, p.Content) AGAINST (%s IN NATURAL LANGUAGE MODE) + COALESCE(cm.Score, 0) / 2, 6)"
+
+def _search_query(query, post_types, after, limit):
+    type_filter = ""
+    type_params = []
+    if post_types:
+        type_filter = f"AND p.PostType IN ({_in_placeholders(len(post_types))})"
+        type_params = list(post_types)
+
+    after_filter = ""
+    after_params = []
+    if after is not None:
+        after_score, after_post_id = after
+        after_filter = "WHERE scored.Score < %s OR (scored.Score = %s AND scored.PostID < %s)"
+        after_params = [after_score, after_score, after_post_id]
+
+    # The UNION collects the matching PostIDs through the FULLTEXT indexes, only those posts get scored
+    return f"""
+        SELECT * FROM (
+            SELECT p.PostID, p.Title, p.Content, p.PostType, p.CreationTimestamp, p.CommentCount,
+                   u.Username AS AuthorUsername, cm.Comments AS MatchingComments,
+                   {SEARCH_SCORE} AS Score
+            FROM (
+                SELECT PostID FROM Posts WHERE MATCH(Title, Content) AGAINST (%s IN NATURAL LANGUAGE MODE)
+                UNION
+                SELECT PostID FROM Comments WHERE MATCH(Content) AGAINST (%s IN NATURAL LANGUAGE MODE)
+            ) hits
+            JOIN Posts p ON p.PostID = hits.PostID
+            JOIN Users u ON u.UserID = p.AuthorUserID
+            LEFT JOIN (
+                SELECT PostID, MAX(MATCH(Content) AGAINST (%s IN NATURAL LANGUAGE MODE)) AS Score, COUNT(*) AS Comments
+                FROM Comments
+                WHERE MATCH(Content) AGAINST (%s IN NATURAL LANGUAGE MODE)
+                GROUP BY PostID
+            ) cm ON cm.PostID = p.PostID
+            WHERE TRUE {type_filter}
+        ) scored
+        {after_filter}
+        ORDER BY scored.Score DESC, scored.PostID DESC
+        LIMIT %s
+    """, [query] * 5 + type_params + after_params + [limit + 1]
+
+# Returns {"results", "next_cursor"}, or None on error
+def search_posts(query, post_types=None, after=None, limit=20):
+    conn = get_read_connection()
+    if not conn:
+        return None
+
+    page = None
+    try:
+        cursor = _cursor(conn, dictionary=True)
+        cursor.execute(*_search_query(query, post_types, after, limit))
+        results = cursor.fetchall()
+        next_cursor = None
+        if len(results) > limit:
+            results = results[:limit]
+            last = results[-1]
+            next_cursor = encode_score_cursor(last['Score'], last['PostID'])
+        for result in results:
+            result['Score'] = float(result['Score'])
+            result['MatchingComments'] = result['MatchingComments'] or 0
+        page = {"results": results, "next_cursor": next_cursor}
+    except Error as e:
+        print(f"Error in search_posts: {e}")
+    finally:
+        if conn.is_connected():
+            cursor.close()
+        conn.close()
+    return page
+
+# The FULLTEXT indexes search_posts needs, as (table, index name, columns)
+SEARCH_INDEXES = (
+    ("Posts", "ft_posts_text", "Title, Content"),
+    ("Comments", "ft_comments_content", "Content"),
+)
+
+# Adds whichever SEARCH_INDEXES are missing. InnoDB reads the existing rows into a new FULLTEXT
+# index itself while the ALTER runs (writes to the table wait for it), and keeps it current from
+# then on. Returns the names of the indexes added, or None on error.
+def ensure_search_indexes():
+    conn = get_db_connection()
+    if not conn:
+        return None
+
+    added = []
+    try:
+        cursor = _cursor(conn, prepared=False)
+        for table, index_name, columns in SEARCH_INDEXES:
+            cursor.execute("""
+                SELECT COUNT(*) FROM information_schema.STATISTICS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+            """, (table, index_name))
+            if cursor.fetchone()[0]:
+                continue
+            cursor.execute(f"ALTER TABLE {table} ADD FULLTEXT INDEX {index_name} ({columns})")
+            added.append(index_name)
+    except Error as e:
+        print(f"Error in ensure_search_indexes: {e}")
+        return None
+    finally:
+        if conn.is_connected():
+            cursor.close()
+        conn.close()
+    return added
+
+# The vote tables stream_votes can export, name -> (columns, SELECT without WHERE)
+VOTE_EXPORTS = {
+    "poll-votes": (("VoteID", "PostID", "OptionID", "OptionText", "UserID", "Timestamp"), """
+        SELECT v.VoteID, v.PostID, v.OptionID, po.OptionText, v.UserID, v.Timestamp
+        FROM PollVotes v
+        JOIN PollOptions po ON po.OptionID = v.OptionID"""),
+    "item-votes": (("VoteID", "PostID", "VoteType", "UserID", "Timestamp"), """
+        SELECT v.VoteID, v.PostID, v.VoteType, v.UserID, v.Timestamp
+        FROM ItemVotes v"""),
+}
+
+# Starts an export of one of VOTE_EXPORTS, in VoteID order, optionally only for post_id and for votes
+# cast in [since, until) (naive UTC datetimes). Returns a generator of row lists of up to chunk_size
+# tuples, or None if the export could not start.
+# The rows come from an unbuffered cursor and are read off the socket as the caller asks for them,
+# so memory stays at one chunk however large the table. The export gets a connection of its own
+# instead of one from the pool, which it would hold for as long as the download takes; its
+# net_write_timeout (EXPORT_NET_WRITE_TIMEOUT, default 600 s) is how long MySQL waits for a slow client.
+def stream_votes(export, post_id=None, since=None, until=None, chunk_size=1000):
+    _, select = VOTE_EXPORTS[export]
+    conditions = []
+    params = []
+    if post_id is not None:
+        conditions.append("v.PostID = %s")
+        params.append(post_id)
+    if since is not None:
+        conditions.append("v.Timestamp >= %s")
+        params.append(since)
+    if until is not None:
+        conditions.append("v.Timestamp < %s")
+        params.append(until)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    conn = None
+    try:
+        conn = _connect()
+        cursor = _cursor(conn, prepared=False)
+        cursor.execute("SET SESSION net_write_timeout = %s", (int(os.getenv('EXPORT_NET_WRITE_TIMEOUT', 600)),))
+        cursor.execute(f"{select} {where} ORDER BY v.VoteID", params)
+    except Error as e:
+        print(f"Error in stream_votes: {e}")
+        if conn is not None:
             conn.close()
-    return comments    
\ No newline at end of file
+        return None
+
+    def chunks():
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        except Error as e:
+            # Headers are out already, so the only way to tell the client is to cut the download short
+            print(f"Error in stream_votes: {e}")
+            raise
+        finally:
+            # Also reached when the client disconnects, closing the socket drops the unread rows
+            try:
+                conn.close()
+            except Error:
+                pass
+
+    return chunks()
+
+# Bulk import for POST /api/admin/import. posts is a list of dicts with PostType, Title, Content,
+# AllowComments and, for polls, Options. Each chunk of chunk_size posts is one transaction: polls are
+# inserted one by one (their PostID is needed for the options), all other posts and all options of
+# the chunk go through _bulk_insert. Stops at the first failing chunk, earlier chunks stay committed.
+# Returns {"posts", "options", "chunks", "failed_chunk"} where failed_chunk is None on success.
+def import_posts(user_id, posts, chunk_size=500):
+    result = {"posts": 0, "options": 0, "chunks": 0, "failed_chunk": None}
+    conn = get_db_connection()
+    if not conn:
+        result["failed_chunk"] = 0
+        return result
+
+    try:
+        # A plain cursor, the multi-row statements differ in size and would each be prepared once
+        cursor = _cursor(conn, prepared=False)
+        for index, start in enumerate(range(0, len(posts), chunk_size)):
+            chunk = posts[start:start + chunk_size]
+            try:
+                other_rows = []
+                option_rows = []
+                for post in chunk:
+                    if post['PostType'] == 'Poll':
+                        cursor.execute("INSERT INTO Posts (AuthorUserID, PostType, Title, AllowComments) VALUES (%s, %s, %s, %s)", (user_id, "Poll", post['Title'], post['AllowComments']))
+                        post_id = cursor.lastrowid
+                        option_rows.extend((post_id, option) for option in post['Options'])
+                    else:
+                        other_rows.append((user_id, post['PostType'], post['Title'], post['Content'], post['AllowComments']))
+                _bulk_insert(cursor, "Posts", ("AuthorUserID", "PostType", "Title", "Content", "AllowComments"), other_rows)
+                options = _bulk_insert(cursor, "PollOptions", ("PostID", "OptionText"), option_rows)
+                conn.commit()
+            except Error as e:
+                print(f"Error in import_posts (chunk {index}): {e}")
+                if conn.is_connected():
+                    conn.rollback()
+                result["failed_chunk"] = index
+                break
+            result["posts"] += len(chunk)
+            result["options"] += options
+            result["chunks"] += 1
+    finally:
+        if conn.is_connected():
+            cursor.close()
+        conn.close()
+
+    if result["posts"]:
+        replicas.pin(user_id)
+        feed_cache.invalidate_head()
+        # The imported posts have no single ID, clients just learn that the feed has new posts
+        events.publish("new_post", {"PostID": None, "PostType": "Import"})
+    return result
+
+# Recomputes Posts.CommentCount from Comments for any post where the counter has drifted.
+# Works through PostID ranges of batch_size so each UPDATE only locks a bounded set of rows.
+# Returns the number of posts that were corrected.
+def reconcile_comment_counts(batch_size=1000):
+    conn = get_db_connection()
+    if not conn:
+        return None
+
+    corrected = 0
+    try:
+        cursor = _cursor(conn)
+        cursor.execute("SELECT MIN(PostID), MAX(PostID) FROM Posts")
+        min_id, max_id = cursor.fetchone()
+        if min_id is None:
+            return 0
+
+        for start in range(min_id, max_id + 1, batch_size):
+            end = start + batch_size - 1
+            cursor.execute("""
+                UPDATE Posts p
+                LEFT JOIN (
+                    SELECT PostID, COUNT(*) AS Actual
+                    FROM Comments
+                    WHERE PostID BETWEEN %s AND %s
+                    GROUP BY PostID
+                ) c ON c.PostID = p.PostID
+                SET p.CommentCount = COALESCE(c.Actual, 0)
+                WHERE p.PostID BETWEEN %s AND %s
+                  AND p.CommentCount <> COALESCE(c.Actual, 0)
+            """, (start, end, start, end))
+            corrected += cursor.rowcount
+            conn.commit()
+    except Error as e:
+        print(f"Error in reconcile_comment_counts: {e}")
+        if conn.is_connected():
+            conn.rollback()
+        return None
+    finally:
+        if conn.is_connected():
+            cursor.close()
+        conn.close()
+    return corrected
+
+# Moves the counter shards of up to batch_size options into PollOptions.VoteCount.
+# Returns the number of options folded (0 once there is nothing left), or None on error.
+def fold_vote_counter_shards(batch_size=500):
+    conn = get_db_connection()
+    if not conn:
+        return None
+
+    folded = 0
+    try:
+        # The IN lists change size from batch to batch
+        cursor = _cursor(conn, prepared=False)
+        cursor.execute("SELECT DISTINCT OptionID FROM PollOptionCounterShards ORDER BY OptionID LIMIT %s", (batch_size,))
+        option_ids = [row[0] for row in cursor.fetchall()]
+        if not option_ids:
+            return 0
+
+        placeholders = _in_placeholders(len(option_ids))
+        # Lock the shards being folded, votes on these options wait for the commit rather than being lost
+        cursor.execute(f"""
+            SELECT OptionID, SUM(VoteCount)
+            FROM PollOptionCounterShards
+            WHERE OptionID IN ({placeholders})
+            GROUP BY OptionID
+            FOR UPDATE
+        """, option_ids)
+        totals = cursor.fetchall()
+        if totals:
+            cases = " ".join(["WHEN %s THEN %s"] * len(totals))
+            cursor.execute(
+                f"UPDATE PollOptions SET VoteCount = VoteCount + CASE OptionID {cases} ELSE 0 END WHERE OptionID IN ({_in_placeholders(len(totals))})",
+                [value for option_id, total in totals for value in (option_id, int(total))] + [option_id for option_id, _ in totals])
+        cursor.execute(f"DELETE FROM PollOptionCounterShards WHERE OptionID IN ({placeholders})", option_ids)
+        conn.commit()
+        folded = len(option_ids)
+    except Error as e:
+        print(f"Error in fold_vote_counter_shards: {e}")
+        if conn.is_connected():
+            conn.rollback()
+        return None
+    finally:
+        if conn.is_connected():
+            cursor.close()
+        conn.close()
+    return folded
+
+# What archive_posts copies, in order, each as INSERT ... SELECT over the PostIDs of one batch
+ARCHIVE_COPIES = (
+    """
+        INSERT INTO Posts_Archive (PostID, AuthorUserID, PostType, Title, Content, AllowComments, CommentCount, CreationTimestamp)
+        SELECT PostID, AuthorUserID, PostType, Title, Content, AllowComments, CommentCount, CreationTimestamp
+        FROM Posts WHERE PostID IN ({ids})
+    """,
+    f"""
+        INSERT INTO PollOptions_Archive (OptionID, PostID, OptionText, VoteCount)
+        SELECT po.OptionID, po.PostID, po.OptionText, {OPTION_VOTE_COUNT}
+        FROM PollOptions po
+        LEFT JOIN PollOptionCounterShards s ON s.OptionID = po.OptionID
+        WHERE po.PostID IN ({{ids}})
+        GROUP BY po.OptionID
+    """,
+    """
+        INSERT INTO PollVotes_Archive (VoteID, UserID, PostID, OptionID, Timestamp)
+        SELECT VoteID, UserID, PostID, OptionID, Timestamp
+        FROM PollVotes WHERE PostID IN ({ids})
+    """,
+    """
+        INSERT INTO ItemVotes_Archive (VoteID, UserID, PostID, VoteType, Timestamp)
+        SELECT VoteID, UserID, PostID, VoteType, Timestamp
+        FROM ItemVotes WHERE PostID IN ({ids})
+    """,
+    """
+        INSERT INTO VoteItemTallies_Archive (PostID, ForCount, AgainstCount, AbstainCount, LastUpdated)
+        SELECT PostID, ForCount, AgainstCount, AbstainCount, LastUpdated
+        FROM VoteItemTallies WHERE PostID IN ({ids})
+    """,
+    """
+        INSERT INTO Comments_Archive (CommentID, PostID, UserID, Content, Timestamp)
+        SELECT CommentID, PostID, UserID, Content, Timestamp
+        FROM Comments WHERE PostID IN ({ids})
+    """,
+)
+
+# Moves up to batch_size of the oldest posts created before `before` (naive UTC), with their options,
+# votes, tallies and comments, into the *_Archive tables. Posts still in use, with a vote or comment
+# at or after idle_since, stay where they are: there is no "closed" state for polls or threads, so
+# going quiet stands in for it. One transaction per batch: the posts are locked, copied, then deleted
+# from Posts, which takes the rest with it (ON DELETE CASCADE). Only rows of the batch are locked,
+# so votes and comments on other posts carry on meanwhile.
+# Returns the number of posts moved (0 once there is nothing left), or None on error.
+def archive_posts(before, batch_size=100, idle_since=None):
+    conn = get_db_connection()
+    if not conn:
+        return None
+
+    moved = 0
+    try:
+        # The IN lists change size from batch to batch, so these are not worth keeping prepared
+        cursor = _cursor(conn, prepared=False)
+        idle_since = idle_since or before
+        # Picked without locking, so the posts skipped for recent activity are never locked
+        cursor.execute("""
+            SELECT p.PostID FROM Posts p
+            WHERE p.CreationTimestamp < %s
+              AND NOT EXISTS (SELECT 1 FROM Comments c WHERE c.PostID = p.PostID AND c.Timestamp >= %s)
+              AND NOT EXISTS (SELECT 1 FROM PollVotes v WHERE v.PostID = p.PostID AND v.Timestamp >= %s)
+              AND NOT EXISTS (SELECT 1 FROM ItemVotes v WHERE v.PostID = p.PostID AND v.Timestamp >= %s)
+            ORDER BY p.CreationTimestamp, p.PostID
+            LIMIT %s
+        """, (before, idle_since, idle_since, idle_since, batch_size))
+        candidates = [row[0] for row in cursor.fetchall()]
+        if not candidates:
+            conn.rollback()
+            return 0
+        # Locking the posts makes new votes and comments on them wait for the commit (their foreign
+        # keys), and anything that got in before the lock is copied along with the rest
+        cursor.execute(f"SELECT PostID FROM Posts WHERE PostID IN ({_in_placeholders(len(candidates))}) FOR UPDATE", candidates)
+        post_ids = [row[0] for row in cursor.fetchall()]
+        if not post_ids:
+            conn.rollback()
+            return 0
+
+        ids = _in_placeholders(len(post_ids))
+        for statement in ARCHIVE_COPIES:
+            cursor.execute(statement.format(ids=ids), post_ids)
+        cursor.execute(f"DELETE FROM Posts WHERE PostID IN ({ids})", post_ids)
+        conn.commit()
+        moved = len(post_ids)
+        # Cached pages may still list these posts, get_feed_posts finds them in the archive
+        for post_id in post_ids:
+            feed_cache.invalidate_post(post_id)
+    except Error as e:
+        print(f"Error in archive_posts: {e}")
+        if conn.is_connected():
+            conn.rollback()
+        return None
+    finally:
+        if conn.is_connected():
+            cursor.close()
+        conn.close()
+    return moved
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# In-process publish/subscribe for the live feed stream (GET /api/feed/stream).
+# db_queries publishes small deltas after each committed write, every connected client holds a
+# Subscription with a bounded buffer. A client too slow to keep up is not allowed to grow memory:
+# its buffer is dropped and it is told to resync (reload the feed) instead.
+#
+# The stream is meant to be served by green-thread workers (see gunicorn.conf.py), where one process
+# holds thousands of idle connections. On its own the broker only reaches clients of the process that
+# made the write, so with more than one worker set EVENTS_REDIS_URL: events are then published to a
+# Redis pub/sub channel and every process relays them to its own subscribers. When a relay loses its
+# Redis connection, its clients are sent a resync, since anything published meanwhile is lost.
+#
+# In the async serving mode (asgi.py) the stream is served on the event loop instead, with an
+# AsyncSubscription: publishers on other threads hand it events through the loop, never blocking it.
+
+# Sent in place of the dropped events when a subscriber's buffer overflows
+RESYNC = ("resync", {})
+
+
+class Subscription:
+    def __init__(self, max_buffer):
+        self.max_buffer = max_buffer
+        self._cond = threading.Condition()
+        self._events = deque()
+        self._overflowed = False
+        self.closed = False
+
+    def put(self, event):
+        with self._cond:
+            if self._overflowed:
+                return
+            if len(self._events) >= self.max_buffer:
+                self._events.clear()
+                self._overflowed = True
+            else:
+                self._events.append(event)
+            self._cond.notify()
+
+    # Returns the next event, or None if nothing arrived within timeout (time for a heartbeat)
+    def get(self, timeout):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not self._events and not self._overflowed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            if self._overflowed:
+                self._overflowed = False
+                return RESYNC
+            return self._events.popleft()
+
+
+class AsyncSubscription:
+    def __init__(self, max_buffer, loop):
+        self.max_buffer = max_buffer
+        self._loop = loop
+        self._arrived = asyncio.Event()
+        self._events = deque()
+        self._overflowed = False
+        self.closed = False
+
+    # Called from any thread
+    def put(self, event):
+        try:
+            self._loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # The loop has shut down
+            pass
+
+    def _put(self, event):
+        if self._overflowed:
+            return
+        if len(self._events) >= self.max_buffer:
+            self._events.clear()
+            self._overflowed = True
+        else:
+            self._events.append(event)
+        self._arrived.set()
+
+    # Async counterpart of Subscription.get
+    async def get(self, timeout):
+        if not self._events and not self._overflowed:
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        if self._overflowed:
+            self._overflowed = False
+            return RESYNC
+        return self._events.popleft()
+
+
+class Broker:
+    def __init__(self, max_buffer=None):
+        self.max_buffer = max_buffer
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+        self.published = 0
+
+    def subscribe(self, loop=None):
+        max_buffer = self.max_buffer or int(os.getenv('FEED_STREAM_BUFFER', 100))
+        if loop is None:
+            subscription = Subscription(max_buffer)
+        else:
+            subscription = AsyncSubscription(max_buffer, loop)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscription.closed = True
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event_type, data):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+            self.published += 1
+        for subscription in subscriptions:
+            subscription.put((event_type, data))
+
+    def stats(self):
+        with self._lock:
+            return {"subscribers": len(self._subscriptions), "published": self.published}
+
+
+class RedisRelay:
+    CHANNEL = "edemocracy:feed-events"
+
+    def __init__(self, url, broker):
+        # redis-py: https://redis-py.readthedocs.io/
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self._error = redis.RedisError
+        self.broker = broker
+        self.pid = os.getpid()
+        self.errors = 0
+        threading.Thread(target=self._listen, name="feed-events", daemon=True).start()
+
+    def publish(self, event_type, data):
+        try:
+            self._redis.publish(self.CHANNEL, json.dumps([event_type, data], default=str))
+        except self._error as e:
+            print(f"Error publishing feed event: {e}")
+            self.errors += 1
+            # At least this process's clients see it
+            self.broker.publish(event_type, data)
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.CHANNEL)
+                for message in pubsub.listen():
+                    event_type, data = json.loads(message['data'])
+                    self.broker.publish(event_type, data)
+            except Exception as e:
+                print(f"Lost the feed event channel, reconnecting: {e}")
+                self.errors += 1
+                self.broker.publish(*RESYNC)
+                time.sleep(1)
+
+
+broker = Broker()
+_relay = None
+_relay_lock = threading.Lock()
+
+# The Redis relay of this process (started after fork), or None without EVENTS_REDIS_URL
+def _get_relay():
+    global _relay
+    redis_url = os.getenv('EVENTS_REDIS_URL')
+    if not redis_url:
+        return None
+    with _relay_lock:
+        if _relay is None or _relay.pid != os.getpid():
+            _relay = RedisRelay(redis_url, broker)
+        return _relay
+
+def publish(event_type, data):
+    relay = _get_relay()
+    if relay is not None:
+        relay.publish(event_type, data)
+    else:
+        broker.publish(event_type, data)
+
+def subscribe():
+    # Starts listening to the other workers' events before the first client needs them
+    _get_relay()
+    return broker.subscribe()
+
+# For a client served on the running event loop
+def subscribe_async():
+    _get_relay()
+    return broker.subscribe(asyncio.get_running_loop())
+
+def unsubscribe(subscription):
+    broker.unsubscribe(subscription)
+
+# One Server-Sent Events message
+def sse_message(event):
+    event_type, data = event
+    return f"event: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
@@ -0,0 +1,56 @@
+import csv
+import datetime
+import io
+import json
+import zlib
+
+# Encoders for the streamed admin exports (GET /api/admin/export/<table>).
+# Each takes the column names and the row chunks from db_queries.stream_votes and yields encoded
+# chunks, so the export never holds more than one chunk of rows or bytes at a time.
+
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+}
+
+# TIMESTAMP columns come back as naive UTC (see db_queries._connect)
+def _value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat() + 'Z'
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8')
+    return value
+
+def csv_chunks(columns, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in chunks:
+        writer.writerows([_value(value) for value in row] for row in rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+def jsonl_chunks(columns, chunks):
+    for rows in chunks:
+        yield "".join(
+            json.dumps(dict(zip(columns, (_value(value) for value in row))), separators=(',', ':')) + "\n"
+            for row in rows
+        ).encode('utf-8')
+
+def encode(export_format, columns, chunks):
+    if export_format == 'csv':
+        return csv_chunks(columns, chunks)
+    return jsonl_chunks(columns, chunks)
+
+# A .gz file of the encoded chunks, written as it goes. Chunks smaller than what deflate buffers come
+# out as nothing until enough has gathered, so these are skipped rather than sent as empty chunks.
+def gzip_chunks(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,118 @@
+import os
+import threading
+# (local module)
+from cache import TTLCache, RedisCache
+
+# Shared layer of the feed cache.
+# Everything in a feed page except the per-user vote state is the same for every user, so we cache:
+#   page:...  -> the post IDs on a page and its next_cursor
+#   post:<id> -> the post dict with its options and comment count
+# The per-user overlay (userHasVoted etc.) is applied by db_queries on top of copies of these entries.
+#
+# Head pages (no cursor) are keyed by a generation number which every new post bumps, so older
+# head pages simply stop being looked up. Pages further back only hold posts older than their
+# cursor, and those sets never change, so they do not need invalidating.
+#
+# Settings: FEED_CACHE_TTL (seconds, 0 disables the cache), FEED_CACHE_SIZE (entries, in process)
+# and FEED_CACHE_REDIS_URL to share the cache between workers through Redis.
+#
+# Invalidation only reaches the cache it runs against. Without FEED_CACHE_REDIS_URL every worker has
+# its own, so with more than one worker (gunicorn's default here is 2) a new post or vote handled by
+# one worker leaves the others serving the old head page and counts for up to FEED_CACHE_TTL. Set
+# FEED_CACHE_REDIS_URL whenever more than one worker runs; gunicorn.conf.py warns at start if it is
+# missing.
+
+_cache = None
+_cache_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {
+    "page_hits": 0,
+    "page_misses": 0,
+    "post_hits": 0,
+    "post_misses": 0,
+    "head_invalidations": 0,
+    "post_invalidations": 0,
+}
+
+def _ttl():
+    return int(os.getenv('FEED_CACHE_TTL', 30))
+
+def enabled():
+    return _ttl() > 0
+
+def _get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            redis_url = os.getenv('FEED_CACHE_REDIS_URL')
+            if redis_url:
+                _cache = RedisCache(redis_url, prefix="feed", ttl=_ttl())
+            else:
+                _cache = TTLCache(maxsize=int(os.getenv('FEED_CACHE_SIZE', 5000)), ttl=_ttl())
+        return _cache
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+# Returns the cache key for a page, or None if the page cannot be cached right now
+def page_key(after, limit):
+    if after is None:
+        generation = _get_cache().get_counter("head_generation")
+        if generation is None:
+            return None
+        return f"page:head:{generation}:{limit}"
+    after_timestamp, after_post_id = after
+    return f"page:{after_timestamp.isoformat()}:{after_post_id}:{limit}"
+
+# Returns {"post_ids": [...], "next_cursor": ...} or None
+def get_page(key):
+    if not enabled() or key is None:
+        return None
+    entry = _get_cache().get(key)
+    _count("page_hits" if entry is not None else "page_misses")
+    return entry
+
+def set_page(key, post_ids, next_cursor):
+    if not enabled() or key is None:
+        return
+    _get_cache().set(key, {"post_ids": post_ids, "next_cursor": next_cursor})
+
+# Returns {post_id: post} for the posts that are cached
+def get_posts(post_ids):
+    if not enabled() or not post_ids:
+        return {}
+    found = _get_cache().get_many([f"post:{post_id}" for post_id in post_ids])
+    posts = {post['PostID']: post for post in found.values()}
+    _count("post_hits", len(posts))
+    _count("post_misses", len(post_ids) - len(posts))
+    return posts
+
+def set_posts(posts):
+    if not enabled():
+        return
+    cache = _get_cache()
+    for post in posts:
+        cache.set(f"post:{post['PostID']}", post)
+
+# A post was created, so every head page is out of date
+def invalidate_head():
+    if not enabled():
+        return
+    _get_cache().incr("head_generation")
+    _count("head_invalidations")
+
+# Something shown in a single post changed (vote or comment count)
+def invalidate_post(post_id):
+    if not enabled():
+        return
+    _get_cache().delete(f"post:{post_id}")
+    _count("post_invalidations")
+
+def stats():
+    with _stats_lock:
+        feed_stats = dict(_stats)
+    feed_stats["enabled"] = enabled()
+    feed_stats["backend"] = _get_cache().stats()
+    return feed_stats
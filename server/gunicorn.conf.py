@@ -0,0 +1,33 @@
+# Production server settings, run from the server directory with:
+#   gunicorn -c gunicorn.conf.py app:app
+# Gunicorn settings: https://docs.gunicorn.org/en/stable/settings.html
+#
+# The default gevent worker runs every request in a green thread, so the long-lived
+# /api/feed/stream connections cost a few KB each instead of a whole OS thread, and a
+# single worker can hold thousands of them. The connection pool and the event broker use
+# threading primitives, which gevent's monkey patching turns into green ones, and
+# mysql-connector is switched to its pure Python protocol so queries yield too.
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gevent')
+# Open connections per gevent worker, idle feed streams included
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 5000))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+keepalive = 5
+
+if worker_class == 'gevent':
+    os.environ.setdefault('DB_USE_PURE', 'true')
+
+# Settings that have to be shared between workers for the app to behave as one server
+SHARED_WITH_SEVERAL_WORKERS = {
+    'FEED_CACHE_REDIS_URL': "new posts and vote counts reach other workers' feed caches only after FEED_CACHE_TTL",
+    'EVENTS_REDIS_URL': "/api/feed/stream clients only get the events of writes handled by their own worker",
+}
+
+def on_starting(server):
+    if workers > 1:
+        for setting, consequence in SHARED_WITH_SEVERAL_WORKERS.items():
+            if not os.getenv(setting):
+                server.log.warning(f"{workers} workers without {setting}: {consequence}")
@@ -0,0 +1,261 @@
+import contextvars
+import cProfile
+import functools
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+# Request tracing and timing for the Flask app, exported in the Prometheus text format on /metrics.
+#
+# init_app() gives every request an ID (the client's X-Request-ID, or a new one) which is echoed in the
+# response, and times the request per route. instrument_module(db_queries) wraps the module's public
+# functions that check out a connection, and the connection getters themselves, so each call,
+# connection checkout and cursor execute is timed and attributed to the db_queries function and
+# request it ran for. Helpers that never touch the database are left alone, as is stream_votes,
+# which opens its own connection and does its work after returning. Executes slower than
+# SLOW_QUERY_MS (default 200, 0 turns the log off) are printed with the request ID and SQL.
+#
+# PROFILE_SAMPLE_RATE (default 0) runs that fraction of requests under cProfile and writes the stats
+# to PROFILE_DIR/<route>-<request id>.prof, for "python -m pstats" or snakeviz.
+#
+# Metrics are kept per process: with several gunicorn workers each scrape sees the worker that
+# answered it, so scrape the workers individually or compare rates rather than totals.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 1000, 10000)
+
+request_id = contextvars.ContextVar('request_id', default=None)
+_db_function = contextvars.ContextVar('db_function', default=None)
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # label values -> [bucket counts..., +Inf count, sum]
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for label_values, values in sorted(series.items()):
+            labels = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{le}"}} {cumulative}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {values[-1]}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return "\n".join(lines)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _gauge(name, help_text, value):
+    return f"# HELP {name} {help_text}\n# TYPE {name} gauge\n{name} {value}"
+
+
+http_request_seconds = Histogram(
+    "edemocracy_http_request_duration_seconds", "Time to answer a request.", ("route", "method", "status"))
+db_call_seconds = Histogram(
+    "edemocracy_db_call_duration_seconds", "Time spent in a db_queries function, connection included.", ("function",))
+db_query_seconds = Histogram(
+    "edemocracy_db_query_duration_seconds", "Time to execute one statement.", ("function",))
+db_query_rows = Histogram(
+    "edemocracy_db_query_rows", "Rows fetched by one statement.", ("function",), buckets=ROW_BUCKETS)
+db_acquire_seconds = Histogram(
+    "edemocracy_db_pool_acquire_duration_seconds", "Time to check a connection out of the pool.", ())
+
+# Extra gauges for /metrics, name -> (help, function returning a number)
+_gauges = {}
+
+def register_gauge(name, help_text, read):
+    _gauges[name] = (help_text, read)
+
+def render_metrics():
+    parts = [metric.render() for metric in (http_request_seconds, db_call_seconds, db_query_seconds, db_query_rows, db_acquire_seconds)]
+    for name, (help_text, read) in sorted(_gauges.items()):
+        try:
+            parts.append(_gauge(name, help_text, read()))
+        except Exception as e:
+            print(f"Error reading gauge {name}: {e}")
+    return "\n".join(parts) + "\n"
+
+
+def _slow_query_seconds():
+    return float(os.getenv('SLOW_QUERY_MS', 200)) / 1000
+
+def _log_slow_query(elapsed, sql):
+    statement = re.sub(r"\s+", " ", str(sql)).strip()
+    print(f"Slow query ({elapsed * 1000:.0f} ms) request={request_id.get()} function={_db_function.get()}: {statement[:500]}", flush=True)
+
+
+class TimedCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def _timed(self, method, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            db_query_seconds.observe(elapsed, _db_function.get() or "")
+            threshold = _slow_query_seconds()
+            if threshold and elapsed >= threshold:
+                _log_slow_query(elapsed, args[0] if args else "")
+
+    def execute(self, *args, **kwargs):
+        return self._timed(self._cursor.execute, *args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self._timed(self._cursor.executemany, *args, **kwargs)
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        db_query_rows.observe(len(rows), _db_function.get() or "")
+        return rows
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        db_query_rows.observe(len(rows), _db_function.get() or "")
+        return rows
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        db_query_rows.observe(0 if row is None else 1, _db_function.get() or "")
+        return row
+
+
+class TimedConnection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._conn.close()
+
+    def cursor(self, *args, **kwargs):
+        return TimedCursor(self._conn.cursor(*args, **kwargs))
+
+    def statement_cursor(self, *args, **kwargs):
+        return TimedCursor(self._conn.statement_cursor(*args, **kwargs))
+
+
+def _timed_db_function(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # Nested calls (get_user_role -> get_user_profile_by_id) are part of the outermost one
+        if _db_function.get() is not None:
+            return func(*args, **kwargs)
+        token = _db_function.set(func.__name__)
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            db_call_seconds.observe(time.perf_counter() - started, func.__name__)
+            _db_function.reset(token)
+    wrapper.__instrumented__ = True
+    return wrapper
+
+def _timed_get_db_connection(get_db_connection):
+    @functools.wraps(get_db_connection)
+    def wrapper():
+        started = time.perf_counter()
+        conn = get_db_connection()
+        db_acquire_seconds.observe(time.perf_counter() - started)
+        return TimedConnection(conn) if conn else conn
+    wrapper.__instrumented__ = True
+    return wrapper
+
+CONNECTION_GETTERS = ('get_db_connection', 'get_read_connection')
+
+# Whether func checks out a pooled connection itself
+def _checks_out_connection(func):
+    code = getattr(func, '__code__', None)
+    return code is not None and any(name in code.co_names for name in CONNECTION_GETTERS)
+
+# Wraps the public functions of db_queries that query through the pool, in place. Functions inside
+# the module call each other through the module globals, so those calls go through the wrappers as well.
+def instrument_module(module):
+    for name, value in list(vars(module).items()):
+        if getattr(value, '__instrumented__', False) or not callable(value) or isinstance(value, type):
+            continue
+        if getattr(value, '__module__', None) != module.__name__:
+            continue
+        if name in CONNECTION_GETTERS:
+            setattr(module, name, _timed_get_db_connection(value))
+        elif not name.startswith('_') and _checks_out_connection(value):
+            setattr(module, name, _timed_db_function(value))
+
+
+def init_app(app):
+    # Flask: https://flask.palletsprojects.com/
+    from flask import g, request
+
+    @app.before_request
+    def start_request():
+        g.request_started = time.perf_counter()
+        g.request_id_token = request_id.set(request.headers.get('X-Request-ID') or uuid.uuid4().hex)
+        sample_rate = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+        if sample_rate and random.random() < sample_rate:
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def finish_request(response):
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            profile_dir = os.getenv('PROFILE_DIR', 'profiles')
+            os.makedirs(profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(profile_dir, f"{request.endpoint or 'unknown'}-{request_id.get()}.prof"))
+
+        response.headers['X-Request-ID'] = request_id.get() or ''
+        started = g.get('request_started')
+        if started is not None:
+            # The route's rule rather than the path, so /api/posts/<int:post_id>/comments is one series
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            http_request_seconds.observe(time.perf_counter() - started, route, request.method, str(response.status_code))
+        return response
+
+    @app.teardown_request
+    def end_request(exc):
+        token = g.pop('request_id_token', None)
+        if token is not None:
+            try:
+                request_id.reset(token)
+            except ValueError:
+                # Set in another context (a streamed response finishing on its own greenlet)
+                pass
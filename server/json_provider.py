@@ -0,0 +1,69 @@
+import datetime
+import decimal
+import re
+# Flask: https://flask.palletsprojects.com/
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+# Faster JSON for jsonify when orjson is installed, otherwise Flask's own provider is kept.
+# The output follows DefaultJSONProvider (compact, sorted keys, datetimes as HTTP dates, Decimal as
+# str, everything outside ASCII written as \u escapes) so ETags come out the same whichever provider
+# is in use. asgi.py installs it on the Quart app too.
+try:
+    # orjson: https://github.com/ijl/orjson
+    import orjson
+except ImportError:
+    orjson = None
+
+
+_NON_ASCII = re.compile(r'[^\x00-\x7e]')
+
+def _escape(match):
+    code = ord(match.group())
+    if code > 0xFFFF:
+        # Outside the BMP: a surrogate pair, as json.dumps writes it
+        code -= 0x10000
+        return f"\\u{0xD800 | (code >> 10):04x}\\u{0xDC00 | (code & 0x3FF):04x}"
+    return f"\\u{code:04x}"
+
+# orjson always writes UTF-8, DefaultJSONProvider (ensure_ascii) escapes everything outside ASCII,
+# and DEL. Both only occur inside JSON strings, so escaping them wherever they are is safe.
+def ascii_json(text):
+    if text.isascii() and '\x7f' not in text:
+        return text
+    return _NON_ASCII.sub(_escape, text)
+
+
+def _default(value):
+    # orjson hands datetimes here because of OPT_PASSTHROUGH_DATETIME, to keep Flask's format
+    if isinstance(value, datetime.date):
+        return http_date(value)
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    options = 0
+    if orjson is not None:
+        options = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(self, obj, **kwargs):
+        return ascii_json(orjson.dumps(obj, default=_default, option=self.options).decode('utf-8'))
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        # Skips the bytes -> str -> bytes round trip of dumps() for the usual all-ASCII body
+        body = orjson.dumps(obj, default=_default, option=self.options)
+        if not body.isascii() or b'\x7f' in body:
+            body = ascii_json(body.decode('utf-8')).encode('ascii')
+        body += b"\n"
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def init_app(app):
+    if orjson is not None:
+        app.json = OrjsonProvider(app)
@@ -0,0 +1,102 @@
+# Maintenance commands, run from the server directory:
+#   python manage.py reconcile-comment-counts [--batch-size N]
+#   python manage.py fold-vote-shards [--batch-size N] [--every SECONDS]
+#   python manage.py build-search-index
+#   python manage.py archive [--older-than-days N] [--idle-days N] [--batch-size N] [--pause SECONDS]
+# argparse: https://docs.python.org/3/library/argparse.html
+import argparse
+import datetime
+import sys
+import time
+# python-dotenv: https://pypi.org/project/python-dotenv/
+from dotenv import load_dotenv
+# (local module)
+import db_queries
+
+def reconcile_comment_counts(args):
+    corrected = db_queries.reconcile_comment_counts(args.batch_size)
+    if corrected is None:
+        print("Reconciliation failed")
+        return 1
+    print(f"Corrected comment counts on {corrected} post(s)")
+    return 0
+
+# Folds until the shard table is empty, then either stops or sleeps and goes again
+def fold_vote_shards(args):
+    while True:
+        total = 0
+        while True:
+            folded = db_queries.fold_vote_counter_shards(args.batch_size)
+            if folded is None:
+                print("Folding vote counter shards failed")
+                if not args.every:
+                    return 1
+                break
+            total += folded
+            if folded == 0:
+                break
+        print(f"Folded vote counter shards of {total} option(s)")
+        if not args.every:
+            return 0
+        time.sleep(args.every)
+
+def build_search_index(args):
+    added = db_queries.ensure_search_indexes()
+    if added is None:
+        print("Building the search indexes failed")
+        return 1
+    if added:
+        print(f"Added {', '.join(added)}")
+    else:
+        print("Search indexes already exist")
+    return 0
+
+# Archives batch after batch until no post older than the cutoff is left in Posts, pausing between
+# batches so replicas and the live traffic keep up
+def archive(args):
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    before = now - datetime.timedelta(days=args.older_than_days)
+    idle_since = now - datetime.timedelta(days=args.idle_days)
+    total = 0
+    while True:
+        moved = db_queries.archive_posts(before, args.batch_size, idle_since)
+        if moved is None:
+            print(f"Archiving failed after {total} post(s)")
+            return 1
+        total += moved
+        if moved < args.batch_size:
+            break
+        time.sleep(args.pause)
+    print(f"Archived {total} post(s) created before {before:%Y-%m-%d %H:%M} UTC")
+    return 0
+
+def main():
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="EDemocracy maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    reconcile = subparsers.add_parser("reconcile-comment-counts", help="Recompute drifted Posts.CommentCount values")
+    reconcile.add_argument("--batch-size", type=int, default=1000, help="Posts per UPDATE (default 1000)")
+    reconcile.set_defaults(handler=reconcile_comment_counts)
+
+    fold = subparsers.add_parser("fold-vote-shards", help="Move PollOptionCounterShards into PollOptions.VoteCount")
+    fold.add_argument("--batch-size", type=int, default=500, help="Options per transaction (default 500)")
+    fold.add_argument("--every", type=float, default=None, help="Keep running, folding every N seconds")
+    fold.set_defaults(handler=fold_vote_shards)
+
+    search = subparsers.add_parser("build-search-index", help="Add the FULLTEXT indexes used by /api/search")
+    search.set_defaults(handler=build_search_index)
+
+    archiver = subparsers.add_parser("archive", help="Move old posts with their votes and comments to the *_Archive tables")
+    archiver.add_argument("--older-than-days", type=float, default=365, help="Archive posts older than N days (default 365)")
+    archiver.add_argument("--idle-days", type=float, default=90, help="Keep posts with votes or comments in the last N days (default 90)")
+    archiver.add_argument("--batch-size", type=int, default=100, help="Posts per transaction (default 100)")
+    archiver.add_argument("--pause", type=float, default=0.5, help="Seconds to wait between batches (default 0.5)")
+    archiver.set_defaults(handler=archive)
+
+    args = parser.parse_args()
+    return args.handler(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+import asyncio
+import math
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+# bcrypt: https://pypi.org/project/bcrypt/
+import bcrypt
+
+# Password hashing for registration and login.
+# bcrypt is deliberately slow, so it never runs on a request thread or the event loop: every hash
+# and check goes to a small, fixed size process pool (BCRYPT_WORKERS) shared by all requests of this
+# server process. At most BCRYPT_MAX_QUEUE jobs may be waiting or running at once. Past that,
+# PasswordPoolBusy is raised straight away and the route answers 503 with Retry-After, so a login
+# spike can't take over the workers that cheap requests like /api/feed need.
+#
+# The cost factor comes from BCRYPT_ROUNDS. Hashes made with a different cost still verify, and
+# needs_rehash() tells login to store a fresh hash at the current cost.
+
+DEFAULT_ROUNDS = 12
+LATENCY_SAMPLES = 1000
+
+
+class PasswordPoolBusy(Exception):
+    def __init__(self, retry_after):
+        super().__init__("Password hashing queue is full")
+        self.retry_after = retry_after
+
+
+def get_rounds():
+    return int(os.getenv('BCRYPT_ROUNDS', DEFAULT_ROUNDS))
+
+# Run in the worker processes
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds))
+
+def _check(password, stored_hash):
+    return bcrypt.checkpw(password.encode('utf-8'), stored_hash.encode('utf-8'))
+
+# The cost is the second field of the hash, e.g. "$2b$12$..."
+def hash_rounds(stored_hash):
+    try:
+        return int(stored_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+def needs_rehash(stored_hash):
+    return hash_rounds(stored_hash) != get_rounds()
+
+
+class PasswordPool:
+    def __init__(self, workers, max_queue):
+        self.workers = workers
+        self.max_queue = max_queue
+        # Spawned rather than forked: the server process may already be running threads or greenlets
+        self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.completed = 0
+        self.rejected = 0
+
+    def submit(self, func, *args):
+        with self._lock:
+            if self._in_flight >= self.max_queue:
+                self.rejected += 1
+                raise PasswordPoolBusy(self._retry_after())
+            self._in_flight += 1
+        started = time.monotonic()
+        try:
+            future = self._executor.submit(func, *args)
+        except Exception:
+            with self._lock:
+                self._in_flight -= 1
+            raise
+        future.add_done_callback(lambda _: self._done(started))
+        return future
+
+    def _done(self, started):
+        with self._lock:
+            self._in_flight -= 1
+            self.completed += 1
+            self._latencies.append(time.monotonic() - started)
+
+    # Seconds until the queue has likely drained enough to accept a new job
+    def _retry_after(self):
+        if not self._latencies:
+            return 1
+        avg = sum(self._latencies) / len(self._latencies)
+        return max(1, math.ceil(self._in_flight * avg / self.workers))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            in_flight = self._in_flight
+            completed, rejected = self.completed, self.rejected
+
+        def percentile(fraction):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000, 1)
+
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "queue_depth": in_flight,
+            "completed": completed,
+            "rejected": rejected,
+            "rounds": get_rounds(),
+            "latency_ms_p50": percentile(0.50),
+            "latency_ms_p95": percentile(0.95),
+            "latency_ms_max": round(latencies[-1] * 1000, 1) if latencies else None,
+        }
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+# One pool per process: a forked server worker must not share its parent's executor
+def get_pool():
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            workers = int(os.getenv('BCRYPT_WORKERS', os.cpu_count() or 2))
+            _pool = PasswordPool(workers, int(os.getenv('BCRYPT_MAX_QUEUE', workers * 4)))
+            _pool_pid = os.getpid()
+        return _pool
+
+def hash_password(password):
+    return get_pool().submit(_hash, password, get_rounds()).result()
+
+def check_password(password, stored_hash):
+    return get_pool().submit(_check, password, stored_hash).result()
+
+async def hash_password_async(password):
+    return await asyncio.wrap_future(get_pool().submit(_hash, password, get_rounds()))
+
+async def check_password_async(password, stored_hash):
+    return await asyncio.wrap_future(get_pool().submit(_check, password, stored_hash))
+
+def stats():
+    return get_pool().stats()
@@ -0,0 +1,199 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Write throttling for the Flask app (see rate_limited in app.py).
+#
+# Every limited route has a budget per user and per client IP, as token buckets: "30/60" lets 30
+# requests through at once and refills at 30 per 60 seconds. Budgets are set per route name with
+# RATE_LIMIT_<NAME>_USER / RATE_LIMIT_<NAME>_IP (e.g. RATE_LIMIT_VOTE_USER=30/60), over the defaults
+# in app.py. Buckets live in the process unless RATE_LIMIT_REDIS_URL is set, in which case all workers
+# share them through Redis. When Redis can't be reached requests are let through (fail open).
+#
+# The client IP is only as good as request.remote_addr. Behind reverse proxies (nginx, a load
+# balancer) set TRUSTED_PROXY_HOPS to their number, and app.py takes the client's address from
+# X-Forwarded-For. Without it every client would share the proxy's IP and so a single budget, so the
+# per-IP buckets are only used once TRUSTED_PROXY_HOPS is set, or with RATE_LIMIT_BY_IP=true for a
+# server that clients reach directly.
+#
+# On top of that, WRITE_CONCURRENCY caps the number of limited requests a process runs at once
+# (default: the connection pool's size plus overflow). Past the cap, requests are turned away
+# immediately instead of queueing for a database connection.
+#
+# RATE_LIMIT_ENABLED=false turns both off.
+
+def enabled():
+    return os.getenv('RATE_LIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+def trusted_proxy_hops():
+    return int(os.getenv('TRUSTED_PROXY_HOPS', 0))
+
+def ip_scope_enabled():
+    by_ip = os.getenv('RATE_LIMIT_BY_IP')
+    if by_ip is not None:
+        return by_ip.lower() in ('1', 'true', 'yes')
+    return trusted_proxy_hops() > 0
+
+# "30/60" -> (rate per second, burst)
+def parse_budget(budget):
+    count, seconds = budget.split('/')
+    return int(count) / float(seconds), int(count)
+
+
+class TokenBuckets:
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        # key -> (tokens, last refill), least recently used first
+        self._buckets = OrderedDict()
+
+    # Takes one token. Returns (allowed, seconds until a token is available)
+    def acquire(self, key, rate, burst):
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            # A dropped bucket just starts full again, so only idle ones should go
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+    def stats(self):
+        with self._lock:
+            return {"backend": "memory", "keys": len(self._buckets)}
+
+
+class RedisTokenBuckets:
+    # Same arithmetic as TokenBuckets, run atomically inside Redis
+    SCRIPT = """
+        local rate = tonumber(ARGV[1])
+        local burst = tonumber(ARGV[2])
+        local now = tonumber(ARGV[3])
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+        local tokens = tonumber(bucket[1]) or burst
+        local last = tonumber(bucket[2]) or now
+        tokens = math.min(burst, tokens + math.max(0, now - last) * rate)
+        local allowed = 0
+        local wait = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+            allowed = 1
+        else
+            wait = (1 - tokens) / rate
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+        return {allowed, tostring(wait)}
+    """
+
+    def __init__(self, url, prefix="ratelimit"):
+        # redis-py: https://redis-py.readthedocs.io/
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self._script = self._redis.register_script(self.SCRIPT)
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.errors = 0
+
+    def acquire(self, key, rate, burst):
+        try:
+            allowed, wait = self._script(keys=[f"{self.prefix}:{key}"], args=[rate, burst, time.time()])
+        except Exception as e:
+            print(f"Error in Redis rate limiter: {e}")
+            with self._lock:
+                self.errors += 1
+            return True, 0
+        return bool(allowed), float(wait)
+
+    def stats(self):
+        with self._lock:
+            return {"backend": "redis", "errors": self.errors}
+
+
+class ConcurrencyLimit:
+    def __init__(self, limit):
+        self.limit = limit
+        self._semaphore = threading.BoundedSemaphore(limit)
+
+    # Never waits, False means the process is already at its limit
+    def try_enter(self):
+        return self._semaphore.acquire(blocking=False)
+
+    def leave(self):
+        self._semaphore.release()
+
+
+_buckets = None
+_concurrency = None
+_setup_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"allowed": 0, "limited": 0, "shed": 0}
+
+def get_buckets():
+    global _buckets
+    with _setup_lock:
+        if _buckets is None:
+            redis_url = os.getenv('RATE_LIMIT_REDIS_URL')
+            if redis_url:
+                _buckets = RedisTokenBuckets(redis_url)
+            else:
+                _buckets = TokenBuckets(int(os.getenv('RATE_LIMIT_MAX_KEYS', 100000)))
+        return _buckets
+
+def get_concurrency_limit():
+    global _concurrency
+    with _setup_lock:
+        if _concurrency is None:
+            default = int(os.getenv('DB_POOL_SIZE', 5)) + int(os.getenv('DB_POOL_MAX_OVERFLOW', 10))
+            _concurrency = ConcurrencyLimit(int(os.getenv('WRITE_CONCURRENCY', default)))
+        return _concurrency
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+def budget(name, scope, default):
+    return parse_budget(os.getenv(f"RATE_LIMIT_{name.upper()}_{scope.upper()}", default))
+
+# Checks the user's and the IP's bucket for route name. Returns None if the request may go ahead,
+# or the number of seconds the client should wait.
+def check(name, user_id, ip, user_default, ip_default):
+    buckets = get_buckets()
+    waits = []
+    scopes = [("user", user_id, user_default)]
+    if ip_scope_enabled():
+        scopes.append(("ip", ip, ip_default))
+    for scope, key, default in scopes:
+        rate, burst = budget(name, scope, default)
+        allowed, wait = buckets.acquire(f"{name}:{scope}:{key}", rate, burst)
+        if not allowed:
+            waits.append(wait)
+    if waits:
+        _count("limited")
+        return max(1, math.ceil(max(waits)))
+    _count("allowed")
+    return None
+
+def enter():
+    if get_concurrency_limit().try_enter():
+        return True
+    _count("shed")
+    return False
+
+def leave():
+    get_concurrency_limit().leave()
+
+def stats():
+    with _stats_lock:
+        counts = dict(_stats)
+    counts["by_ip"] = ip_scope_enabled()
+    counts["write_concurrency"] = get_concurrency_limit().limit
+    counts["backend"] = get_buckets().stats()
+    return counts
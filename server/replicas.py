@@ -0,0 +1,175 @@
+import contextvars
+import os
+import threading
+import time
+# (local module)
+from cache import TTLCache, RedisCache
+
+# Read replicas for the read-only db_queries functions (see get_read_connection there).
+#
+# DB_REPLICA_HOSTS lists replicas of DB_HOST as "host[:port],host[:port]", reached with the same
+# DB_USER, DB_PASSWORD and DB_NAME. Reads go to them in turn. A replica that refuses a connection is
+# left out for DB_REPLICA_EJECT_SECONDS (default 30). Every DB_REPLICA_LAG_CHECK_SECONDS (default 5)
+# a read also asks the replica how far behind it is (SHOW REPLICA STATUS, the user needs the
+# REPLICATION CLIENT privilege), and replicas more than DB_REPLICA_MAX_LAG seconds (default 5) behind,
+# or not replicating at all, are skipped until they catch up. With no usable replica reads go to the
+# primary.
+#
+# Read-your-writes: a user who has just written (voted, commented, posted) reads from the primary for
+# DB_REPLICA_PIN_SECONDS (default 5), so they see their own write even on a lagging replica. The user
+# of the current request is set by token_required in app.py. Pins are kept in the process unless
+# DB_REPLICA_PIN_REDIS_URL is set; with several workers they should be shared, or the next request
+# may land on a worker that does not know about the write.
+
+_reader = contextvars.ContextVar('db_reader', default=None)
+
+_pins = None
+_pins_lock = threading.Lock()
+
+def _pin_seconds():
+    return float(os.getenv('DB_REPLICA_PIN_SECONDS', 5))
+
+def _get_pins():
+    global _pins
+    with _pins_lock:
+        if _pins is None:
+            redis_url = os.getenv('DB_REPLICA_PIN_REDIS_URL')
+            if redis_url:
+                _pins = RedisCache(redis_url, prefix="replica-pin", ttl=_pin_seconds())
+            else:
+                _pins = TTLCache(maxsize=int(os.getenv('DB_REPLICA_PIN_SIZE', 10000)), ttl=_pin_seconds())
+        return _pins
+
+# Makes user_id the reader of the current request, returns a token for reset_reader()
+def set_reader(user_id):
+    return _reader.set(user_id)
+
+def reset_reader(token):
+    _reader.reset(token)
+
+# Sends user_id's reads to the primary for the next DB_REPLICA_PIN_SECONDS
+def pin(user_id):
+    if user_id is not None and _pin_seconds() > 0:
+        _get_pins().set(user_id, True)
+
+def pinned():
+    user_id = _reader.get()
+    return user_id is not None and _pin_seconds() > 0 and _get_pins().get(user_id, False)
+
+# "db1:3306, db2" -> [("db1", 3306), ("db2", default_port)]
+def parse_hosts(value, default_port):
+    hosts = []
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        host, _, port = part.partition(':')
+        hosts.append((host, int(port) if port else default_port))
+    return hosts
+
+
+class Replica:
+    def __init__(self, host, port, pool):
+        self.host = host
+        self.port = port
+        self.pool = pool
+        self.ejected_until = 0.0
+        # Seconds behind the primary at the last check, None while replication is stopped
+        self.lag = 0.0
+        self.lag_checked_at = None
+        self.reads = 0
+        self.failures = 0
+
+
+class ReplicaSet:
+    def __init__(self, replicas, eject_seconds=30.0, max_lag=5.0, lag_check_seconds=5.0):
+        self.replicas = replicas
+        self.eject_seconds = eject_seconds
+        self.max_lag = max_lag
+        self.lag_check_seconds = lag_check_seconds
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._next = 0
+        self.fallbacks = 0
+
+    # A connection to the next usable replica, or None when the read should go to the primary
+    def acquire(self):
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.replicas)
+        now = time.monotonic()
+        for i in range(len(self.replicas)):
+            replica = self.replicas[(start + i) % len(self.replicas)]
+            if replica.ejected_until > now:
+                continue
+            try:
+                conn = replica.pool.acquire()
+            except Exception as e:
+                print(f"Error connecting to replica {replica.host}:{replica.port}, ejecting it: {e}")
+                with self._lock:
+                    replica.failures += 1
+                    replica.ejected_until = time.monotonic() + self.eject_seconds
+                continue
+            if not self._caught_up(replica, conn):
+                conn.close()
+                continue
+            with self._lock:
+                replica.reads += 1
+            return conn
+        with self._lock:
+            self.fallbacks += 1
+        return None
+
+    def _caught_up(self, replica, conn):
+        now = time.monotonic()
+        if replica.lag_checked_at is None or now - replica.lag_checked_at >= self.lag_check_seconds:
+            replica.lag_checked_at = now
+            try:
+                replica.lag = self._read_lag(conn)
+            except Exception as e:
+                # Without the privilege to ask, the replica is used as if it were current
+                print(f"Error reading lag of replica {replica.host}:{replica.port}: {e}")
+        return replica.lag is not None and replica.lag <= self.max_lag
+
+    def _read_lag(self, conn):
+        cursor = conn.cursor(dictionary=True)
+        try:
+            try:
+                cursor.execute("SHOW REPLICA STATUS")
+            except Exception:
+                # MySQL before 8.0.22
+                cursor.execute("SHOW SLAVE STATUS")
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+        if row is None:
+            # Not set up as a replica (e.g. DB_REPLICA_HOSTS pointing at the primary in development)
+            return 0.0
+        lag = row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+        return float(lag) if lag is not None else None
+
+    def dispose(self):
+        for replica in self.replicas:
+            replica.pool.dispose()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            lags = [replica.lag for replica in self.replicas if replica.lag is not None]
+            return {
+                "fallbacks": self.fallbacks,
+                "max_lag": self.max_lag,
+                "lag_seconds": max(lags) if lags else 0.0,
+                "behind": sum(1 for replica in self.replicas if replica.lag is None or replica.lag > self.max_lag),
+                "replicas": [
+                    {
+                        "host": f"{replica.host}:{replica.port}",
+                        "ejected_for": max(0.0, replica.ejected_until - now),
+                        "lag_seconds": replica.lag,
+                        "reads": replica.reads,
+                        "failures": replica.failures,
+                        "pool": replica.pool.stats(),
+                    }
+                    for replica in self.replicas
+                ],
+            }
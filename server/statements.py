@@ -0,0 +1,146 @@
+import os
+import threading
+from collections import OrderedDict
+
+# Prepared statements that outlive a request.
+# A prepared cursor from mysql-connector prepares its statement on the server the first time it runs,
+# can run it again without re-parsing, and deallocates it on close(). Closing it at the end of every
+# db_queries function meant the server re-prepared the same statements on every call. Each pooled
+# connection now keeps a StatementCache of prepared cursors by SQL text, and db_queries gets a
+# StatementCursor that runs every execute() on the cached cursor for its SQL and leaves them open on
+# close().
+#
+# STATEMENT_CACHE_SIZE (default 64, 0 turns the cache off) caps the statements kept per connection,
+# least recently used ones are deallocated first. MySQL counts prepared statements across all
+# connections against max_prepared_stmt_count, so the cap is lowered to that limit divided by
+# max_connections: the server can never run out, however many workers and pools connect.
+
+
+def configured_size():
+    return int(os.getenv('STATEMENT_CACHE_SIZE', 64))
+
+# The cache size for connections to the server raw is connected to
+def per_connection_limit(raw, size):
+    if size <= 0:
+        return 0
+    cursor = raw.cursor()
+    try:
+        cursor.execute("SELECT @@global.max_prepared_stmt_count, @@global.max_connections")
+        max_statements, max_connections = cursor.fetchone()
+    finally:
+        cursor.close()
+    return max(0, min(size, int(max_statements) // max(1, int(max_connections))))
+
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+def _count(hits=0, misses=0, evictions=0):
+    with _stats_lock:
+        _stats["hits"] += hits
+        _stats["misses"] += misses
+        _stats["evictions"] += evictions
+
+def stats():
+    with _stats_lock:
+        counts = dict(_stats)
+    lookups = counts["hits"] + counts["misses"]
+    counts["hit_rate"] = counts["hits"] / lookups if lookups else 0.0
+    counts["size"] = configured_size()
+    return counts
+
+
+class StatementCache:
+    # Only used by the thread that has the connection checked out, so no lock of its own
+    def __init__(self, raw, maxsize):
+        self.raw = raw
+        self.maxsize = maxsize
+        # (sql, dictionary) -> prepared cursor, least recently used first
+        self._cursors = OrderedDict()
+
+    # Returns (cursor, cached). A cursor that is not cached belongs to the caller, who closes it.
+    def get(self, sql, dictionary):
+        if self.maxsize <= 0:
+            _count(misses=1)
+            return self.raw.cursor(prepared=True, dictionary=dictionary), False
+        key = (sql, dictionary)
+        cursor = self._cursors.get(key)
+        if cursor is not None:
+            self._cursors.move_to_end(key)
+            _count(hits=1)
+            return cursor, True
+        _count(misses=1)
+        while len(self._cursors) >= self.maxsize:
+            _, evicted = self._cursors.popitem(last=False)
+            _count(evictions=1)
+            _close(evicted)
+        cursor = self.raw.cursor(prepared=True, dictionary=dictionary)
+        self._cursors[key] = cursor
+        return cursor, True
+
+    # Drops a statement that failed, the next execute prepares it afresh
+    def discard(self, sql, dictionary):
+        cursor = self._cursors.pop((sql, dictionary), None)
+        if cursor is not None:
+            _close(cursor)
+
+    def __len__(self):
+        return len(self._cursors)
+
+    def close(self):
+        cursors = list(self._cursors.values())
+        self._cursors.clear()
+        for cursor in cursors:
+            _close(cursor)
+
+
+def _close(cursor):
+    try:
+        cursor.close()
+    except Exception:
+        pass
+
+
+class StatementCursor:
+    # Stands in for conn.cursor(prepared=True): execute() runs on the cached cursor for the SQL, the
+    # fetch methods, rowcount and lastrowid read from whichever cursor ran last.
+    def __init__(self, cache, dictionary=False):
+        self._cache = cache
+        self._dictionary = dictionary
+        self._cursor = None
+        self._owned = []
+
+    def __getattr__(self, name):
+        cursor = self.__dict__.get('_cursor')
+        if cursor is None:
+            raise AttributeError(f"No statement has been executed yet (accessing '{name}')")
+        return getattr(cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, sql, params=()):
+        cursor, cached = self._cache.get(sql, self._dictionary)
+        if not cached:
+            self._owned.append(cursor)
+        self._cursor = cursor
+        try:
+            return cursor.execute(sql, params)
+        except Exception:
+            if cached:
+                self._cache.discard(sql, self._dictionary)
+                self._cursor = None
+            raise
+
+    # Leaves the cached statements prepared, but reads any rows the caller did not fetch, since the
+    # connection cannot run anything else until they are gone
+    def close(self):
+        if self._cursor is not None and getattr(self._cache.raw, 'unread_result', False):
+            try:
+                self._cursor.fetchall()
+            except Exception:
+                self._cache.close()
+        self._cursor = None
+        owned, self._owned = self._owned, []
+        for cursor in owned:
+            _close(cursor)
@@ -0,0 +1,48 @@
+import os
+import threading
+# (local module)
+from cache import TTLCache
+
+# Process-wide cache of user profiles (UserID, Username, Email, Role, RegistrationTimestamp) by UserID.
+# Nearly every authenticated request needs the caller's role or name, and those almost never change,
+# so db_queries.get_user_profile_by_id and get_user_role read through this cache.
+#
+# Anything that changes a user row must call invalidate_user() (db_queries.update_user_role does).
+# That only reaches the current process: other workers keep their copy for at most USER_CACHE_TTL
+# seconds (default 60, 0 disables the cache). USER_CACHE_SIZE caps the number of users kept.
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def _ttl():
+    return int(os.getenv('USER_CACHE_TTL', 60))
+
+def enabled():
+    return _ttl() > 0
+
+def _get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = TTLCache(maxsize=int(os.getenv('USER_CACHE_SIZE', 10000)), ttl=_ttl())
+        return _cache
+
+# Returns a copy, so callers may modify it
+def get_user(user_id):
+    if not enabled():
+        return None
+    user = _get_cache().get(user_id)
+    return dict(user) if user is not None else None
+
+def set_user(user):
+    if enabled():
+        _get_cache().set(user['UserID'], dict(user))
+
+def invalidate_user(user_id):
+    if enabled():
+        _get_cache().delete(user_id)
+
+def stats():
+    if not enabled():
+        return {"enabled": False}
+    return dict(_get_cache().stats(), enabled=True)
@@ -0,0 +1,262 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+# (local modules)
+import db_queries
+import replicas
+
+# In-process index of who has voted on what, as a Bloom filter over (kind, user, post) with kind
+# "poll" (PollVotes) or "item" (ItemVotes). A Bloom filter can say "maybe" for a vote that was never
+# cast (at most VOTE_INDEX_ERROR_RATE of the time, default 1%) but never "no" for one it was told
+# about, so:
+#   - cast_vote and cast_item_vote only look for an earlier vote in the database when the index
+#     says maybe, and answer those duplicates with a 409 before attempting the insert,
+#   - the feed only asks PollVotes/ItemVotes about the posts on the page the index says maybe for,
+#     which for most pages is none or a few.
+#
+# Each worker warms its own index from the vote tables when it starts, in the background (answering
+# "maybe" for everything until it is done), then adds the votes it writes itself. Votes cast through
+# other workers are read in every VOTE_INDEX_REFRESH seconds (default 1) by VoteID. A vote with a lower
+# VoteID can commit after one with a higher one (a write-behind batch is one transaction of up to
+# VOTE_BATCH_SIZE votes), so every VoteID skipped over is kept as a gap and looked up again on each
+# refresh until its vote turns up, or for VOTE_INDEX_GAP_SECONDS (default 60), after which it is taken
+# to be a rolled back or failed insert. At most VOTE_INDEX_MAX_GAPS (default 10000) of the newest gaps
+# per table are kept. Until a late vote is read the index can say "no" for it: the unique keys still
+# stop the duplicate, and a user who has just voted elsewhere is pinned to the database
+# (replicas.pinned()).
+#
+# The filter grows by adding a larger one whenever the current one is full, starting at
+# VOTE_INDEX_CAPACITY votes (default 1,000,000, about 1.4 MB at 1%). Deleted votes stay in it, which
+# only costs the odd extra query. VOTE_INDEX_ENABLED=false turns it off.
+
+KINDS = ('poll', 'item')
+
+# The error rate of the nth filter: error_rate / 2, / 4, / 8... so all of them together stay below error_rate
+def _error_rate(error_rate, n):
+    return error_rate / 2 ** (n + 1)
+
+
+def enabled():
+    return os.getenv('VOTE_INDEX_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        # Optimal bit and hash counts for capacity entries at error_rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    # Double hashing: the k positions are h1 + i * h2, from one 128 bit digest
+    def _positions(self, key):
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+
+class VoteIndex:
+    def __init__(self, capacity=1000000, error_rate=0.01, refresh_interval=1.0, gap_seconds=60.0, max_gaps=10000,
+                 batch_size=10000):
+        self.pid = os.getpid()
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_interval = refresh_interval
+        self.gap_seconds = gap_seconds
+        self.max_gaps = max_gaps
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        # Each new filter is twice the size of the last, see _error_rate
+        self._filters = [BloomFilter(capacity, _error_rate(error_rate, 0))]
+        # Highest VoteID read per kind
+        self._high_water = {kind: 0 for kind in KINDS}
+        # VoteIDs below the high water mark not read yet, per kind: VoteID -> when it was first skipped,
+        # oldest first. Only used by the refreshing thread.
+        self._gaps = {kind: OrderedDict() for kind in KINDS}
+        self._refreshed_at = None
+        self.ready = False
+        self.lookups = 0
+        self.maybes = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    @staticmethod
+    def _key(kind, user_id, post_id):
+        return f"{kind}:{int(user_id)}:{int(post_id)}".encode('ascii')
+
+    def add(self, kind, user_id, post_id):
+        key = self._key(kind, user_id, post_id)
+        with self._lock:
+            if key in self:
+                return
+            current = self._filters[-1]
+            if current.full:
+                current = BloomFilter(current.capacity * 2, _error_rate(self.error_rate, len(self._filters)))
+                self._filters.append(current)
+            current.add(key)
+
+    def __contains__(self, key):
+        return any(key in bloom for bloom in self._filters)
+
+    # False when user_id certainly has no vote of kind on post_id, as far as the index has read
+    def might_have_voted(self, kind, user_id, post_id):
+        self.maybe_refresh()
+        if not self.ready:
+            return True
+        with self._lock:
+            maybe = self._key(kind, user_id, post_id) in self
+            self.lookups += 1
+            if maybe:
+                self.maybes += 1
+        return maybe
+
+    # Remembers the VoteIDs between the high water mark and vote_id, which may still commit
+    def _skip_to(self, kind, vote_id, now):
+        gaps = self._gaps[kind]
+        for gap in range(max(self._high_water[kind] + 1, vote_id - self.max_gaps), vote_id):
+            gaps[gap] = now
+        while len(gaps) > self.max_gaps:
+            gaps.popitem(last=False)
+
+    # Reads votes written since the last refresh, then looks for the ones that were skipped over.
+    # Returns the number of votes read, or None on error.
+    def refresh(self):
+        read = 0
+        for kind in KINDS:
+            gaps = self._gaps[kind]
+            while True:
+                rows = db_queries.get_vote_keys(kind, self._high_water[kind], self.batch_size)
+                if rows is None:
+                    return self._refresh_failed()
+                now = time.monotonic()
+                for vote_id, user_id, post_id in rows:
+                    self._skip_to(kind, vote_id, now)
+                    self.add(kind, user_id, post_id)
+                    self._high_water[kind] = max(self._high_water[kind], vote_id)
+                read += len(rows)
+                if len(rows) < self.batch_size:
+                    break
+
+            expired = time.monotonic() - self.gap_seconds
+            while gaps and next(iter(gaps.values())) < expired:
+                gaps.popitem(last=False)
+            gap_ids = list(gaps)
+            for start in range(0, len(gap_ids), 1000):
+                rows = db_queries.get_vote_keys_by_id(kind, gap_ids[start:start + 1000])
+                if rows is None:
+                    return self._refresh_failed()
+                for vote_id, user_id, post_id in rows:
+                    self.add(kind, user_id, post_id)
+                    gaps.pop(vote_id, None)
+                read += len(rows)
+        with self._lock:
+            self.refreshes += 1
+        return read
+
+    def _refresh_failed(self):
+        with self._lock:
+            self.refresh_errors += 1
+        return None
+
+    # Refreshes at most every refresh_interval, in whichever request comes first. Others go on with
+    # the index as it is rather than wait.
+    def maybe_refresh(self):
+        if self._refreshed_at is not None and time.monotonic() - self._refreshed_at < self.refresh_interval:
+            return
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            if self._refreshed_at is None or time.monotonic() - self._refreshed_at >= self.refresh_interval:
+                if self.refresh() is not None:
+                    self.ready = True
+                self._refreshed_at = time.monotonic()
+        finally:
+            self._refresh_lock.release()
+
+    def warm(self):
+        started = time.perf_counter()
+        self.maybe_refresh()
+        if self.ready:
+            print(f"Vote index warmed with {self.stats()['votes']} votes in {time.perf_counter() - started:.1f} s")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "votes": sum(bloom.count for bloom in self._filters),
+                "filters": len(self._filters),
+                "bytes": sum(len(bloom._bits) for bloom in self._filters),
+                "high_water": dict(self._high_water),
+                "gaps": {kind: len(gaps) for kind, gaps in self._gaps.items()},
+                "lookups": self.lookups,
+                "maybe_rate": self.maybes / self.lookups if self.lookups else 0.0,
+                "refreshes": self.refreshes,
+                "refresh_errors": self.refresh_errors,
+            }
+
+
+_index = None
+_index_lock = threading.Lock()
+
+# One index per worker process, warmed in the background from the first call (after fork)
+def get_index():
+    global _index
+    with _index_lock:
+        if _index is None or _index.pid != os.getpid():
+            _index = VoteIndex(
+                capacity=int(os.getenv('VOTE_INDEX_CAPACITY', 1000000)),
+                error_rate=float(os.getenv('VOTE_INDEX_ERROR_RATE', 0.01)),
+                refresh_interval=float(os.getenv('VOTE_INDEX_REFRESH', 1)),
+                gap_seconds=float(os.getenv('VOTE_INDEX_GAP_SECONDS', 60)),
+                max_gaps=int(os.getenv('VOTE_INDEX_MAX_GAPS', 10000)),
+            )
+            threading.Thread(target=_index.warm, name="vote-index-warm", daemon=True).start()
+        return _index
+
+# True once the index is on and warmed, so that its "no" can be trusted
+def ready():
+    if not enabled():
+        return False
+    index = get_index()
+    index.maybe_refresh()
+    return index.ready
+
+def might_have_voted(kind, user_id, post_id):
+    if not enabled():
+        return True
+    return get_index().might_have_voted(kind, user_id, post_id)
+
+# For get_feed_posts: might_have_voted, or None when every post has to be checked in the database
+# (index off or still warming, or the current user wrote recently and may have voted elsewhere)
+def feed_filter():
+    if replicas.pinned() or not ready():
+        return None
+    return might_have_voted
+
+# Called once a vote is committed
+def record(kind, user_id, post_id):
+    if enabled():
+        get_index().add(kind, user_id, post_id)
+
+def stats():
+    if not enabled():
+        return {"enabled": False}
+    return dict(get_index().stats(), enabled=True)
@@ -0,0 +1,286 @@
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+from collections import deque
+# (local modules)
+import db_queries
+import vote_index
+
+# Write-behind ingestion for /api/vote and /api/item-votes.
+# Votes are validated and deduplicated synchronously, appended to a local journal (one file per
+# worker process, fsync'd before the client gets its 202) and queued. A background thread writes
+# them in batches with db_queries.apply_vote_batch, which applies one aggregated VoteCount UPDATE
+# per batch instead of one row lock per vote.
+#
+# If a worker dies with votes still queued, the next worker to start finds its journal (the file
+# lock is free again) and replays everything after the last commit marker. Replays are idempotent
+# because apply_vote_batch skips votes that are already in the database.
+#
+# Settings: VOTE_WRITE_BEHIND (enable), VOTE_JOURNAL_DIR, VOTE_BATCH_SIZE, VOTE_FLUSH_INTERVAL (seconds),
+# VOTE_JOURNAL_FSYNC and VOTE_MAX_ATTEMPTS (per vote, before it goes to the dead letter file).
+
+ITEM_VOTE_CHOICES = ('For', 'Against', 'Abstain')
+
+
+def enabled():
+    return os.getenv('VOTE_WRITE_BEHIND', 'false').lower() in ('1', 'true', 'yes')
+
+
+class VoteJournal:
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.fsync = fsync
+        self._file = open(path, 'a+', encoding='utf-8')
+        # Held for the life of the process, so other workers know this journal is not orphaned
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _write(self, record):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def append(self, record):
+        self._write(record)
+
+    def mark_committed(self, seq):
+        self._write({"committed": seq})
+
+    # Drops everything once all journalled votes are committed, so the file does not grow forever
+    def truncate(self):
+        self._file.truncate(0)
+        self._file.flush()
+
+    # Returns the vote records written after the last commit marker
+    @staticmethod
+    def read_uncommitted(file):
+        file.seek(0)
+        records = []
+        committed = 0
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A torn final write from a crash, the client never got a 202 for it
+                continue
+            if "committed" in record:
+                committed = max(committed, record["committed"])
+            else:
+                records.append(record)
+        return [record for record in records if record["seq"] > committed]
+
+
+class VoteQueue:
+    def __init__(self, journal_dir, batch_size=500, flush_interval=0.2, fsync=True, max_attempts=5):
+        self.pid = os.getpid()
+        self.journal_dir = journal_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        os.makedirs(journal_dir, exist_ok=True)
+        self.journal = VoteJournal(os.path.join(journal_dir, f"votes-{self.pid}.jsonl"), fsync=fsync)
+
+        self._lock = threading.Condition()
+        self._queue = deque()
+        self._seq = 0
+        # (kind, user_id, post_id) -> seq of votes accepted but not yet written, for synchronous dedupe
+        self._pending = {}
+
+        self.accepted = 0
+        self.written = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.dead_lettered = 0
+
+        self._replay_orphaned_journals()
+        self._worker = threading.Thread(target=self._run, name="vote-queue", daemon=True)
+        self._worker.start()
+
+    # Returns "queued", "duplicate", "invalid" or "error"
+    def submit_poll_vote(self, user_id, post_id, option_id):
+        status = db_queries.check_poll_vote(user_id, post_id, option_id)
+        if status is None:
+            return "error"
+        if status != "ok":
+            return status
+        return self._enqueue({"kind": "poll", "user_id": user_id, "post_id": post_id, "option_id": option_id})
+
+    def submit_item_vote(self, user_id, post_id, choice):
+        if choice not in ITEM_VOTE_CHOICES:
+            return "invalid"
+        state = db_queries.get_vote_item_state(user_id, post_id)
+        if state is None:
+            return "error"
+        if state == "not_found":
+            return "invalid"
+        post_type, has_voted = state
+        if post_type != 'VoteItem':
+            return "invalid"
+        if has_voted:
+            return "duplicate"
+        return self._enqueue({"kind": "item", "user_id": user_id, "post_id": post_id, "choice": choice})
+
+    def _enqueue(self, record):
+        key = (record["kind"], record["user_id"], record["post_id"])
+        with self._lock:
+            if key in self._pending:
+                return "duplicate"
+            self._seq += 1
+            record["seq"] = self._seq
+            try:
+                self.journal.append(record)
+            except OSError as e:
+                print(f"Error writing vote journal: {e}")
+                return "error"
+            record["attempts"] = 0
+            self._pending[key] = record["seq"]
+            self._queue.append(record)
+            self.accepted += 1
+            self._lock.notify()
+        return "queued"
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._queue:
+                    self._lock.wait()
+            # Give concurrent voters a moment to join this batch
+            time.sleep(self.flush_interval)
+            with self._lock:
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                # Anything but a database error (those are handled in _write_batch) would otherwise end
+                # this thread silently while votes kept being accepted. Put back what is not written yet.
+                print(f"Error writing vote batch, retrying it: {e!r}")
+                with self._lock:
+                    unwritten = [record for record in batch
+                                 if self._pending.get((record["kind"], record["user_id"], record["post_id"])) == record["seq"]]
+                    self._queue.extendleft(reversed(unwritten))
+                time.sleep(1)
+
+    def _write_batch(self, batch):
+        if self._apply(batch):
+            self._finish(batch)
+            return
+
+        self.failed_batches += 1
+        # One bad vote (e.g. its post was deleted) must not hold up the rest, so retry one by one
+        retry = []
+        for record in batch:
+            if len(batch) > 1 and self._apply([record]):
+                self._finish([record])
+                continue
+            record["attempts"] += 1
+            if record["attempts"] >= self.max_attempts:
+                self._dead_letter(record)
+                self._finish([record])
+            else:
+                retry.append(record)
+        if retry:
+            # Probably the database is down, back off before trying again
+            time.sleep(min(2 ** max(record["attempts"] for record in retry), 30))
+            with self._lock:
+                self._queue.extendleft(reversed(retry))
+
+    def _apply(self, batch):
+        poll_votes = [(r["user_id"], r["post_id"], r["option_id"]) for r in batch if r["kind"] == "poll"]
+        item_votes = [(r["user_id"], r["post_id"], r["choice"]) for r in batch if r["kind"] == "item"]
+        result = db_queries.apply_vote_batch(poll_votes, item_votes)
+        if result is None:
+            return False
+        for record in batch:
+            vote_index.record(record["kind"], record["user_id"], record["post_id"])
+        return True
+
+    def _finish(self, batch):
+        with self._lock:
+            for record in batch:
+                self._pending.pop((record["kind"], record["user_id"], record["post_id"]), None)
+            self.written += len(batch)
+            self.batches += 1
+            try:
+                if not self._pending:
+                    self.journal.truncate()
+                else:
+                    # Votes can finish out of order after a retry, so everything before the oldest
+                    # vote still pending is committed
+                    self.journal.mark_committed(min(self._pending.values()) - 1)
+            except OSError as e:
+                print(f"Error writing vote journal: {e}")
+
+    def _dead_letter(self, record):
+        print(f"Giving up on vote after {record['attempts']} attempts: {record}")
+        self.dead_lettered += 1
+        with open(os.path.join(self.journal_dir, "dead-letter.jsonl"), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + "\n")
+
+    # Journals left behind by worker processes that have exited
+    def _replay_orphaned_journals(self):
+        for path in glob.glob(os.path.join(self.journal_dir, "votes-*.jsonl")):
+            if path == self.journal.path:
+                continue
+            try:
+                file = open(path, 'r+', encoding='utf-8')
+            except OSError:
+                continue
+            try:
+                try:
+                    fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    # Still owned by a live worker
+                    continue
+                records = VoteJournal.read_uncommitted(file)
+                if records:
+                    print(f"Replaying {len(records)} vote(s) from {path}")
+                    for start in range(0, len(records), self.batch_size):
+                        chunk = records[start:start + self.batch_size]
+                        for record in chunk:
+                            record["attempts"] = 0
+                        if not self._apply(chunk):
+                            # Leave the journal in place for the next worker to try
+                            print(f"Could not replay {path}, leaving it for later")
+                            break
+                    else:
+                        os.remove(path)
+                else:
+                    os.remove(path)
+            finally:
+                file.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued": len(self._queue),
+                "pending": len(self._pending),
+                "accepted": self.accepted,
+                "written": self.written,
+                "batches": self.batches,
+                "failed_batches": self.failed_batches,
+                "dead_lettered": self.dead_lettered,
+            }
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+# One queue per worker process, started on first use (after fork)
+def get_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None or _queue.pid != os.getpid():
+            _queue = VoteQueue(
+                os.getenv('VOTE_JOURNAL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vote_journal')),
+                batch_size=int(os.getenv('VOTE_BATCH_SIZE', 500)),
+                flush_interval=float(os.getenv('VOTE_FLUSH_INTERVAL', 0.2)),
+                fsync=os.getenv('VOTE_JOURNAL_FSYNC', 'true').lower() in ('1', 'true', 'yes'),
+                max_attempts=int(os.getenv('VOTE_MAX_ATTEMPTS', 5)),
+            )
+        return _queue
@@ -0,0 +1,23 @@
+import datetime
+
+import pytest
+
+from cursors import decode_cursor, decode_score_cursor, encode_cursor, encode_score_cursor
+
+
+def test_cursor_round_trip():
+    timestamp = datetime.datetime(2026, 3, 1, 12, 30, 5, 123456)
+    assert decode_cursor(encode_cursor(timestamp, 42)) == (timestamp, 42)
+
+
+def test_score_cursor_keeps_every_digit():
+    score = 0.1 + 0.2
+    assert decode_score_cursor(encode_score_cursor(score, 7)) == (score, 7)
+
+
+@pytest.mark.parametrize("cursor", ["", "not base64!", "bm8tc2VwYXJhdG9y", "MjAyNi0wMS0wMXx4"])
+def test_malformed_cursors_raise_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+    with pytest.raises(ValueError):
+        decode_score_cursor(cursor)
@@ -0,0 +1,43 @@
+import asyncio
+import threading
+
+import events
+
+
+def test_async_subscription_gets_events_published_from_other_threads():
+    async def scenario():
+        broker = events.Broker(max_buffer=10)
+        subscription = broker.subscribe(asyncio.get_running_loop())
+        publisher = threading.Thread(target=broker.publish, args=("new_post", {"PostID": 1}))
+        publisher.start()
+        event = await subscription.get(5)
+        publisher.join()
+        return event
+
+    assert asyncio.run(scenario()) == ("new_post", {"PostID": 1})
+
+
+def test_async_subscription_times_out_for_a_heartbeat():
+    async def scenario():
+        subscription = events.Broker(max_buffer=10).subscribe(asyncio.get_running_loop())
+        return await subscription.get(0.01)
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_async_subscription_overflow_asks_for_resync():
+    async def scenario():
+        broker = events.Broker(max_buffer=2)
+        subscription = broker.subscribe(asyncio.get_running_loop())
+        for post_id in range(3):
+            broker.publish("new_post", {"PostID": post_id})
+        # Let the loop run the handed over puts
+        await asyncio.sleep(0)
+        return await subscription.get(1), await subscription.get(0.01)
+
+    assert asyncio.run(scenario()) == (events.RESYNC, None)
+
+
+def test_sse_message():
+    assert events.sse_message(("comment_count", {"PostID": 7, "CommentCount": 2})) == \
+        'event: comment_count\ndata: {"PostID": 7, "CommentCount": 2}\n\n'
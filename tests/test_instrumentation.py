@@ -0,0 +1,34 @@
+import types
+
+import instrumentation
+
+
+def make_module():
+    module = types.ModuleType("fake_queries")
+    exec(
+        "def get_db_connection():\n"
+        "    return None\n"
+        "def find_user(user_id):\n"
+        "    conn = get_db_connection()\n"
+        "    return user_id\n"
+        "def archive_reads():\n"
+        "    return False\n"
+        "def stream_votes():\n"
+        "    conn = _connect()\n"
+        "    yield conn\n"
+        "def _connect():\n"
+        "    return None\n",
+        module.__dict__,
+    )
+    return module
+
+
+def test_only_functions_that_check_out_a_connection_are_wrapped():
+    module = make_module()
+    instrumentation.instrument_module(module)
+
+    assert getattr(module.get_db_connection, '__instrumented__', False)
+    assert getattr(module.find_user, '__instrumented__', False)
+    assert not getattr(module.archive_reads, '__instrumented__', False)
+    assert not getattr(module.stream_votes, '__instrumented__', False)
+    assert module.find_user(3) == 3
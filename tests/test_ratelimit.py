@@ -0,0 +1,71 @@
+import pytest
+
+import ratelimit
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, 'monotonic', clock)
+    return clock
+
+
+def test_parse_budget():
+    assert ratelimit.parse_budget("30/60") == (0.5, 30)
+
+
+def test_bucket_allows_a_burst_then_refills(clock):
+    buckets = ratelimit.TokenBuckets()
+    rate, burst = ratelimit.parse_budget("3/60")
+    assert [buckets.acquire("k", rate, burst)[0] for _ in range(3)] == [True, True, True]
+
+    allowed, wait = buckets.acquire("k", rate, burst)
+    assert not allowed
+    assert wait == pytest.approx(20)
+
+    clock.now += 20
+    assert buckets.acquire("k", rate, burst)[0]
+    assert not buckets.acquire("k", rate, burst)[0]
+
+
+def test_buckets_are_per_key(clock):
+    buckets = ratelimit.TokenBuckets()
+    assert buckets.acquire("a", 1, 1)[0]
+    assert not buckets.acquire("a", 1, 1)[0]
+    assert buckets.acquire("b", 1, 1)[0]
+
+
+def test_idle_buckets_are_dropped_first(clock):
+    buckets = ratelimit.TokenBuckets(max_keys=2)
+    for key in ("a", "b", "c"):
+        buckets.acquire(key, 1, 1)
+    assert list(buckets._buckets) == ["b", "c"]
+
+
+def test_check_returns_whole_seconds_to_retry_after(clock, monkeypatch):
+    monkeypatch.setattr(ratelimit, '_buckets', ratelimit.TokenBuckets())
+    monkeypatch.delenv('RATE_LIMIT_BY_IP', raising=False)
+    monkeypatch.delenv('TRUSTED_PROXY_HOPS', raising=False)
+    assert ratelimit.check("test", 1, "10.0.0.1", "1/90", "100/60") is None
+    assert ratelimit.check("test", 1, "10.0.0.1", "1/90", "100/60") == 90
+    # Under a second still asks for one
+    clock.now += 89.5
+    assert ratelimit.check("test", 1, "10.0.0.1", "1/90", "100/60") == 1
+
+
+def test_ip_scope_needs_trusted_proxies_or_an_explicit_setting(monkeypatch):
+    monkeypatch.delenv('TRUSTED_PROXY_HOPS', raising=False)
+    monkeypatch.delenv('RATE_LIMIT_BY_IP', raising=False)
+    assert not ratelimit.ip_scope_enabled()
+    monkeypatch.setenv('TRUSTED_PROXY_HOPS', '1')
+    assert ratelimit.ip_scope_enabled()
+    monkeypatch.setenv('RATE_LIMIT_BY_IP', 'false')
+    assert not ratelimit.ip_scope_enabled()
@@ -0,0 +1,89 @@
+import pytest
+
+from statements import StatementCache, StatementCursor
+
+
+class FakeCursor:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.closed = False
+        self.executed = []
+
+    def execute(self, sql, params=()):
+        if self.fail:
+            raise RuntimeError("statement failed")
+        self.executed.append((sql, params))
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    unread_result = False
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.cursors = []
+
+    def cursor(self, prepared=False, dictionary=False):
+        cursor = FakeCursor(self.fail)
+        self.cursors.append(cursor)
+        return cursor
+
+
+def test_hits_reuse_the_prepared_cursor():
+    cache = StatementCache(FakeConnection(), 4)
+    first, cached = cache.get("SELECT 1", False)
+    again, _ = cache.get("SELECT 1", False)
+    assert cached and again is first
+    # Plain and dictionary cursors are separate statements
+    assert cache.get("SELECT 1", True)[0] is not first
+    assert len(cache) == 2
+
+
+def test_least_recently_used_statement_is_deallocated():
+    cache = StatementCache(FakeConnection(), 2)
+    a, _ = cache.get("a", False)
+    b, _ = cache.get("b", False)
+    cache.get("a", False)
+    cache.get("c", False)
+    assert b.closed and not a.closed
+    assert cache.get("a", False)[0] is a
+
+
+def test_discard_and_close():
+    cache = StatementCache(FakeConnection(), 4)
+    a, _ = cache.get("a", False)
+    cache.discard("a", False)
+    assert a.closed and len(cache) == 0
+    assert cache.get("a", False)[0] is not a
+
+    b, _ = cache.get("b", False)
+    cache.close()
+    assert b.closed and len(cache) == 0
+
+
+def test_size_zero_hands_out_uncached_cursors():
+    cache = StatementCache(FakeConnection(), 0)
+    cursor, cached = cache.get("a", False)
+    assert not cached and len(cache) == 0
+
+
+def test_statement_cursor_leaves_cached_statements_open():
+    cache = StatementCache(FakeConnection(), 4)
+    cursor = StatementCursor(cache)
+    cursor.execute("SELECT %s", (1,))
+    cursor.close()
+    prepared, _ = cache.get("SELECT %s", False)
+    assert not prepared.closed and prepared.executed == [("SELECT %s", (1,))]
+
+
+def test_statement_cursor_drops_a_statement_that_failed():
+    cache = StatementCache(FakeConnection(fail=True), 4)
+    cursor = StatementCursor(cache)
+    with pytest.raises(RuntimeError):
+        cursor.execute("SELECT broken")
+    assert len(cache) == 0
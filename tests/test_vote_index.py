@@ -0,0 +1,95 @@
+import pytest
+
+# vote_index reads through db_queries, which needs mysql-connector to import
+pytest.importorskip("mysql.connector")
+
+import db_queries
+import vote_index
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = vote_index.BloomFilter(1000, 0.01)
+    keys = [f"poll:{user}:{post}".encode() for user in range(50) for post in range(20)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    assert bloom.full
+
+
+def test_bloom_filter_false_positive_rate_is_near_target():
+    bloom = vote_index.BloomFilter(1000, 0.01)
+    for i in range(1000):
+        bloom.add(f"in:{i}".encode())
+    false_positives = sum(f"out:{i}".encode() in bloom for i in range(10000))
+    assert false_positives / 10000 < 0.03
+
+
+def test_index_grows_a_new_filter_when_full():
+    index = vote_index.VoteIndex(capacity=10, error_rate=0.01)
+    for post_id in range(100):
+        index.add('poll', 1, post_id)
+    assert len(index._filters) > 1
+    # Each new filter doubles in size
+    assert index._filters[1].capacity == 20
+    assert all(index._key('poll', 1, post_id) in index for post_id in range(100))
+
+
+def test_index_answers_maybe_until_warmed_then_reads_votes(monkeypatch):
+    votes = {'poll': [(1, 7, 100), (2, 8, 100)], 'item': [(1, 7, 200)]}
+    monkeypatch.setattr(db_queries, 'get_vote_keys',
+                        lambda kind, after, limit: [row for row in votes[kind] if row[0] > after][:limit])
+    index = vote_index.VoteIndex(capacity=100, refresh_interval=3600)
+    assert not index.ready
+    index.warm()
+    assert index.ready
+    assert index.stats()["high_water"] == {'poll': 2, 'item': 1}
+    assert index.might_have_voted('poll', 7, 100)
+    assert index.might_have_voted('item', 7, 200)
+    assert not index.might_have_voted('item', 8, 100)
+
+
+def test_failed_refresh_leaves_the_index_unready(monkeypatch):
+    monkeypatch.setattr(db_queries, 'get_vote_keys', lambda kind, after, limit: None)
+    index = vote_index.VoteIndex(capacity=100)
+    index.warm()
+    assert not index.ready
+    assert index.might_have_voted('poll', 1, 1)
+    assert index.stats()["refresh_errors"] == 1
+
+
+def test_disabled_index_is_never_ready(monkeypatch):
+    monkeypatch.setenv('VOTE_INDEX_ENABLED', 'false')
+    assert not vote_index.ready()
+    assert vote_index.might_have_voted('poll', 1, 1)
+
+
+def test_votes_committed_late_are_read_from_the_gaps(monkeypatch):
+    table = {'poll': [(1, 7, 100), (3, 9, 100)], 'item': []}
+    monkeypatch.setattr(db_queries, 'get_vote_keys',
+                        lambda kind, after, limit: [row for row in table[kind] if row[0] > after][:limit])
+    monkeypatch.setattr(db_queries, 'get_vote_keys_by_id',
+                        lambda kind, vote_ids: [row for row in table[kind] if row[0] in vote_ids])
+    index = vote_index.VoteIndex(capacity=100, refresh_interval=0)
+    index.warm()
+    assert index.stats()["gaps"]["poll"] == 1
+
+    # VoteID 2 commits after 3 was read, and after far more than a batch of later votes
+    table['poll'] += [(vote_id, 1, vote_id) for vote_id in range(4, 3000)]
+    index.refresh()
+    table['poll'].append((2, 8, 100))
+    index.refresh()
+    assert index.might_have_voted('poll', 8, 100)
+    assert index.stats()["gaps"]["poll"] == 0
+
+
+def test_gaps_are_given_up_after_gap_seconds(monkeypatch):
+    monkeypatch.setattr(db_queries, 'get_vote_keys',
+                        lambda kind, after, limit: [(5, 1, 1)] if kind == 'poll' and after < 5 else [])
+    monkeypatch.setattr(db_queries, 'get_vote_keys_by_id', lambda kind, vote_ids: [])
+    index = vote_index.VoteIndex(capacity=100, gap_seconds=60, max_gaps=2)
+    index.refresh()
+    # Only the newest max_gaps are kept
+    assert list(index._gaps['poll']) == [3, 4]
+    index.gap_seconds = 0
+    index.refresh()
+    assert index.stats()["gaps"]["poll"] == 0
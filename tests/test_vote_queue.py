@@ -0,0 +1,84 @@
+import io
+import json
+import time
+
+import pytest
+
+# vote_queue writes through db_queries, which needs mysql-connector to import
+pytest.importorskip("mysql.connector")
+
+import db_queries
+import vote_queue
+
+
+@pytest.fixture(autouse=True)
+def no_vote_index(monkeypatch):
+    monkeypatch.setenv('VOTE_INDEX_ENABLED', 'false')
+
+
+def journal_lines(*records):
+    return "".join(json.dumps(record) + "\n" for record in records)
+
+
+def poll_vote(seq, user_id=1, post_id=10):
+    return {"kind": "poll", "user_id": user_id, "post_id": post_id, "option_id": 5, "seq": seq}
+
+
+def test_read_uncommitted_skips_committed_and_torn_records():
+    file = io.StringIO(
+        journal_lines(poll_vote(1), poll_vote(2, user_id=2), {"committed": 1}, poll_vote(3, user_id=3))
+        + '{"kind": "poll", "user_'
+    )
+    assert [record["seq"] for record in vote_queue.VoteJournal.read_uncommitted(file)] == [2, 3]
+
+
+def test_read_uncommitted_uses_the_highest_marker():
+    file = io.StringIO(journal_lines(poll_vote(1), poll_vote(2, user_id=2), {"committed": 2}, {"committed": 1}))
+    assert vote_queue.VoteJournal.read_uncommitted(file) == []
+
+
+def test_orphaned_journal_is_replayed_and_removed(tmp_path, monkeypatch):
+    applied = []
+    monkeypatch.setattr(db_queries, 'apply_vote_batch', lambda polls, items: applied.append((polls, items)) or {})
+    orphan = tmp_path / "votes-1.jsonl"
+    orphan.write_text(journal_lines(
+        poll_vote(1),
+        {"committed": 1},
+        poll_vote(2, user_id=2),
+        {"kind": "item", "user_id": 3, "post_id": 11, "choice": "For", "seq": 3},
+    ))
+
+    vote_queue.VoteQueue(str(tmp_path), fsync=False)
+
+    assert applied == [([(2, 10, 5)], [(3, 11, "For")])]
+    assert not orphan.exists()
+
+
+def test_orphaned_journal_is_kept_when_replay_fails(tmp_path, monkeypatch):
+    monkeypatch.setattr(db_queries, 'apply_vote_batch', lambda polls, items: None)
+    orphan = tmp_path / "votes-1.jsonl"
+    orphan.write_text(journal_lines(poll_vote(1)))
+
+    vote_queue.VoteQueue(str(tmp_path), fsync=False)
+
+    assert orphan.exists()
+
+
+def test_writer_survives_an_unexpected_error(tmp_path, monkeypatch):
+    calls = []
+
+    def apply_vote_batch(polls, items):
+        calls.append(polls)
+        if len(calls) == 1:
+            raise RuntimeError("unexpected")
+        return {}
+
+    monkeypatch.setattr(db_queries, 'apply_vote_batch', apply_vote_batch)
+    queue = vote_queue.VoteQueue(str(tmp_path), flush_interval=0, fsync=False)
+    assert queue._enqueue({"kind": "poll", "user_id": 1, "post_id": 10, "option_id": 5}) == "queued"
+
+    deadline = time.monotonic() + 5
+    while queue.stats()["written"] < 1 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert queue.stats()["written"] == 1
+    assert calls == [[(1, 10, 5)], [(1, 10, 5)]]